@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import UserProfile, Categoria, Gasto, FondoComun, IngresoFondo, GastoRecurrente, ObjetivoAhorro
+from .models import UserProfile, Categoria, Gasto, FondoComun, IngresoFondo, GastoRecurrente, ObjetivoAhorro, Liquidacion, ResumenMensual
+from .models import MovimientoFondo, CierreFondo
 
 
 """
@@ -15,7 +16,12 @@ aportaciones.
 admin.site.register(UserProfile)
 admin.site.register(Categoria)
 admin.site.register(Gasto)
-admin.site.register(FondoComun)
+@admin.register(FondoComun)
+class FondoComunAdmin(admin.ModelAdmin):
+    # El saldo solo cambia mediante movimientos (ver ``core.fondos``)
+    list_display = ('tipo', 'saldo', 'ultima_actualizacion')
+    readonly_fields = ('saldo',)
+
 admin.site.register(IngresoFondo)
 @admin.register(GastoRecurrente)
 class GastoRecurrenteAdmin(admin.ModelAdmin):
@@ -24,3 +30,49 @@ class GastoRecurrenteAdmin(admin.ModelAdmin):
 @admin.register(ObjetivoAhorro)
 class ObjetivoAhorroAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'monto_objetivo', 'aporte_mensual', 'fondo_destino', 'activo')
+
+@admin.register(Liquidacion)
+class LiquidacionAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'pagado_por', 'cantidad', 'saldo')
+    readonly_fields = ('saldo',)
+
+@admin.register(ResumenMensual)
+class ResumenMensualAdmin(admin.ModelAdmin):
+    # Tabla derivada: se mantiene con señales y ``reconstruir_resumen``
+    list_display = ('ano', 'mes', 'categoria', 'fondo', 'pagado_por', 'total', 'numero')
+    list_filter = ('ano', 'mes')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MovimientoFondo)
+class MovimientoFondoAdmin(admin.ModelAdmin):
+    # Los movimientos son inmutables: solo se consultan
+    list_display = ('fecha', 'fondo', 'tipo', 'importe', 'descripcion')
+    list_filter = ('fondo', 'tipo')
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CierreFondo)
+class CierreFondoAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'fondo', 'saldo')
+    list_filter = ('fondo',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -6,3 +6,4 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import core.templatetags.custom_filters
+        import core.versiones  # receptores de request_started/request_finished
@@ -0,0 +1,136 @@
+"""
+Cálculo del balance de deuda entre las dos personas.
+
+El balance se obtiene directamente en la base de datos mediante una única
+agregación condicional sobre ``Gasto``: se suman por separado los importes
+pagados por la persona actual y por la otra, descartando los gastos
+vinculados a un fondo común (esos salen de la cuenta conjunta y no generan
+deuda). El reparto proporcional se aplica después sobre las dos sumas, lo
+que da exactamente el mismo resultado que multiplicar gasto a gasto.
+
+Para que el coste no crezca con la antigüedad del historial se usan
+liquidaciones (``Liquidacion``) como puntos de control: cada una guarda el
+balance acumulado hasta su fecha, de modo que el balance actual se obtiene
+sumando el de la última liquidación y la agregación de los gastos
+posteriores. Los balances de las liquidaciones se expresan siempre desde el
+punto de vista de Sara (positivo: Adri le debe dinero a Sara).
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Case, Q, Sum, When
+
+from .models import Gasto, Liquidacion
+
+# Porcentajes de aportación fijos por usuaria
+PORCENTAJE_SARA = Decimal('0.63')
+PORCENTAJE_ADRI = Decimal('0.37')
+
+
+def calcular_deuda(gastos, usuario, mi_porcentaje, otro_porcentaje):
+    """Devuelve el balance de ``usuario`` para el queryset ``gastos``.
+
+    Un valor positivo significa que la otra persona le debe dinero a
+    ``usuario``; uno negativo, que ``usuario`` debe a la otra persona. Solo
+    se lanza una consulta, independientemente del número de gastos.
+    """
+    sin_fondo = Q(fondo__isnull=True)
+    totales = gastos.order_by().aggregate(
+        pagado_por_mi=Sum(Case(When(sin_fondo & Q(pagado_por=usuario), then='monto_total'))),
+        pagado_por_otro=Sum(Case(When(sin_fondo & ~Q(pagado_por=usuario), then='monto_total'))),
+    )
+    # SQLite suma los decimales como coma flotante: redondeamos a céntimos
+    # para recuperar el valor exacto (en PostgreSQL la suma ya es exacta).
+    pagado_por_mi = (totales['pagado_por_mi'] or Decimal('0')).quantize(Decimal('0.01'))
+    pagado_por_otro = (totales['pagado_por_otro'] or Decimal('0')).quantize(Decimal('0.01'))
+    # Lo que yo pagué lo debe la otra persona en su porcentaje y viceversa
+    return pagado_por_mi * otro_porcentaje - pagado_por_otro * mi_porcentaje
+
+
+def _deuda_sara(gastos, sara):
+    """Balance de Sara para ``gastos`` (positivo: Adri le debe a Sara)."""
+    return calcular_deuda(gastos, sara, PORCENTAJE_SARA, PORCENTAJE_ADRI)
+
+
+def _gastos_entre(desde, hasta):
+    """Gastos con fecha en el intervalo ``(desde, hasta]``; ``None`` no acota."""
+    gastos = Gasto.objects.all()
+    if desde is not None:
+        gastos = gastos.filter(fecha__gt=desde)
+    if hasta is not None:
+        gastos = gastos.filter(fecha__lte=hasta)
+    return gastos
+
+
+def calcular_deuda_actual(usuario, sara, mi_porcentaje, otro_porcentaje):
+    """Balance actual de ``usuario`` partiendo de la última liquidación.
+
+    Si no hay liquidaciones se agrega todo el historial (una consulta). Si
+    las hay, se parte del balance tras la última y solo se agregan los
+    gastos posteriores a su fecha.
+    """
+    ultima = Liquidacion.objects.select_related('pagado_por').order_by('-fecha', '-id').first()
+    if ultima is None:
+        return calcular_deuda(Gasto.objects.all(), usuario, mi_porcentaje, otro_porcentaje)
+
+    posteriores = _gastos_entre(ultima.fecha, None)
+    arrastre = ultima.saldo_tras_liquidar()
+    # El arrastre está expresado desde el punto de vista de Sara
+    if usuario != sara:
+        arrastre = -arrastre
+    return arrastre + calcular_deuda(posteriores, usuario, mi_porcentaje, otro_porcentaje)
+
+
+def recalcular_liquidaciones(desde):
+    """Recalcula el balance de las liquidaciones con fecha ``>= desde``.
+
+    Se parte de la liquidación inmediatamente anterior (que no se ve
+    afectada) y se recorren las siguientes en orden, agregando solo los
+    gastos comprendidos entre cada par de liquidaciones consecutivas.
+    """
+    afectadas = list(
+        Liquidacion.objects.select_related('pagado_por').filter(fecha__gte=desde).order_by('fecha', 'id')
+    )
+    if not afectadas:
+        return
+    sara = User.objects.filter(username='sara').first()
+    if sara is None:
+        return
+
+    anterior = (
+        Liquidacion.objects.select_related('pagado_por')
+        .filter(fecha__lt=desde)
+        .order_by('-fecha', '-id')
+        .first()
+    )
+    arrastre = anterior.saldo_tras_liquidar() if anterior else Decimal('0')
+    fecha_anterior = anterior.fecha if anterior else None
+
+    for liquidacion in afectadas:
+        saldo = arrastre + _deuda_sara(_gastos_entre(fecha_anterior, liquidacion.fecha), sara)
+        if saldo != liquidacion.saldo:
+            Liquidacion.objects.filter(pk=liquidacion.pk).update(saldo=saldo)
+            liquidacion.saldo = saldo
+        arrastre = liquidacion.saldo_tras_liquidar()
+        fecha_anterior = liquidacion.fecha
+
+
+def invalidar_por_fechas(*fechas):
+    """Recalcula las liquidaciones afectadas por cambios en ``fechas``.
+
+    Solo hay trabajo que hacer si alguna de las fechas cae en o antes de la
+    última liquidación; los gastos posteriores no forman parte de ningún
+    punto de control.
+    """
+    fechas = [f for f in fechas if f is not None]
+    if not fechas:
+        return
+    ultima_fecha = (
+        Liquidacion.objects.order_by('-fecha').values_list('fecha', flat=True).first()
+    )
+    if ultima_fecha is None:
+        return
+    desde = min(fechas)
+    if desde <= ultima_fecha:
+        recalcular_liquidaciones(desde)
@@ -0,0 +1,207 @@
+"""
+Búsqueda de texto en la descripción de los gastos.
+
+La búsqueda de los listados (parámetro ``q``) no usa ``icontains`` sobre la
+tabla de gastos, que es un ``LIKE '%texto%'`` que la recorre entera, sino
+un índice de texto que depende de la base de datos:
+
+* En SQLite, la tabla virtual FTS5 ``core_gasto_fts`` con la descripción
+  de cada gasto (su ``rowid`` es el id del gasto) y el tokenizador
+  ``trigram``, que encuentra el texto en cualquier parte de la descripción
+  sin distinguir mayúsculas, igual que ``icontains``. La relevancia es
+  ``bm25``. Los textos de menos de tres caracteres no tienen trigramas y se
+  buscan con ``icontains``.
+* En PostgreSQL, un índice GIN de trigramas (``pg_trgm``) sobre
+  ``UPPER(descripcion)``, la expresión que genera ``icontains``, de modo
+  que la misma consulta pasa a usar el índice. La relevancia es
+  ``word_similarity``.
+* Si el índice no existe (SQLite anterior a 3.34 o compilado sin FTS5,
+  PostgreSQL sin permiso para crear la extensión) se recurre a
+  ``icontains``.
+
+Ambos índices se crean en la migración ``0023_indice_busqueda``. La tabla
+FTS5 se mantiene con las señales de ``Gasto`` (ver ``core.models``),
+incluida ``gastos_creados_en_bloque``, y :func:`reconstruir` la rehace
+desde cero, por ejemplo tras restaurar una copia. El índice de trigramas
+lo mantiene PostgreSQL.
+
+:func:`mas_relevantes` ordena los resultados por relevancia y antigüedad:
+la relevancia se normaliza entre 0 y 1 y se le suma un término que vale
+:data:`PESO_RECIENTE` para un gasto de hoy y se reduce a la mitad cada
+:data:`VIDA_MEDIA_DIAS` días.
+"""
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Gasto
+
+TABLA_FTS = 'core_gasto_fts'
+# Gastos candidatos (los más relevantes) que se ordenan por relevancia y
+# fecha; el listado cuenta hasta este mismo número (``core.filtros``)
+LIMITE_CANDIDATOS = 1000
+PESO_RECIENTE = 0.5
+VIDA_MEDIA_DIAS = 180
+# El tokenizador ``trigram`` no encuentra textos más cortos
+LONGITUD_MINIMA_FTS = 3
+# Ids por sentencia al borrar del índice (SQLite limita los parámetros)
+LOTE_BORRADO = 500
+
+
+def _consulta_fts(texto):
+    """Consulta FTS5 que busca ``texto`` entero, o ``None`` si es demasiado corto."""
+    if len(texto) < LONGITUD_MINIMA_FTS:
+        return None
+    return '"{}"'.format(texto.replace('"', '""'))
+
+
+def _con_pagadores(condicion, texto):
+    """Añade a ``condicion`` los gastos de las usuarias cuyo nombre contiene ``texto``.
+
+    La tabla de usuarias es pequeña: se consulta antes para no añadir un
+    ``OR`` a la consulta de gastos (que impide usar un solo índice) cuando
+    ningún nombre coincide, que es lo habitual.
+    """
+    pagadores = list(User.objects.filter(username__icontains=texto).values_list('id', flat=True))
+    return condicion | Q(pagado_por_id__in=pagadores) if pagadores else condicion
+
+
+class MotorBasico:
+    """Sin índice de texto: ``icontains`` y los resultados más recientes."""
+
+    def filtro(self, texto):
+        return _con_pagadores(Q(descripcion__icontains=texto), texto)
+
+    def candidatos(self, gastos, texto, limite):
+        gastos = gastos.filter(descripcion__icontains=texto).order_by('-fecha', '-id')
+        return [(gasto_id, 1.0) for gasto_id in gastos.values_list('id', flat=True)[:limite]]
+
+    def indexar(self, gastos):
+        pass
+
+    def quitar(self, ids):
+        pass
+
+    def reconstruir(self):
+        pass
+
+
+class MotorTrigramas(MotorBasico):
+    """PostgreSQL: ``icontains`` usa el índice de trigramas."""
+
+    def candidatos(self, gastos, texto, limite):
+        relevancia = Func(
+            Value(texto), F('descripcion'), function='word_similarity', output_field=FloatField()
+        )
+        gastos = gastos.filter(descripcion__icontains=texto).annotate(relevancia=relevancia)
+        return list(gastos.order_by('-relevancia', '-fecha').values_list('id', 'relevancia')[:limite])
+
+
+class MotorFTS5(MotorBasico):
+    """SQLite: tabla virtual FTS5 con la descripción de cada gasto."""
+
+    def filtro(self, texto):
+        consulta = _consulta_fts(texto)
+        if consulta is None:
+            return super().filtro(texto)
+        coincidencias = RawSQL(f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s', [consulta])
+        return _con_pagadores(Q(pk__in=coincidencias), texto)
+
+    def candidatos(self, gastos, texto, limite):
+        consulta = _consulta_fts(texto)
+        if consulta is None:
+            return super().candidatos(gastos, texto, limite)
+        # ``EXISTS`` correlacionado y no ``rowid IN (...)``: con ``IN`` SQLite
+        # recorre los ids del subconjunto y consulta FTS5 una vez por cada uno
+        sql, parametros = (
+            gastos.order_by().filter(pk=RawSQL(f'{TABLA_FTS}.rowid', [])).values('pk').query.sql_with_params()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, bm25({TABLA_FTS}) FROM {TABLA_FTS} '
+                f'WHERE {TABLA_FTS} MATCH %s AND EXISTS ({sql}) ORDER BY rank LIMIT %s',
+                [consulta, *parametros, limite],
+            )
+            filas = cursor.fetchall()
+        # ``bm25`` es negativo y menor cuanto más relevante: se normaliza
+        # respecto al mejor resultado
+        mejor = min((puntuacion for _, puntuacion in filas), default=0) or -1
+        return [(gasto_id, puntuacion / mejor) for gasto_id, puntuacion in filas]
+
+    def indexar(self, gastos):
+        filas = [(gasto.pk, gasto.descripcion) for gasto in gastos if gasto.pk]
+        self.quitar([gasto_id for gasto_id, _ in filas])
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {TABLA_FTS} (rowid, descripcion) VALUES (%s, %s)', filas)
+
+    def quitar(self, ids):
+        ids = list(ids)
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(ids), LOTE_BORRADO):
+                lote = ids[inicio:inicio + LOTE_BORRADO]
+                marcadores = ', '.join(['%s'] * len(lote))
+                cursor.execute(f'DELETE FROM {TABLA_FTS} WHERE rowid IN ({marcadores})', lote)
+
+    def reconstruir(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLA_FTS}')
+            cursor.execute(f'INSERT INTO {TABLA_FTS} (rowid, descripcion) SELECT id, descripcion FROM core_gasto')
+
+
+# Motor de cada base de datos, por alias y nombre (los tests usan otra base)
+_motores = {}
+
+
+def motor():
+    """Motor de búsqueda de la base de datos actual."""
+    clave = (connection.alias, str(connection.settings_dict['NAME']))
+    if clave not in _motores:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [TABLA_FTS])
+                _motores[clave] = MotorFTS5() if cursor.fetchone() else MotorBasico()
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'gasto_descripcion_trgm_idx'")
+                _motores[clave] = MotorTrigramas() if cursor.fetchone() else MotorBasico()
+            else:
+                _motores[clave] = MotorBasico()
+    return _motores[clave]
+
+
+def filtro(texto):
+    """Condición sobre ``Gasto``: la descripción o el nombre de quien pagó coinciden con ``texto``."""
+    return motor().filtro(texto)
+
+
+def mas_relevantes(gastos, texto, limite=LIMITE_CANDIDATOS):
+    """Ids de los gastos de ``gastos`` que coinciden con ``texto``, de más a menos relevante.
+
+    Se toman los ``limite`` gastos más relevantes según el índice y se
+    reordenan sumando a su relevancia el peso de su antigüedad.
+    """
+    candidatos = dict(motor().candidatos(gastos, texto, limite))
+    hoy = datetime.date.today()
+    puntuaciones = {
+        gasto_id: candidatos[gasto_id] + PESO_RECIENTE * 0.5 ** (max((hoy - fecha).days, 0) / VIDA_MEDIA_DIAS)
+        for gasto_id, fecha in Gasto.objects.filter(pk__in=candidatos).values_list('id', 'fecha')
+    }
+    return sorted(puntuaciones, key=lambda gasto_id: (-puntuaciones[gasto_id], -gasto_id))
+
+
+def indexar(gastos):
+    """Añade o actualiza ``gastos`` en el índice de búsqueda."""
+    motor().indexar(gastos)
+
+
+def quitar(ids):
+    """Elimina del índice de búsqueda los gastos con esos ids."""
+    motor().quitar(ids)
+
+
+def reconstruir():
+    """Rehace el índice de búsqueda a partir de la tabla de gastos."""
+    motor().reconstruir()
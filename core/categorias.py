@@ -0,0 +1,91 @@
+"""
+Copia en memoria de la tabla ``Categoria``.
+
+Las categorías son pocas y casi nunca cambian, pero se consultan en cada
+vista (selectores de filtro, nombre de cada gasto, resúmenes). En lugar de
+unir ``Categoria`` en cada consulta, cada proceso guarda la tabla completa
+en memoria y las vistas resuelven los nombres a partir de
+``categoria_id``.
+
+Al guardar o borrar una categoría (señales en ``models.py``) se descarta la
+copia local y se cambia la versión de las categorías en la base de datos
+(ver ``core.versiones``); los demás procesos recargan la tabla al ver que
+la versión ha cambiado.
+"""
+
+from . import metricas, versiones
+from .models import Categoria
+
+CLAVE_VERSION = 'categorias'
+
+# Fondo del que salen por defecto los gastos de cada categoría (por código)
+FONDO_POR_CODIGO = {
+    '1': 'SUPERMERCADO',  # Supermercado
+    '3': 'GASTOS',        # Gastos piso
+    '2': 'VIAJES',        # Viajes
+    '6': 'COMPRAS',       # Compras piso
+}
+
+# (versión, {id: Categoria}) cargada por este proceso
+_categorias = None
+
+
+def _tabla():
+    global _categorias
+    version = versiones.leer(CLAVE_VERSION)
+    acierto = _categorias is not None and _categorias[0] == version
+    metricas.registrar_cache('categorias', acierto)
+    if not acierto:
+        _categorias = (version, {categoria.id: categoria for categoria in Categoria.objects.order_by('id')})
+    return _categorias[1]
+
+
+def todas():
+    """Lista de categorías ordenadas por ``id``."""
+    return list(_tabla().values())
+
+
+def por_id(categoria_id):
+    """Categoría con el ``id`` indicado, o ``None``."""
+    return _tabla().get(categoria_id)
+
+
+def nombre(categoria_id):
+    """Nombre de la categoría ``categoria_id`` (cadena vacía si no existe)."""
+    categoria = por_id(categoria_id)
+    return categoria.nombre if categoria else ''
+
+
+def por_codigo(codigo):
+    """Categoría inicial con el código antiguo ``codigo`` (``'1'``-``'6'``)."""
+    for categoria in _tabla().values():
+        if categoria.codigo == codigo:
+            return categoria
+    return None
+
+
+def resolver(valor):
+    """Categoría a partir de su ``id`` o de su nombre (sin distinguir mayúsculas).
+
+    Permite aceptar en la URL o en un formulario tanto el identificador
+    como el nombre legible. Devuelve ``None`` si no coincide ninguna.
+    """
+    valor = (valor or '').strip()
+    if valor.isdigit() and int(valor) in _tabla():
+        return _tabla()[int(valor)]
+    for categoria in _tabla().values():
+        if categoria.nombre.lower() == valor.lower():
+            return categoria
+    return None
+
+
+def tipo_fondo(categoria):
+    """Tipo de ``FondoComun`` asociado a ``categoria``, o ``None``."""
+    return FONDO_POR_CODIGO.get(categoria.codigo)
+
+
+def olvidar_categorias():
+    """Descarta la copia en memoria en todos los procesos."""
+    global _categorias
+    _categorias = None
+    versiones.cambiar(CLAVE_VERSION)
@@ -0,0 +1,292 @@
+"""
+Clasificación automática de gastos por su descripción.
+
+Es un clasificador bayesiano ingenuo multinomial sobre las palabras de la
+descripción, entrenado con los gastos ya registrados y su categoría. El
+modelo son solo recuentos (cuántas veces aparece cada palabra en cada
+categoría y cuántos gastos tiene cada categoría), así que:
+
+* se construye con una sola consulta agregada por comercio y categoría
+  (``Gasto.comercio_normalizado``), sin leer los gastos uno a uno;
+* se actualiza de forma incremental con las señales de ``Gasto`` en lugar
+  de reentrenarse;
+* predecir cuesta unas pocas operaciones por palabra y categoría (del
+  orden de microsegundos).
+
+Los recuentos se guardan también en la tabla ``ConteoPalabra``, que las
+señales de ``Gasto`` mantienen en la misma transacción. Como en ``core.sugerencias``, cada proceso guarda su modelo en
+memoria y, tras un cambio (la versión de ``core.versiones``), solo lee
+las filas cambiadas desde su copia. Lo usan las sugerencias del formulario
+de ``crear_gasto`` y la importación de extractos para proponer la
+categoría; ``python manage.py medir_clasificador`` mide el entrenamiento y
+las predicciones con historiales sintéticos.
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count
+
+from . import metricas, versiones
+from .models import ConteoPalabra, Gasto, normalizar_comercio
+
+CLAVE_VERSION = 'clasificador'
+# Cambia al reconstruir la tabla: los procesos deben cargarla entera
+CLAVE_RECONSTRUCCION = 'clasificador:reconstruccion'
+# Suavizado de Laplace de los recuentos de palabras
+ALFA = 1.0
+# Probabilidad mínima para proponer una categoría
+UMBRAL = 0.6
+
+PALABRA = re.compile(r'[a-z0-9]{2,}')
+
+
+def palabras(descripcion):
+    """Palabras de ``descripcion`` en minúsculas y sin tildes (de dos letras o más)."""
+    sin_tildes = unicodedata.normalize('NFKD', descripcion or '').encode('ascii', 'ignore').decode()
+    return PALABRA.findall(sin_tildes.lower())
+
+
+class NaiveBayes:
+    """Recuentos de un clasificador bayesiano ingenuo multinomial.
+
+    ``conteos`` guarda para cada palabra sus apariciones por categoría, de
+    modo que al predecir solo se consultan las palabras de la descripción.
+    """
+
+    def __init__(self, alfa=ALFA):
+        self.alfa = alfa
+        self.documentos = Counter()
+        self.total_palabras = Counter()
+        self.conteos = {}
+
+    def aprender(self, tokens, categoria, veces=1):
+        """Suma ``veces`` gastos de ``categoria`` con esas palabras (negativo para restarlos)."""
+        self.documentos[categoria] += veces
+        for token in tokens:
+            por_categoria = self.conteos.setdefault(token, Counter())
+            por_categoria[categoria] += veces
+            self.total_palabras[categoria] += veces
+            if por_categoria[categoria] <= 0:
+                del por_categoria[categoria]
+                if not por_categoria:
+                    del self.conteos[token]
+        if self.documentos[categoria] <= 0:
+            del self.documentos[categoria]
+            del self.total_palabras[categoria]
+
+    def olvidar(self, tokens, categoria, veces=1):
+        self.aprender(tokens, categoria, -veces)
+
+    def fijar(self, token, categoria, veces):
+        """Pone en ``veces`` las apariciones de ``token`` en ``categoria``.
+
+        Con ``token`` vacío, el número de gastos de la categoría (como en
+        la tabla ``ConteoPalabra``).
+        """
+        if not token:
+            self.documentos[categoria] = veces
+            if veces <= 0:
+                del self.documentos[categoria]
+            return
+        por_categoria = self.conteos.setdefault(token, Counter())
+        self.total_palabras[categoria] += veces - por_categoria[categoria]
+        por_categoria[categoria] = veces
+        if veces <= 0:
+            del por_categoria[categoria]
+            if not por_categoria:
+                del self.conteos[token]
+        if self.total_palabras[categoria] <= 0:
+            del self.total_palabras[categoria]
+
+    def probabilidades(self, tokens):
+        """Probabilidad de cada categoría para las palabras ``tokens``.
+
+        Las palabras que no aparecen en ningún gasto no aportan nada; sin
+        ninguna palabra conocida no se devuelve nada.
+        """
+        conocidas = [self.conteos[token] for token in tokens if token in self.conteos]
+        if not conocidas:
+            return {}
+        total_documentos = sum(self.documentos.values())
+        vocabulario = len(self.conteos)
+        puntuaciones = {}
+        for categoria, documentos in self.documentos.items():
+            puntuacion = math.log(documentos / total_documentos)
+            puntuacion -= len(conocidas) * math.log(self.total_palabras[categoria] + self.alfa * vocabulario)
+            for por_categoria in conocidas:
+                puntuacion += math.log(por_categoria.get(categoria, 0) + self.alfa)
+            puntuaciones[categoria] = puntuacion
+        maxima = max(puntuaciones.values())
+        exponenciales = {categoria: math.exp(valor - maxima) for categoria, valor in puntuaciones.items()}
+        suma = sum(exponenciales.values())
+        return {categoria: valor / suma for categoria, valor in exponenciales.items()}
+
+    def predecir(self, tokens, umbral=UMBRAL):
+        """Categoría más probable si su probabilidad llega a ``umbral``, o ``None``."""
+        probabilidades = self.probabilidades(tokens)
+        if not probabilidades:
+            return None
+        categoria = max(probabilidades, key=probabilidades.get)
+        return categoria if probabilidades[categoria] >= umbral else None
+
+
+# (reconstrucción, versión, NaiveBayes) de este proceso
+_modelo = None
+_cerrojo = threading.Lock()
+# Versión del último cambio de este hilo aún sin confirmar
+_hilo = threading.local()
+
+
+def entrenar():
+    """Modelo entrenado con todos los gastos (agrupados por comercio y categoría)."""
+    modelo = NaiveBayes()
+    filas = (
+        Gasto.objects.order_by()
+        .values_list('comercio_normalizado', 'categoria_id')
+        .annotate(veces=Count('id'))
+    )
+    for comercio, categoria_id, veces in filas:
+        modelo.aprender(palabras(comercio), categoria_id, veces)
+    return modelo
+
+
+def _cargar(modelo, filas):
+    for palabra, categoria_id, veces in filas.values_list('palabra', 'categoria_id', 'veces'):
+        modelo.fijar(palabra, categoria_id, veces)
+
+
+def modelo():
+    """Modelo de este proceso, al día con la tabla ``ConteoPalabra``.
+
+    Se carga y se pone al día como el índice de ``core.sugerencias``: la
+    tabla entera si se ha reconstruido y, si no, solo las filas cambiadas.
+    """
+    global _modelo
+    reconstruccion = versiones.leer(CLAVE_RECONSTRUCCION)
+    version = versiones.leer(CLAVE_VERSION)
+    if version == getattr(_hilo, 'pendiente', None):
+        # Cambios de esta transacción sin confirmar: no pasan a la copia del proceso
+        metricas.registrar_cache('clasificador', False)
+        propio = NaiveBayes()
+        _cargar(propio, ConteoPalabra.objects.all())
+        return propio
+    local = _modelo
+    acierto = local is not None and local[:2] == (reconstruccion, version)
+    metricas.registrar_cache('clasificador', acierto)
+    if not acierto:
+        with _cerrojo:
+            local = _modelo
+            if local is None or local[0] != reconstruccion or local[1] > version:
+                nuevo = NaiveBayes()
+                _cargar(nuevo, ConteoPalabra.objects.all())
+                _modelo = (reconstruccion, version, nuevo)
+            elif local[1] < version:
+                _cargar(local[2], ConteoPalabra.objects.filter(version__gt=local[1]))
+                _modelo = (reconstruccion, version, local[2])
+    return _modelo[2]
+
+
+def predecir(descripcion):
+    """Id de la categoría propuesta para ``descripcion``, o ``None`` si no hay bastante certeza."""
+    return modelo().predecir(palabras(descripcion))
+
+
+def _aplicar(acumulado, version):
+    """Suma a ``ConteoPalabra`` los recuentos de ``acumulado`` con una lectura y una escritura en bloque."""
+    existentes = ConteoPalabra.objects.filter(
+        palabra__in={palabra for palabra, _ in acumulado},
+        categoria_id__in={categoria_id for _, categoria_id in acumulado},
+    )
+    cambiadas = []
+    for fila in existentes:
+        clave = (fila.palabra, fila.categoria_id)
+        if clave in acumulado:
+            fila.veces += acumulado.pop(clave)
+            fila.version = version
+            cambiadas.append(fila)
+    ConteoPalabra.objects.bulk_update(cambiadas, ['veces', 'version'])
+    ConteoPalabra.objects.bulk_create([
+        ConteoPalabra(palabra=palabra, categoria_id=categoria_id, veces=veces, version=version)
+        for (palabra, categoria_id), veces in acumulado.items()
+        if veces > 0
+    ])
+
+
+def _registrar(aprendidos=(), olvidados=()):
+    """Aplica los cambios a ``ConteoPalabra`` con una versión nueva del modelo.
+
+    Como en ``core.sugerencias``, todo ocurre en la transacción en curso con
+    la fila de la versión bloqueada, y los cambios se agrupan por palabra y
+    categoría (la palabra vacía cuenta los gastos de cada categoría).
+    """
+    acumulado = Counter()
+    for signo, cambios in ((1, aprendidos), (-1, olvidados)):
+        for descripcion, categoria_id in cambios:
+            acumulado['', categoria_id] += signo
+            for token in palabras(descripcion):
+                acumulado[token, categoria_id] += signo
+    acumulado = {clave: veces for clave, veces in acumulado.items() if veces}
+    if not acumulado:
+        return
+    with transaction.atomic():
+        version = versiones.cambiar(CLAVE_VERSION)
+        _aplicar(acumulado, version)
+        _hilo.pendiente = version
+        transaction.on_commit(lambda: setattr(_hilo, 'pendiente', None))
+
+
+def registrar_gastos(gastos):
+    """Aprende de los gastos creados."""
+    aprendidos = [(gasto.descripcion, gasto.categoria_id) for gasto in gastos]
+    _registrar(aprendidos=aprendidos)
+
+
+def registrar_cambio(gasto):
+    """Corrige el modelo si cambian la descripción o la categoría de un gasto."""
+    originales = getattr(gasto, '_valores_originales', {})
+    if not all(campo in originales for campo in ('descripcion', 'categoria_id')):
+        return
+    anterior = (originales['descripcion'], originales['categoria_id'])
+    actual = (gasto.descripcion, gasto.categoria_id)
+    if normalizar_comercio(anterior[0]) != normalizar_comercio(actual[0]) or anterior[1] != actual[1]:
+        _registrar(aprendidos=[actual], olvidados=[anterior])
+
+
+def registrar_borrado(gasto):
+    """Olvida un gasto borrado."""
+    _registrar(olvidados=[(gasto.descripcion, gasto.categoria_id)])
+
+
+def reconstruir():
+    """Rehace ``ConteoPalabra`` desde ``Gasto`` (ver :func:`entrenar`).
+
+    Devuelve el número de filas creadas. Los procesos cargan la tabla
+    entera la próxima vez que usen el modelo.
+    """
+    entrenado = entrenar()
+    with transaction.atomic():
+        versiones.cambiar(CLAVE_RECONSTRUCCION)
+        version = versiones.cambiar(CLAVE_VERSION)
+        ConteoPalabra.objects.all().delete()
+        filas = [
+            ConteoPalabra(palabra='', categoria_id=categoria_id, veces=veces, version=version)
+            for categoria_id, veces in entrenado.documentos.items()
+        ] + [
+            ConteoPalabra(palabra=palabra, categoria_id=categoria_id, veces=veces, version=version)
+            for palabra, por_categoria in entrenado.conteos.items()
+            for categoria_id, veces in por_categoria.items()
+        ]
+        ConteoPalabra.objects.bulk_create(filas, batch_size=1000)
+    return len(filas)
+
+
+def olvidar_modelo():
+    """Descarta el modelo de este proceso (por ejemplo, al cambiar de base de datos)."""
+    global _modelo
+    with _cerrojo:
+        _modelo = None
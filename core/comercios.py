@@ -0,0 +1,58 @@
+"""
+Consultas de gasto por comercio.
+
+Los gastos guardan su descripción normalizada en ``comercio_normalizado``
+(ver :func:`core.models.normalizar_comercio`), indexada junto con la fecha.
+Así los totales por tienda se calculan con una única consulta agrupada en
+la base de datos, para cualquier intervalo de fechas.
+"""
+
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
+
+from . import categorias
+from .models import Gasto, normalizar_comercio
+
+# Código de la categoría «Supermercado»
+CODIGO_SUPERMERCADO = '1'
+
+
+def totales_por_comercio(desde, hasta, filtro=None):
+    """Total gastado en cada comercio en el intervalo ``[desde, hasta)``.
+
+    Devuelve una lista de ``(comercio, total)`` ordenada de mayor a menor
+    gasto. Por defecto se limita a la categoría «Supermercado»; con
+    ``filtro=Q()`` se incluyen todos los gastos.
+    """
+    if filtro is None:
+        supermercado = categorias.por_codigo(CODIGO_SUPERMERCADO)
+        filtro = Q(categoria_id=supermercado.id if supermercado else None)
+    filas = (
+        Gasto.objects.filter(filtro, fecha__gte=desde, fecha__lt=hasta)
+        .order_by()
+        .values('comercio_normalizado')
+        .annotate(suma=Sum('monto_total'))
+        .order_by('-suma', 'comercio_normalizado')
+    )
+    return [(fila['comercio_normalizado'], fila['suma'].quantize(Decimal('0.01'))) for fila in filas]
+
+
+def historial_comercio(comercio, desde, hasta):
+    """Total mensual gastado en ``comercio`` en el intervalo ``[desde, hasta)``.
+
+    ``comercio`` puede escribirse de cualquier forma: se normaliza igual que
+    al guardar. Devuelve una lista de ``(primer día del mes, total)``.
+    """
+    filas = (
+        Gasto.objects.filter(
+            comercio_normalizado=normalizar_comercio(comercio), fecha__gte=desde, fecha__lt=hasta
+        )
+        .annotate(mes=TruncMonth('fecha'))
+        .order_by()
+        .values('mes')
+        .annotate(suma=Sum('monto_total'))
+        .order_by('mes')
+    )
+    return [(fila['mes'], fila['suma'].quantize(Decimal('0.01'))) for fila in filas]
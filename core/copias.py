@@ -0,0 +1,311 @@
+"""
+Copias de seguridad de todos los datos del hogar en JSON Lines comprimido.
+
+El fichero es un gzip con una línea JSON por registro:
+
+* una cabecera ``{"formato": "gastos", "version": 1, ...}``;
+* por cada modelo, una línea ``{"modelo": ..., "campos": [...]}`` seguida
+  de una lista de valores por fila, en el orden de ``campos``;
+* un cierre ``{"fin": {modelo: filas}}`` que permite detectar copias
+  incompletas.
+
+:func:`crear_copia` lee cada tabla con ``values_list().iterator()`` y
+escribe a medida que lee, y :func:`restaurar_copia` inserta las filas por
+bloques en una única transacción, de modo que la memoria no depende del
+tamaño de la copia. Las tablas grandes se insertan con un ``INSERT``
+parametrizado (``executemany``) sin crear instancias de los modelos, lo que
+además conserva tal cual los campos ``auto_now_add`` como
+``IngresoFondo.fecha``. Sirve para pasar los datos de
+SQLite a PostgreSQL (y al revés) sin ``dumpdata``/``loaddata``.
+
+Las usuarias y las categorías se identifican por nombre (la base de datos
+de destino puede tenerlas ya, p. ej. las categorías iniciales que crean
+las migraciones); el resto de tablas conserva sus claves primarias. Los
+datos derivados no se copian sino que se recalculan una sola vez al final
+de la restauración: saldos y cierres de los fondos a partir de sus
+movimientos, ``ResumenMensual`` y el balance de las liquidaciones.
+"""
+
+import datetime
+import gzip
+import json
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .models import (
+    Categoria,
+    CierreFondo,
+    ConteoPalabra,
+    FondoComun,
+    Gasto,
+    GastoRecurrente,
+    IngresoFondo,
+    Liquidacion,
+    MovimientoFondo,
+    ObjetivoAhorro,
+    ResumenMensual,
+    UserProfile,
+    UsoComercio,
+)
+
+FORMATO = 'gastos'
+VERSION = 1
+TAMANO_BLOQUE = 2000
+
+# Tablas identificadas por un campo natural en lugar de por su ``id``
+CLAVES_NATURALES = {User: 'username', Categoria: 'nombre'}
+# Tablas que se copian, en orden de dependencias
+MODELOS = [
+    User,
+    Categoria,
+    UserProfile,
+    FondoComun,
+    ObjetivoAhorro,
+    GastoRecurrente,
+    Gasto,
+    IngresoFondo,
+    Liquidacion,
+    MovimientoFondo,
+]
+# Tablas que se recalculan y, por tanto, se vacían antes de restaurar
+DERIVADOS = [CierreFondo, ResumenMensual, UsoComercio, ConteoPalabra]
+# Tablas pequeñas que se restauran con el ORM; las demás se insertan con un
+# ``INSERT`` parametrizado (``executemany``), sin crear instancias
+CON_ORM = (User, Categoria, UserProfile)
+# Tipos cuyos valores JSON (texto) hay que convertir antes de insertarlos
+TIPOS_CONVERTIDOS = ('DateField', 'DateTimeField', 'TimeField', 'DecimalField')
+
+
+class ErrorCopia(ValueError):
+    """La copia no tiene el formato esperado o no se puede restaurar."""
+
+
+def _etiqueta(modelo):
+    return modelo._meta.label_lower
+
+
+def _campos(modelo):
+    return [campo.attname for campo in modelo._meta.concrete_fields]
+
+
+def _lineas_copia():
+    """Líneas (objetos JSON) de la copia, tabla a tabla."""
+    yield {'formato': FORMATO, 'version': VERSION, 'creada': datetime.datetime.now().isoformat()}
+    filas = {}
+    for modelo in MODELOS:
+        campos = _campos(modelo)
+        yield {'modelo': _etiqueta(modelo), 'campos': campos}
+        filas[_etiqueta(modelo)] = 0
+        consulta = modelo._default_manager.order_by('pk').values_list(*campos).iterator(chunk_size=TAMANO_BLOQUE)
+        for fila in consulta:
+            filas[_etiqueta(modelo)] += 1
+            yield fila
+    yield {'fin': filas}
+
+
+def _a_json(valor):
+    """Fechas en ISO 8601 (con microsegundos) y decimales como texto exacto."""
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    raise TypeError(f'No se puede copiar {valor!r}')
+
+
+def crear_copia(destino):
+    """Escribe la copia en ``destino`` (ruta o fichero binario) y devuelve las filas por tabla."""
+    codificador = json.JSONEncoder(default=_a_json, ensure_ascii=False, separators=(',', ':'))
+    with gzip.open(destino, 'wt', encoding='utf-8') as salida:
+        for linea in _lineas_copia():
+            salida.write(codificador.encode(linea))
+            salida.write('\n')
+    return linea['fin']
+
+
+def _vaciar(modelos):
+    """Borra las tablas con ``DELETE`` directo, sin cargar filas ni enviar señales."""
+    with connection.cursor() as cursor:
+        for modelo in modelos:
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(modelo._meta.db_table)}')
+
+
+class _Restauracion:
+    """Estado de una restauración: traducción de claves y bloque pendiente."""
+
+    def __init__(self):
+        # {modelo: {id en la copia: id en la base de datos}}
+        self.ids = {modelo: {} for modelo in CLAVES_NATURALES}
+        self.modelo = None
+        self.conversores = []
+        self.pendientes = []
+        self.filas = {}
+
+    def empezar(self, etiqueta, campos):
+        self.guardar()
+        modelos = {_etiqueta(modelo): modelo for modelo in MODELOS}
+        if etiqueta not in modelos:
+            raise ErrorCopia(f'Tabla desconocida en la copia: {etiqueta}')
+        self.modelo = modelos[etiqueta]
+        por_nombre = {campo.attname: campo for campo in self.modelo._meta.concrete_fields}
+        desconocidos = set(campos) - set(por_nombre)
+        if desconocidos:
+            raise ErrorCopia(f'Campos desconocidos en {etiqueta}: {", ".join(sorted(desconocidos))}')
+        self.campos = campos
+        self.conversores = [self._conversor(por_nombre[nombre]) for nombre in campos]
+        self.filas[etiqueta] = 0
+
+    def _conversor(self, campo):
+        relacionado = campo.related_model if campo.is_relation else None
+        if relacionado in self.ids:
+            # Clave foránea a una tabla con clave natural: se traduce el id
+            ids = self.ids[relacionado]
+            return lambda valor: ids[valor] if valor is not None else None
+        if self.modelo in CON_ORM:
+            return campo.to_python
+        tipo = campo.get_internal_type()
+        # Valores listos para el ``INSERT`` directo. Fechas e importes (casi
+        # todos los valores convertidos) usan los adaptadores de la base de
+        # datos sin pasar por ``get_db_prep_save``, que es mucho más lento
+        if tipo == 'DateField':
+            adaptar = connection.ops.adapt_datefield_value
+            return lambda valor: adaptar(datetime.date.fromisoformat(valor)) if valor is not None else None
+        if tipo == 'DecimalField':
+            adaptar = connection.ops.adapt_decimalfield_value
+            return lambda valor: adaptar(Decimal(valor)) if valor is not None else None
+        if tipo in TIPOS_CONVERTIDOS:
+            return lambda valor: campo.get_db_prep_save(campo.to_python(valor), connection)
+        # Textos, números, booleanos y claves: el valor JSON ya es el adecuado
+        return lambda valor: valor
+
+    def anadir(self, valores):
+        self.pendientes.append([convertir(valor) for convertir, valor in zip(self.conversores, valores)])
+        self.filas[_etiqueta(self.modelo)] += 1
+        if len(self.pendientes) >= TAMANO_BLOQUE:
+            self.guardar()
+
+    def guardar(self):
+        if not self.pendientes:
+            return
+        if self.modelo in CLAVES_NATURALES:
+            self._guardar_por_clave_natural()
+        elif self.modelo not in CON_ORM:
+            self._insertar()
+        else:
+            objetos = [self.modelo(**dict(zip(self.campos, fila))) for fila in self.pendientes]
+            if self.modelo is UserProfile:
+                # La señal de ``User`` crea perfiles vacíos: se sustituyen por
+                # los copiados, con ``id`` nuevo para no chocar con otros perfiles
+                UserProfile.objects.filter(user_id__in=[perfil.user_id for perfil in objetos]).delete()
+                for perfil in objetos:
+                    perfil.id = None
+            self.modelo._default_manager.bulk_create(objetos)
+        self.pendientes = []
+
+    def _insertar(self):
+        """Inserta el bloque pendiente con un único ``executemany``."""
+        tabla = connection.ops.quote_name(self.modelo._meta.db_table)
+        columnas = ', '.join(
+            connection.ops.quote_name(self.modelo._meta.get_field(campo).column)
+            for campo in self.campos
+        )
+        marcadores = ', '.join(['%s'] * len(self.campos))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {tabla} ({columnas}) VALUES ({marcadores})', self.pendientes)
+
+    def _guardar_por_clave_natural(self):
+        """Reutiliza las filas que ya existen (por nombre) y crea las demás."""
+        clave = CLAVES_NATURALES[self.modelo]
+        filas = [dict(zip(self.campos, fila)) for fila in self.pendientes]
+        existentes = dict(
+            self.modelo._default_manager.filter(**{f'{clave}__in': [fila[clave] for fila in filas]})
+            .values_list(clave, 'pk')
+        )
+        nuevas = []
+        for fila in filas:
+            if fila[clave] not in existentes:
+                nuevas.append(self.modelo(**{campo: valor for campo, valor in fila.items() if campo != 'id'}))
+        self.modelo._default_manager.bulk_create(nuevas)
+        existentes.update(
+            self.modelo._default_manager.filter(**{f'{clave}__in': [getattr(nueva, clave) for nueva in nuevas]})
+            .values_list(clave, 'pk')
+        )
+        for fila in filas:
+            self.ids[self.modelo][fila['id']] = existentes[fila[clave]]
+
+
+def _lineas(origen):
+    with gzip.open(origen, 'rt', encoding='utf-8') as entrada:
+        for numero, linea in enumerate(entrada, start=1):
+            try:
+                yield numero, json.loads(linea)
+            except ValueError as error:
+                raise ErrorCopia(f'Línea {numero} no válida: {error}') from error
+
+
+def _recalcular_derivados():
+    """Saldos y cierres, resumen, liquidaciones, índices de búsqueda y clasificador, una sola vez."""
+    from . import busqueda, categorias, clasificador, fondos, resumen, sugerencias
+    from .balance import recalcular_liquidaciones
+    from .recurrentes import olvidar_periodo_aplicado
+
+    fondos.corregir_desde_movimientos()
+    resumen.reconstruir()
+    busqueda.reconstruir()
+    primera = Liquidacion.objects.order_by('fecha').values_list('fecha', flat=True).first()
+    if primera:
+        recalcular_liquidaciones(primera)
+    categorias.olvidar_categorias()
+    olvidar_periodo_aplicado()
+    sugerencias.reconstruir()
+    clasificador.reconstruir()
+
+
+def restaurar_copia(origen, reemplazar=False):
+    """Restaura la copia ``origen`` (ruta o fichero binario) y devuelve las filas por tabla.
+
+    Las tablas de datos deben estar vacías salvo que se pida ``reemplazar``,
+    en cuyo caso se vacían antes (en la misma transacción). Cualquier error
+    deshace la restauración completa.
+    """
+    # Los perfiles se sustituyen usuaria a usuaria (ver ``_Restauracion.guardar``)
+    datos = [modelo for modelo in reversed(MODELOS) if modelo not in CLAVES_NATURALES and modelo is not UserProfile]
+    with transaction.atomic():
+        if reemplazar:
+            _vaciar(DERIVADOS + datos)
+        else:
+            ocupadas = [_etiqueta(modelo) for modelo in datos if modelo._default_manager.exists()]
+            if ocupadas:
+                raise ErrorCopia(f'Las tablas no están vacías ({", ".join(ocupadas)}); usa la opción de reemplazar')
+            _vaciar(DERIVADOS)
+
+        restauracion = _Restauracion()
+        lineas = _lineas(origen)
+        _, cabecera = next(lineas, (0, {}))
+        if not isinstance(cabecera, dict) or cabecera.get('formato') != FORMATO:
+            raise ErrorCopia('El fichero no es una copia de seguridad de gastos')
+        if cabecera.get('version') != VERSION:
+            raise ErrorCopia(f"Versión de copia no admitida: {cabecera.get('version')}")
+        fin = None
+        for numero, linea in lineas:
+            if isinstance(linea, list):
+                if restauracion.modelo is None:
+                    raise ErrorCopia(f'Línea {numero}: fila fuera de una tabla')
+                restauracion.anadir(linea)
+            elif 'modelo' in linea:
+                restauracion.empezar(linea['modelo'], linea['campos'])
+            elif 'fin' in linea:
+                fin = linea['fin']
+        restauracion.guardar()
+        if fin != restauracion.filas:
+            raise ErrorCopia('La copia está incompleta')
+
+        # Las claves primarias se han insertado explícitamente: en PostgreSQL
+        # hay que adelantar las secuencias
+        with connection.cursor() as cursor:
+            for sentencia in connection.ops.sequence_reset_sql(no_style(), MODELOS):
+                cursor.execute(sentencia)
+        _recalcular_derivados()
+    return restauracion.filas
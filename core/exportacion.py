@@ -0,0 +1,195 @@
+"""
+Exportación de gastos a CSV y XLSX como flujo.
+
+Las filas se leen con ``values_list(...).iterator(chunk_size=...)``: no se
+crean instancias de ``Gasto`` y, en PostgreSQL, la consulta usa un cursor
+del servidor, así que la memoria no depende del número de gastos. Los
+nombres de categorías, fondos y usuarias se resuelven con tablas pequeñas
+cargadas una vez.
+
+:func:`csv_en_flujo` y :func:`xlsx_en_flujo` son generadores de ``bytes``
+pensados para ``StreamingHttpResponse``: la cabecera sale antes de
+ejecutar la consulta, de modo que el navegador empieza a recibir el
+fichero al momento. El XLSX se escribe a mano (un ZIP con las partes
+mínimas de Office Open XML, cadenas en línea y un estilo de fecha) para
+no depender de ninguna librería externa.
+"""
+
+import csv
+import datetime
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.contrib.auth.models import User
+
+from . import categorias
+from .balance import PORCENTAJE_ADRI, PORCENTAJE_SARA
+from .models import FondoComun
+
+COLUMNAS = ('Fecha', 'Descripción', 'Categoría', 'Fondo', 'Pagado por', 'Importe', 'Parte Sara', 'Parte Adri')
+CAMPOS = ('fecha', 'descripcion', 'categoria_id', 'fondo_id', 'pagado_por_id', 'monto_total')
+TAMANO_BLOQUE = 2000
+CENTIMOS = Decimal('0.01')
+
+
+def filas(gastos):
+    """Filas de la exportación (tuplas en el orden de ``COLUMNAS``) de ``gastos``."""
+    nombres = {categoria.id: categoria.nombre for categoria in categorias.todas()}
+    fondos = {fondo.id: fondo.get_tipo_display() for fondo in FondoComun.objects.all()}
+    usuarios = dict(User.objects.values_list('id', 'username'))
+    consulta = gastos.order_by('fecha', 'id').values_list(*CAMPOS).iterator(chunk_size=TAMANO_BLOQUE)
+    for fecha, descripcion, categoria_id, fondo_id, pagado_por_id, monto in consulta:
+        yield (
+            fecha,
+            descripcion,
+            nombres.get(categoria_id, ''),
+            fondos.get(fondo_id, ''),
+            usuarios.get(pagado_por_id, ''),
+            monto,
+            (monto * PORCENTAJE_SARA).quantize(CENTIMOS),
+            (monto * PORCENTAJE_ADRI).quantize(CENTIMOS),
+        )
+
+
+class _Eco:
+    """Pseudo-fichero que devuelve lo escrito en lugar de guardarlo."""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_en_flujo(filas):
+    """CSV (UTF-8 con BOM, para que Excel respete las tildes) fila a fila."""
+    escritor = csv.writer(_Eco())
+    yield ('\ufeff' + escritor.writerow(COLUMNAS)).encode()
+    for fila in filas:
+        yield escritor.writerow(fila).encode()
+
+
+class _Salida:
+    """Fichero de solo escritura y no posicionable que acumula lo escrito.
+
+    ``zipfile`` escribe en él como en un flujo (con descriptores de datos
+    tras cada entrada) y el generador vacía lo acumulado tras cada bloque.
+    """
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def seek(self, *args):
+        raise OSError('no posicionable')
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+PARTES_XLSX = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Gastos" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilo 1: fecha (formato 14); estilo 2: importe con dos decimales (formato 4)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+# Día 0 de las fechas de Excel (contando el 29/02/1900 inexistente)
+EPOCA_EXCEL = datetime.date(1899, 12, 30)
+
+
+def _celda(valor):
+    if isinstance(valor, datetime.date):
+        return f'<c s="1"><v>{(valor - EPOCA_EXCEL).days}</v></c>'
+    if isinstance(valor, Decimal):
+        return f'<c s="2"><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(valor))}</t></is></c>'
+
+
+def _fila(valores):
+    return '<row>' + ''.join(_celda(valor) for valor in valores) + '</row>'
+
+
+def xlsx_en_flujo(filas, filas_por_bloque=500):
+    """Libro XLSX de una hoja con las filas, emitido por bloques."""
+    salida = _Salida()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in PARTES_XLSX.items():
+            libro.writestr(nombre, contenido)
+        with libro.open('xl/worksheets/sheet1.xml', 'w') as hoja:
+            hoja.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _fila(COLUMNAS)
+            ).encode())
+            yield salida.vaciar()
+            bloque = []
+            for fila in filas:
+                bloque.append(_fila(fila))
+                if len(bloque) >= filas_por_bloque:
+                    hoja.write(''.join(bloque).encode())
+                    bloque = []
+                    yield salida.vaciar()
+            hoja.write((''.join(bloque) + '</sheetData></worksheet>').encode())
+    yield salida.vaciar()
@@ -0,0 +1,68 @@
+"""
+Filtros de fecha aprovechables por los índices.
+
+``fecha__month`` y ``fecha__year`` se traducen en SQL a funciones de
+extracción sobre la columna (``EXTRACT``/``django_date_extract``), que
+impiden usar los índices sobre ``fecha``. Estas funciones expresan los
+mismos filtros como intervalos semiabiertos ``[desde, hasta)``, que el
+planificador resuelve con una búsqueda por rango en el índice.
+"""
+
+import datetime
+
+from django.db.models import Max, Min, Q
+
+
+def rango_mes(ano, mes):
+    """Intervalo ``[primer día del mes, primer día del mes siguiente)``."""
+    desde = datetime.date(ano, mes, 1)
+    hasta = datetime.date(ano + 1, 1, 1) if mes == 12 else datetime.date(ano, mes + 1, 1)
+    return desde, hasta
+
+
+def rango_ano(ano):
+    """Intervalo ``[1 de enero, 1 de enero del año siguiente)``."""
+    return datetime.date(ano, 1, 1), datetime.date(ano + 1, 1, 1)
+
+
+def _entero(valor, minimo, maximo):
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return valor if minimo <= valor <= maximo else None
+
+
+def ano_y_mes(ano, mes):
+    """Año y mes como enteros válidos (``None`` si faltan o no son válidos)."""
+    return _entero(ano, 1, 9998), _entero(mes, 1, 12)
+
+
+def filtrar_periodo(queryset, ano=None, mes=None, campo='fecha'):
+    """Filtra ``queryset`` por año y/o mes (valores tal y como llegan por GET).
+
+    - Año y mes: el intervalo de ese mes.
+    - Solo año: el intervalo de ese año.
+    - Solo mes: ese mes de cualquier año, como una disyunción de intervalos
+      entre el primer y el último año con datos (se obtienen con ``MIN`` y
+      ``MAX`` sobre el índice).
+
+    Los valores vacíos o no válidos se ignoran.
+    """
+    ano, mes = ano_y_mes(ano, mes)
+    if ano and mes:
+        desde, hasta = rango_mes(ano, mes)
+    elif ano:
+        desde, hasta = rango_ano(ano)
+    elif mes:
+        limites = queryset.aggregate(primero=Min(campo), ultimo=Max(campo))
+        if limites['primero'] is None:
+            return queryset
+        condicion = Q()
+        for ano in range(limites['primero'].year, limites['ultimo'].year + 1):
+            desde, hasta = rango_mes(ano, mes)
+            condicion |= Q(**{f'{campo}__gte': desde, f'{campo}__lt': hasta})
+        return queryset.filter(condicion)
+    else:
+        return queryset
+    return queryset.filter(**{f'{campo}__gte': desde, f'{campo}__lt': hasta})
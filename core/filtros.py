@@ -0,0 +1,86 @@
+"""
+Filtros de los listados de gastos a partir de los parámetros de la URL.
+
+Los listados y la exportación aceptan los mismos parámetros: ``cat``
+(id o nombre de la categoría), ``fondo`` (id o tipo del fondo), ``year`` y
+``month`` (el año es opcional) y ``q`` (texto en la descripción o en el
+nombre de quien pagó). Todos se traducen en condiciones sobre columnas
+indexadas, en intervalos de fechas (ver ``core.fechas``) o en búsquedas
+en el índice de texto (ver ``core.busqueda``).
+
+:func:`contar_gastos` da el número de resultados sin un ``COUNT(*)`` sobre
+``Gasto``: sin búsqueda de texto lo lee de ``ResumenMensual`` y con ella
+cuenta como mucho :data:`LIMITE_CUENTA` filas.
+"""
+
+from django.db.models import Sum
+
+from . import busqueda, categorias
+from .fechas import ano_y_mes, filtrar_periodo
+from .models import FondoComun, ResumenMensual
+
+PARAMETROS = ('cat', 'fondo', 'year', 'month', 'q')
+# Con búsqueda de texto no se cuentan más resultados que los que se pueden
+# ordenar por relevancia
+LIMITE_CUENTA = busqueda.LIMITE_CANDIDATOS
+
+
+def parametros(datos):
+    """Parámetros de filtro presentes en ``datos`` (p. ej. ``request.GET``)."""
+    return {clave: datos.get(clave, '').strip() for clave in PARAMETROS if datos.get(clave, '').strip()}
+
+
+def _ids(filtros):
+    """``(categoria_id, fondo_id)`` pedidos; ``0`` si no existen (no coinciden con nada)."""
+    categoria_id = fondo_id = None
+    if filtros.get('cat'):
+        categoria = categorias.resolver(filtros['cat'])
+        categoria_id = categoria.id if categoria else 0
+    if filtros.get('fondo'):
+        fondo = filtros['fondo']
+        if not fondo.isdigit():
+            fondo = FondoComun.objects.filter(tipo=fondo.upper()).values_list('id', flat=True).first()
+        fondo_id = int(fondo or 0)
+    return categoria_id, fondo_id
+
+
+def filtrar_gastos(gastos, filtros):
+    """Aplica a ``gastos`` los filtros devueltos por :func:`parametros`.
+
+    Una categoría o un fondo que no existen no coinciden con ningún gasto.
+    """
+    categoria_id, fondo_id = _ids(filtros)
+    if categoria_id is not None:
+        gastos = gastos.filter(categoria_id=categoria_id)
+    if fondo_id is not None:
+        gastos = gastos.filter(fondo_id=fondo_id)
+    gastos = filtrar_periodo(gastos, filtros.get('year'), filtros.get('month'))
+    if filtros.get('q'):
+        gastos = gastos.filter(busqueda.filtro(filtros['q']))
+    return gastos
+
+
+def contar_gastos(gastos, filtros):
+    """Número de gastos de ``gastos`` (ya filtrado con ``filtros``).
+
+    Devuelve ``(número, exacto)``. Sin búsqueda de texto todos los filtros
+    son columnas de ``ResumenMensual`` y el número exacto es la suma de su
+    columna ``numero``, que no depende del tamaño de ``Gasto``. Con búsqueda
+    se cuentan como mucho ``LIMITE_CUENTA + 1`` filas; si se alcanza el
+    límite, ``exacto`` es ``False`` y hay más de ``LIMITE_CUENTA`` gastos.
+    """
+    if filtros.get('q'):
+        numero = gastos.order_by().values('pk')[:LIMITE_CUENTA + 1].count()
+        return min(numero, LIMITE_CUENTA), numero <= LIMITE_CUENTA
+    filas = ResumenMensual.objects.all()
+    categoria_id, fondo_id = _ids(filtros)
+    if categoria_id is not None:
+        filas = filas.filter(categoria_id=categoria_id)
+    if fondo_id is not None:
+        filas = filas.filter(fondo_id=fondo_id)
+    ano, mes = ano_y_mes(filtros.get('year'), filtros.get('month'))
+    if ano:
+        filas = filas.filter(ano=ano)
+    if mes:
+        filas = filas.filter(mes=mes)
+    return filas.aggregate(total=Sum('numero'))['total'] or 0, True
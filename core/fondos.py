@@ -0,0 +1,443 @@
+"""
+Saldos, movimientos y consultas agregadas de los fondos comunes.
+
+Cada cambio del saldo de un fondo queda registrado como un
+``MovimientoFondo`` inmutable: los gastos con fondo generan cargos, los
+``IngresoFondo`` abonos y los ajustes manuales movimientos de ajuste (ver
+las señales en ``models.py``). :func:`registrar_movimientos` es el único
+punto que escribe ``FondoComun.saldo``: inserta los movimientos y, en la
+misma transacción, suma su importe al saldo con ``UPDATE ... SET saldo =
+saldo + %s`` (una expresión ``F()``), de modo que dos procesos que
+registren gastos a la vez sobre el mismo fondo no pueden perder ninguno de
+los dos movimientos. Editar o borrar un gasto o un ingreso no modifica sus
+movimientos sino que añade otros que los compensan.
+
+Las importaciones y restauraciones masivas registran los movimientos por
+lotes dentro de :func:`saldos_diferidos`, que acumula las variaciones en
+memoria y aplica al final un único ``UPDATE`` por fondo.
+
+Los ``CierreFondo`` guardan el saldo de cada fondo al final de cada mes.
+:func:`saldo_en` calcula el saldo en una fecha a partir del cierre anterior
+más cercano (una búsqueda en el índice) y la suma de los movimientos
+posteriores, como mucho de un mes. :func:`cerrar_meses` crea los cierres
+que falten y :func:`conciliar` compara el saldo de cada fondo y sus
+cierres con los movimientos; ambos se usan desde ``python manage.py
+conciliar_fondos``.
+
+:func:`historial_saldos` devuelve la evolución del saldo de cada fondo
+por días, semanas o meses en una sola consulta: agrupa los movimientos por
+fondo y periodo y calcula el saldo acumulado con una función de ventana
+(``SUM(SUM(importe)) OVER (PARTITION BY fondo ORDER BY periodo)``).
+
+Las aportaciones de un periodo se obtienen con una única consulta agrupada
+por fondo y usuaria (``values().annotate(Sum)``) y se reparten en memoria,
+en lugar de lanzar varias agregaciones por cada fondo.
+"""
+
+import datetime
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DateField, F, Func, Max, Sum, Value, Window
+from django.db.models.functions import Greatest, Trunc, TruncMonth
+
+from . import paneles
+from .models import CierreFondo, FondoComun, Gasto, IngresoFondo, MovimientoFondo
+
+# Campos de los que depende el movimiento de cada modelo: (fondo, fecha, importe)
+CAMPOS_MOVIMIENTO = {
+    Gasto: ('fondo_id', 'fecha', 'monto_total'),
+    IngresoFondo: ('fondo_id', 'fecha', 'cantidad'),
+}
+
+
+# Variaciones pendientes de aplicar dentro de ``saldos_diferidos`` (por hilo)
+_diferidos = threading.local()
+
+
+def _aplicar_a_saldos(totales):
+    """Suma a cada fondo su total con un ``UPDATE`` por fondo, en orden de ``id``.
+
+    El orden fijo hace que dos transacciones concurrentes bloqueen las filas
+    siempre en el mismo orden.
+    """
+    pendientes = getattr(_diferidos, 'totales', None)
+    if pendientes is not None:
+        for fondo_id, total in totales.items():
+            pendientes[fondo_id] += total
+        return
+    hoy = datetime.date.today()
+    for fondo_id in sorted(totales):
+        if totales[fondo_id]:
+            FondoComun.objects.filter(pk=fondo_id).update(
+                saldo=F('saldo') + totales[fondo_id], ultima_actualizacion=hoy
+            )
+    # ``update`` no dispara las señales de ``FondoComun``
+    paneles.invalidar()
+
+
+def _corregir_cierres(movimientos):
+    """Suma los movimientos con fecha anterior a cierres ya hechos a esos cierres."""
+    por_fondo = defaultdict(list)
+    for mov in movimientos:
+        por_fondo[mov.fondo_id].append(mov)
+    for fondo_id, movs in por_fondo.items():
+        cierres = CierreFondo.objects.filter(fondo_id=fondo_id, fecha__gte=min(m.fecha for m in movs))
+        for cierre in cierres.only('id', 'fecha'):
+            importe = sum((m.importe for m in movs if m.fecha <= cierre.fecha), Decimal('0'))
+            if importe:
+                CierreFondo.objects.filter(pk=cierre.pk).update(saldo=F('saldo') + importe)
+
+
+@contextmanager
+def saldos_diferidos():
+    """Agrupa en un ``UPDATE`` por fondo los saldos de todo el bloque ``with``.
+
+    Los movimientos se siguen insertando a medida que se registran, pero la
+    suma de sus importes se acumula y se aplica al salir, en la misma
+    transacción. Pensado para importaciones por lotes: el número de
+    actualizaciones del saldo no depende del número de lotes. Si ya se está
+    dentro de otro bloque, los totales se aplican al salir del exterior.
+    """
+    if getattr(_diferidos, 'totales', None) is not None:
+        yield
+        return
+    _diferidos.totales = defaultdict(Decimal)
+    try:
+        with transaction.atomic():
+            yield
+            totales, _diferidos.totales = _diferidos.totales, None
+            _aplicar_a_saldos(totales)
+    finally:
+        _diferidos.totales = None
+
+
+def registrar_movimientos(movimientos):
+    """Guarda los movimientos y actualiza el saldo de sus fondos.
+
+    Todo ocurre en una transacción: los movimientos se insertan con un único
+    ``bulk_create``, cada fondo recibe un único ``UPDATE`` con la suma de
+    sus importes y se corrigen los cierres posteriores a la fecha de algún
+    movimiento.
+    """
+    movimientos = [mov for mov in movimientos if mov.importe]
+    if not movimientos:
+        return
+    totales = defaultdict(Decimal)
+    for mov in movimientos:
+        totales[mov.fondo_id] += mov.importe
+    with transaction.atomic():
+        MovimientoFondo.objects.bulk_create(movimientos, batch_size=1000)
+        _aplicar_a_saldos(totales)
+        _corregir_cierres(movimientos)
+
+
+def _valores(obj, valores):
+    """``(fondo_id, fecha, importe)`` normalizados a partir de ``valores``."""
+    fondo, fecha, importe = CAMPOS_MOVIMIENTO[type(obj)]
+    return (
+        valores[fondo],
+        obj._meta.get_field(fecha).to_python(valores[fecha]),
+        obj._meta.get_field(importe).to_python(valores[importe]),
+    )
+
+
+def _movimiento(obj, valores, compensacion, existe=True):
+    fondo_id, fecha, importe = valores
+    if isinstance(obj, Gasto):
+        importe = -importe
+        datos = {'tipo': 'GASTO', 'descripcion': obj.descripcion, 'gasto_id': obj.pk if existe else None}
+    else:
+        descripcion = 'Aportación automática' if obj.es_automatico else 'Aportación'
+        datos = {'tipo': 'INGRESO', 'descripcion': descripcion, 'ingreso_id': obj.pk if existe else None}
+    if compensacion:
+        importe = -importe
+        datos['descripcion'] = f"Anulación: {datos['descripcion']}"
+    datos['descripcion'] = datos['descripcion'][:200]
+    return MovimientoFondo(fondo_id=fondo_id, fecha=fecha, importe=importe, **datos)
+
+
+def movimientos_por_cambio(obj, creado=False, borrado=False):
+    """Movimientos que corresponden a crear, editar o borrar un gasto o ingreso.
+
+    Al editar se compensa el movimiento anterior (con su fondo, fecha e
+    importe originales) y se registra el nuevo, solo si ha cambiado alguno
+    de los tres. Si no se conocen los valores originales no se registra
+    nada al editar.
+    """
+    campos = CAMPOS_MOVIMIENTO[type(obj)]
+    actuales = _valores(obj, {campo: getattr(obj, campo) for campo in campos})
+    guardados = getattr(obj, '_valores_originales', None)
+    originales = _valores(obj, guardados) if guardados and all(c in guardados for c in campos) else None
+
+    if creado:
+        antes, despues = None, actuales
+    elif borrado:
+        antes, despues = originales or actuales, None
+    elif originales is None or originales == actuales:
+        return []
+    else:
+        antes, despues = originales, actuales
+
+    movimientos = []
+    if antes and antes[0]:
+        movimientos.append(_movimiento(obj, antes, compensacion=True, existe=not borrado))
+    if despues and despues[0]:
+        movimientos.append(_movimiento(obj, despues, compensacion=False))
+    return movimientos
+
+
+def ajustar_saldos(movimientos, descripcion='Ajuste manual'):
+    """Registra ajustes manuales del saldo de uno o varios fondos.
+
+    ``movimientos`` es un diccionario ``{fondo_id: importe}`` o un iterable
+    de pares ``(fondo_id, importe)``; los importes negativos restan. Se
+    registra un movimiento de ajuste por fondo con fecha de hoy.
+    """
+    if isinstance(movimientos, dict):
+        movimientos = movimientos.items()
+    totales = defaultdict(Decimal)
+    for fondo_id, importe in movimientos:
+        if fondo_id is not None:
+            totales[fondo_id] += Decimal(importe)
+    hoy = datetime.date.today()
+    registrar_movimientos([
+        MovimientoFondo(fondo_id=fondo_id, fecha=hoy, importe=importe, tipo='AJUSTE', descripcion=descripcion)
+        for fondo_id, importe in totales.items()
+    ])
+
+
+def ajustar_saldo(fondo_id, importe, descripcion='Ajuste manual'):
+    """Suma ``importe`` (negativo para restar) al saldo de un fondo."""
+    ajustar_saldos([(fondo_id, importe)], descripcion)
+
+
+def fijar_saldo(fondo_id, saldo):
+    """Lleva el saldo de un fondo a ``saldo`` registrando la diferencia como ajuste."""
+    with transaction.atomic():
+        actual = FondoComun.objects.select_for_update().values_list('saldo', flat=True).get(pk=fondo_id)
+        ajustar_saldo(fondo_id, Decimal(saldo) - actual, 'Ajuste manual del saldo')
+
+
+def saldo_en(fondo_id, fecha):
+    """Saldo del fondo al final del día ``fecha`` según sus movimientos."""
+    cierre = (
+        CierreFondo.objects.filter(fondo_id=fondo_id, fecha__lte=fecha)
+        .order_by('-fecha')
+        .values('fecha', 'saldo')
+        .first()
+    )
+    movimientos = MovimientoFondo.objects.filter(fondo_id=fondo_id, fecha__lte=fecha)
+    saldo = Decimal('0')
+    if cierre:
+        movimientos = movimientos.filter(fecha__gt=cierre['fecha'])
+        saldo = cierre['saldo']
+    suma = movimientos.aggregate(suma=Sum('importe'))['suma'] or Decimal('0')
+    # SQLite suma los decimales como coma flotante
+    return (saldo + suma).quantize(Decimal('0.01'))
+
+
+def _ultimo_dia_mes(fecha):
+    return (fecha.replace(day=1) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+
+
+def cerrar_meses(hasta=None):
+    """Crea los cierres mensuales que falten hasta el mes de ``hasta``.
+
+    Por defecto se cierra hasta el último mes completo. Cada fondo recibe un
+    cierre por mes desde su primer movimiento (o desde su último cierre),
+    aunque en el mes no haya movimientos, para que el cálculo de
+    :func:`saldo_en` nunca tenga que sumar más de un mes. Devuelve el número
+    de cierres creados.
+    """
+    hasta = hasta or datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+    hasta = _ultimo_dia_mes(hasta)
+    if hasta >= datetime.date.today():
+        # El mes en curso todavía no se puede cerrar
+        hasta = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+
+    ultimos = dict(CierreFondo.objects.order_by().values_list('fondo_id').annotate(Max('fecha')))
+    nuevos = []
+    for fondo_id in FondoComun.objects.values_list('id', flat=True):
+        ultimo = ultimos.get(fondo_id)
+        movimientos = MovimientoFondo.objects.filter(fondo_id=fondo_id, fecha__lte=hasta)
+        if ultimo:
+            saldo = CierreFondo.objects.get(fondo_id=fondo_id, fecha=ultimo).saldo
+            movimientos = movimientos.filter(fecha__gt=ultimo)
+            mes = _ultimo_dia_mes(ultimo + datetime.timedelta(days=1))
+        else:
+            primero = movimientos.order_by('fecha').values_list('fecha', flat=True).first()
+            if primero is None:
+                continue
+            saldo = Decimal('0')
+            mes = _ultimo_dia_mes(primero)
+        sumas = dict(
+            movimientos.annotate(mes=TruncMonth('fecha')).order_by().values_list('mes').annotate(Sum('importe'))
+        )
+        while mes <= hasta:
+            saldo += sumas.get(mes.replace(day=1)) or Decimal('0')
+            saldo = saldo.quantize(Decimal('0.01'))
+            nuevos.append(CierreFondo(fondo_id=fondo_id, fecha=mes, saldo=saldo))
+            mes = _ultimo_dia_mes(mes + datetime.timedelta(days=1))
+    CierreFondo.objects.bulk_create(nuevos, batch_size=1000, ignore_conflicts=True)
+    return len(nuevos)
+
+
+def conciliar():
+    """Compara los saldos y los cierres de cada fondo con sus movimientos.
+
+    Devuelve una lista de diferencias ``(fondo, descripción, esperado,
+    guardado)``; una lista vacía indica que todo cuadra.
+    """
+    sumas = defaultdict(dict)
+    filas = MovimientoFondo.objects.order_by('fondo_id', 'fecha').values_list('fondo_id', 'fecha').annotate(
+        suma=Sum('importe')
+    )
+    for fondo_id, fecha, suma in filas:
+        sumas[fondo_id][fecha] = suma
+
+    cierres = defaultdict(list)
+    for cierre in CierreFondo.objects.order_by('fondo_id', 'fecha'):
+        cierres[cierre.fondo_id].append(cierre)
+
+    diferencias = []
+    for fondo in FondoComun.objects.order_by('id'):
+        acumulado = Decimal('0')
+        pendientes = iter(sorted(sumas[fondo.id].items()))
+        siguiente = next(pendientes, None)
+        for cierre in cierres[fondo.id]:
+            while siguiente and siguiente[0] <= cierre.fecha:
+                acumulado += siguiente[1]
+                siguiente = next(pendientes, None)
+            if acumulado.quantize(Decimal('0.01')) != cierre.saldo:
+                diferencias.append(
+                    (fondo, f'cierre del {cierre.fecha}', acumulado.quantize(Decimal('0.01')), cierre.saldo)
+                )
+        total = sum(sumas[fondo.id].values(), Decimal('0')).quantize(Decimal('0.01'))
+        if total != fondo.saldo:
+            diferencias.append((fondo, 'saldo', total, fondo.saldo))
+    return diferencias
+
+
+def corregir_desde_movimientos():
+    """Iguala los saldos a la suma de sus movimientos y rehace los cierres."""
+    with transaction.atomic():
+        totales = dict(
+            MovimientoFondo.objects.order_by().values_list('fondo_id').annotate(Sum('importe'))
+        )
+        for fondo in FondoComun.objects.select_for_update().order_by('id'):
+            total = (totales.get(fondo.id) or Decimal('0')).quantize(Decimal('0.01'))
+            if total != fondo.saldo:
+                FondoComun.objects.filter(pk=fondo.pk).update(saldo=total)
+        paneles.invalidar()
+        CierreFondo.objects.all().delete()
+        return cerrar_meses()
+
+
+def aportaciones_por_fondo(fondos, desde, hasta=None):
+    """Aportaciones a cada fondo en el intervalo ``[desde, hasta)``.
+
+    Devuelve un diccionario ``{fondo_id: {'total', 'sara', 'adri'}}`` con una
+    entrada por cada fondo de ``fondos`` (a cero si no recibió ingresos).
+    Los ingresos automáticos o de otros usuarios cuentan solo en el total.
+    """
+    # Filtrar por fondo permite recorrer el índice (fondo, fecha) por rangos
+    ingresos = IngresoFondo.objects.filter(fondo__in=[fondo.id for fondo in fondos], fecha__gte=desde)
+    if hasta is not None:
+        ingresos = ingresos.filter(fecha__lt=hasta)
+    filas = (
+        ingresos.order_by()
+        .values('fondo_id', 'usuario__username')
+        .annotate(suma=Sum('cantidad'))
+    )
+
+    sumas = defaultdict(lambda: defaultdict(Decimal))
+    for fila in filas:
+        por_fondo = sumas[fila['fondo_id']]
+        por_fondo['total'] += fila['suma'] or Decimal('0')
+        if fila['usuario__username'] in ('sara', 'adri'):
+            por_fondo[fila['usuario__username']] += fila['suma'] or Decimal('0')
+
+    return {
+        fondo.id: {
+            clave: sumas[fondo.id][clave].quantize(Decimal('0.01'))
+            for clave in ('total', 'sara', 'adri')
+        }
+        for fondo in fondos
+    }
+
+
+# Granularidades del historial: nombre -> unidad de ``Trunc``
+GRANULARIDADES = {'dia': 'day', 'semana': 'week', 'mes': 'month'}
+
+
+class SumaAcumulada(Func):
+    """``SUM`` utilizable como función de ventana sobre un agregado.
+
+    ``Window(Sum(...))`` no admite un ``Sum`` ya agrupado; esta función
+    genera ``SUM(SUM(importe)) OVER (...)``, válido en SQLite y PostgreSQL.
+    """
+
+    function = 'SUM'
+    window_compatible = True
+
+
+def granularidad_para(desde, hasta):
+    """Granularidad del historial según la longitud del intervalo.
+
+    Más de dos años se agrupa por meses, más de tres meses por semanas y el
+    resto por días, de modo que la serie nunca tiene más de unos cientos de
+    puntos por fondo.
+    """
+    dias = (hasta - desde).days
+    if dias > 2 * 366:
+        return 'mes'
+    if dias > 92:
+        return 'semana'
+    return 'dia'
+
+
+def _inicio_periodo(fecha, granularidad):
+    """Primer día del periodo de ``granularidad`` que contiene ``fecha``."""
+    if granularidad == 'mes':
+        return fecha.replace(day=1)
+    if granularidad == 'semana':
+        return fecha - datetime.timedelta(days=fecha.weekday())
+    return fecha
+
+
+def historial_saldos(desde, hasta, granularidad=None):
+    """Saldo de cada fondo al final de cada periodo de ``[desde, hasta)``.
+
+    ``granularidad`` es ``'dia'``, ``'semana'`` o ``'mes'``; si no se indica
+    se elige con :func:`granularidad_para`. Devuelve filas ``{'fondo_id',
+    'periodo', 'variacion', 'saldo'}`` ordenadas por fondo y periodo, donde
+    ``periodo`` es el primer día del periodo, ``variacion`` la suma de sus
+    movimientos y ``saldo`` el saldo acumulado al terminar. Los periodos sin
+    movimientos no aparecen (el saldo no cambia).
+
+    Los movimientos anteriores a ``desde`` se suman en el primer periodo, de
+    modo que el saldo acumulado parte del saldo real y no de cero sin
+    necesidad de filtrar sobre el resultado de la ventana.
+    """
+    granularidad = granularidad or granularidad_para(desde, hasta)
+    primero = Value(_inicio_periodo(desde, granularidad), output_field=DateField())
+    periodo = Greatest(Trunc('fecha', GRANULARIDADES[granularidad], output_field=DateField()), primero)
+    return (
+        MovimientoFondo.objects.filter(fecha__lt=hasta)
+        .annotate(periodo=periodo)
+        .values('fondo_id', 'periodo')
+        .annotate(variacion=Sum('importe'))
+        # La ventana se añade después de agrupar para que no entre en el GROUP BY
+        .annotate(
+            saldo=Window(
+                SumaAcumulada(Sum('importe')),
+                partition_by=F('fondo_id'),
+                order_by=F('periodo').asc(),
+            )
+        )
+        .order_by('fondo_id', 'periodo')
+    )
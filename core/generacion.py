@@ -0,0 +1,250 @@
+"""
+Datos sintéticos de un hogar para pruebas de rendimiento.
+
+:func:`generar` crea el historial de varios años de las dos usuarias:
+gastos del día a día repartidos por categorías y comercios habituales,
+las ocurrencias pasadas de unos cuantos ``GastoRecurrente`` (alquiler,
+suministros, suscripciones), las aportaciones mensuales de cada usuaria
+a los fondos y las de varios ``ObjetivoAhorro``. Con la misma semilla se
+generan siempre los mismos datos.
+
+Se inserta igual que en :func:`core.importacion.importar`: con
+``bulk_create`` por lotes, enviando ``gastos_creados_en_bloque`` por cada
+lote de gastos y registrando los movimientos de los ingresos en bloque,
+dentro de una única transacción y con los saldos diferidos. Así el
+resumen mensual, las liquidaciones, los fondos y los índices de búsqueda
+quedan como si los datos se hubieran creado desde la aplicación, y la
+memoria no depende del número de gastos.
+"""
+
+import datetime
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import categorias
+from .fondos import movimientos_por_cambio, registrar_movimientos, saldos_diferidos
+from .models import (
+    FondoComun,
+    Gasto,
+    GastoRecurrente,
+    IngresoFondo,
+    ObjetivoAhorro,
+    gastos_creados_en_bloque,
+    normalizar_comercio,
+)
+from .recurrentes import ocurrencias_pendientes, olvidar_periodo_aplicado
+
+TAMANO_LOTE = 2000
+USUARIAS = ('sara', 'adri')
+
+# Comercios habituales de cada categoría (por nombre)
+COMERCIOS = {
+    'Supermercado': ['Mercadona', 'Lidl', 'Carrefour Express', 'Dia', 'Alcampo', 'Aldi', 'Consum', 'Eroski'],
+    'Gastos piso': ['Alquiler', 'Iberdrola', 'Endesa Luz', 'Canal Isabel II', 'Movistar Fibra', 'Comunidad Vecinos',
+                    'Seguro Hogar', 'Naturgy Gas'],
+    'Viajes': ['Renfe', 'Iberia', 'Vueling', 'Booking.com', 'Airbnb', 'Ryanair', 'BlaBlaCar', 'Hotel Centro'],
+    'Compras piso': ['Ikea', 'Leroy Merlin', 'Amazon', 'MediaMarkt', 'El Corte Inglés', 'Bauhaus', 'Zara Home'],
+    'Ocio': ['Netflix', 'Spotify', 'Cines Yelmo', 'Restaurante', 'Bar La Plaza', 'Teatro', 'Entradas Concierto'],
+    'Otros': ['Farmacia', 'Peluquería', 'Regalo', 'Correos', 'Gasolinera Repsol', 'Parking', 'Bizum'],
+}
+# Palabras que aparecen en las descripciones de cualquier categoría
+RUIDO = ['compra', 'pago', 'tarjeta', 'Madrid', 'Barcelona', 'recibo', 'cuota', 'online', 'SL', 'SA']
+# Peso de cada categoría en los gastos del día a día e importes mínimo y máximo
+PESOS = {'Supermercado': 40, 'Gastos piso': 8, 'Viajes': 5, 'Compras piso': 7, 'Ocio': 25, 'Otros': 15}
+IMPORTES = {
+    'Supermercado': (5, 150),
+    'Gastos piso': (20, 200),
+    'Viajes': (20, 600),
+    'Compras piso': (10, 400),
+    'Ocio': (3, 80),
+    'Otros': (2, 60),
+}
+# (nombre, importe, periodicidad, categoría, tipo de fondo)
+RECURRENTES = [
+    ('Alquiler', '850.00', 'MENSUAL', 'Gastos piso', 'GASTOS'),
+    ('Movistar Fibra', '35.90', 'MENSUAL', 'Gastos piso', 'GASTOS'),
+    ('Seguro Hogar', '240.00', 'ANUAL', 'Gastos piso', 'GASTOS'),
+    ('Netflix', '13.99', 'MENSUAL', 'Ocio', None),
+    ('Spotify', '16.99', 'MENSUAL', 'Ocio', None),
+]
+# (nombre, importe objetivo, aportación mensual, tipo de fondo)
+OBJETIVOS = [
+    ('Vacaciones', '3000.00', '150.00', 'VIAJES'),
+    ('Sofá nuevo', '1200.00', '50.00', 'COMPRAS'),
+    ('Colchón', '6000.00', '200.00', 'AHORRO'),
+]
+# Aportación mensual de cada usuaria a cada fondo
+APORTACIONES = {'GASTOS': '500.00', 'SUPERMERCADO': '200.00', 'VIAJES': '100.00', 'COMPRAS': '100.00'}
+
+
+@dataclass
+class ResultadoGeneracion:
+    gastos: int
+    recurrentes: int
+    ingresos: int
+    objetivos: int
+
+
+def descripcion_aleatoria(categoria, aleatorio):
+    """Descripción de un gasto de ``categoria`` (por nombre): comercio, ruido y referencia."""
+    partes = [aleatorio.choice(COMERCIOS.get(categoria) or COMERCIOS['Otros'])]
+    partes += aleatorio.sample(RUIDO, aleatorio.randint(0, 2))
+    if aleatorio.random() < 0.3:
+        partes.append(str(aleatorio.randint(1000, 99999)))
+    aleatorio.shuffle(partes)
+    return ' '.join(partes)
+
+
+def _meses(desde, hasta):
+    mes = desde.replace(day=1)
+    while mes <= hasta:
+        yield mes
+        mes = (mes + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _preparar():
+    """Usuarias, fondos (uno por tipo) y categorías por nombre, creando lo que falte."""
+    usuarias = []
+    for nombre in USUARIAS:
+        usuaria, creada = User.objects.get_or_create(username=nombre)
+        if creada:
+            usuaria.set_unusable_password()
+            usuaria.save(update_fields=['password'])
+        usuarias.append(usuaria)
+    fondos = {}
+    for tipo, _ in FondoComun.TIPOS_FONDO:
+        fondo = FondoComun.objects.filter(tipo=tipo).order_by('id').first()
+        fondos[tipo] = fondo or FondoComun.objects.create(tipo=tipo)
+    por_nombre = {categoria.nombre: categoria for categoria in categorias.todas()}
+    return usuarias, fondos, por_nombre
+
+
+def generar(gastos=1000, anos=3, semilla=1, hasta=None, tamano_lote=TAMANO_LOTE):
+    """Crea ``gastos`` gastos del día a día repartidos en los ``anos`` años anteriores a ``hasta``.
+
+    Además de esos gastos se crean los recurrentes y sus ocurrencias, las
+    aportaciones mensuales de cada usuaria a los fondos y los objetivos de
+    ahorro con sus aportaciones automáticas, todo hasta ``hasta`` (hoy por
+    defecto). Los recurrentes y objetivos quedan aplicados hasta esa
+    fecha, así que las vistas no generan nada al abrirse.
+    """
+    aleatorio = random.Random(semilla)
+    hasta = hasta or datetime.date.today()
+    desde = hasta - datetime.timedelta(days=round(365.25 * anos))
+    dias = (hasta - desde).days
+
+    with transaction.atomic(), saldos_diferidos():
+        usuarias, fondos, por_nombre = _preparar()
+        nombres = [nombre for nombre in PESOS if nombre in por_nombre]
+        if not nombres:
+            raise ValueError('No existen las categorías iniciales')
+
+        recurrentes = []
+        for nombre, monto, periodicidad, categoria, tipo in RECURRENTES:
+            if categoria not in por_nombre:
+                continue
+            recurrentes.append(GastoRecurrente(
+                nombre=nombre,
+                monto=Decimal(monto),
+                periodicidad=periodicidad,
+                categoria=por_nombre[categoria],
+                fondo=fondos[tipo] if tipo else None,
+                fecha_inicio=desde + datetime.timedelta(days=aleatorio.randint(0, 27)),
+            ))
+        ocurrencias = []
+        for recurrente in recurrentes:
+            fechas, _ = ocurrencias_pendientes(recurrente, hasta)
+            recurrente.ultima_fecha_aplicada = fechas[-1] if fechas else None
+            ocurrencias.extend((recurrente, fecha) for fecha in fechas)
+        GastoRecurrente.objects.bulk_create(recurrentes)
+
+        objetivos = ObjetivoAhorro.objects.bulk_create([
+            ObjetivoAhorro(
+                nombre=nombre,
+                monto_objetivo=Decimal(monto_objetivo),
+                aporte_mensual=Decimal(aporte),
+                fondo_destino=fondos[tipo],
+                ultimo_ano_aplicado=hasta.year,
+                ultimo_mes_aplicado=hasta.month,
+            )
+            for nombre, monto_objetivo, aporte, tipo in OBJETIVOS
+        ])
+
+        # Aportaciones de cada mes. ``IngresoFondo.fecha`` es ``auto_now_add``
+        # y ``bulk_create`` la sobrescribe: se corrige con un ``UPDATE`` por mes
+        ingresos = 0
+        for mes in _meses(desde, hasta):
+            del_mes = [
+                IngresoFondo(fondo=fondos[tipo], cantidad=Decimal(cantidad), usuario=usuaria)
+                for tipo, cantidad in APORTACIONES.items()
+                for usuaria in usuarias
+            ] + [
+                IngresoFondo(
+                    fondo_id=objetivo.fondo_destino_id,
+                    cantidad=objetivo.aporte_mensual,
+                    es_automatico=True,
+                    objetivo=objetivo,
+                    periodo=mes,
+                )
+                for objetivo in objetivos
+            ]
+            IngresoFondo.objects.bulk_create(del_mes)
+            IngresoFondo.objects.filter(pk__in=[ingreso.pk for ingreso in del_mes]).update(fecha=mes)
+            for ingreso in del_mes:
+                ingreso.fecha = mes
+            registrar_movimientos(
+                [mov for ingreso in del_mes for mov in movimientos_por_cambio(ingreso, creado=True)]
+            )
+            ingresos += len(del_mes)
+
+        # Gastos del día a día y ocurrencias de los recurrentes, por orden de fecha
+        fechas = sorted(desde + datetime.timedelta(days=aleatorio.randint(0, dias)) for _ in range(gastos))
+        filas = sorted(
+            [(fecha, None) for fecha in fechas] + [(fecha, recurrente) for recurrente, fecha in ocurrencias],
+            key=lambda fila: fila[0],
+        )
+        pesos = [PESOS[nombre] for nombre in nombres]
+        lote = []
+        for fecha, recurrente in filas:
+            if recurrente is not None:
+                descripcion = f'[Recurrente] {recurrente.nombre}'
+                gasto = Gasto(
+                    monto_total=recurrente.monto,
+                    categoria_id=recurrente.categoria_id,
+                    fondo_id=recurrente.fondo_id,
+                    recurrente=recurrente,
+                    periodo=fecha,
+                )
+            else:
+                nombre = aleatorio.choices(nombres, pesos)[0]
+                categoria = por_nombre[nombre]
+                minimo, maximo = IMPORTES[nombre]
+                tipo = categorias.tipo_fondo(categoria)
+                descripcion = descripcion_aleatoria(nombre, aleatorio)
+                gasto = Gasto(
+                    monto_total=Decimal(aleatorio.randint(minimo * 100, maximo * 100)) / 100,
+                    categoria_id=categoria.id,
+                    # La mayoría de los gastos con fondo asociado salen de él
+                    fondo_id=fondos[tipo].id if tipo and aleatorio.random() < 0.8 else None,
+                )
+            gasto.descripcion = descripcion
+            # ``bulk_create`` no pasa por ``Gasto.save``
+            gasto.comercio_normalizado = normalizar_comercio(descripcion)
+            gasto.fecha = fecha
+            gasto.pagado_por = aleatorio.choice(usuarias)
+            lote.append(gasto)
+            if len(lote) >= tamano_lote:
+                Gasto.objects.bulk_create(lote)
+                gastos_creados_en_bloque.send(sender=Gasto, gastos=lote)
+                lote = []
+        if lote:
+            Gasto.objects.bulk_create(lote)
+            gastos_creados_en_bloque.send(sender=Gasto, gastos=lote)
+
+    # ``bulk_create`` no emite la señal que olvida la próxima ocurrencia conocida
+    olvidar_periodo_aplicado()
+    return ResultadoGeneracion(gastos, len(ocurrencias), ingresos, len(objetivos))
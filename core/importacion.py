@@ -0,0 +1,386 @@
+"""
+Importación de extractos bancarios como gastos.
+
+Se admiten tres formatos:
+
+* CSV con cabecera (separado por ``;`` o ``,``) con columnas de fecha,
+  concepto e importe y, opcionalmente, categoría.
+* Norma 43 (cuaderno 43 de la AEB), el fichero de movimientos que
+  exportan los bancos españoles.
+* OFX 1.x (SGML) u OFX 2.x (XML).
+
+Los lectores recorren el fichero como un flujo y producen un
+:class:`MovimientoBancario` cada vez, sin cargarlo entero en memoria. Solo
+los cargos (importes negativos) se convierten en gastos; los abonos se
+cuentan y se ignoran.
+
+:func:`importar` inserta los gastos con ``bulk_create`` en lotes de tamaño
+fijo dentro de una única transacción y, al terminar, envía
+``gastos_creados_en_bloque`` una sola vez con todos ellos, de modo que el
+resumen mensual, las liquidaciones, los movimientos de los fondos, los
+índices de búsqueda y sugerencias y el clasificador se mantienen igual que
+al crear un gasto desde el formulario, con un coste que no depende del
+número de lotes. El saldo de los fondos se actualiza con un único
+``UPDATE`` por fondo al final (ver :func:`core.fondos.saldos_diferidos`).
+
+El separador decimal de los importes se deduce de cada fichero (ver
+:func:`_con_importes`). Se usa desde
+``python manage.py importar_extracto`` y desde la vista
+``importar_extracto``.
+"""
+
+import codecs
+import csv
+import datetime
+import functools
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from . import categorias, clasificador
+from .fondos import saldos_diferidos
+from .models import FondoComun, Gasto, gastos_creados_en_bloque, normalizar_comercio
+
+FORMATOS = ('csv', 'norma43', 'ofx')
+# Codificación habitual de cada formato
+CODIFICACIONES = {'csv': 'utf-8-sig', 'norma43': 'latin-1', 'ofx': 'latin-1'}
+EXTENSIONES = {'csv': 'csv', 'n43': 'norma43', 'aeb': 'norma43', 'q43': 'norma43', 'ofx': 'ofx', 'qfx': 'ofx'}
+TAMANO_LOTE = 1000
+# Categoría de los gastos cuyo extracto no indica ninguna (código inicial)
+CODIGO_POR_DEFECTO = '5'  # Otros
+
+MovimientoBancario = namedtuple('MovimientoBancario', 'linea fecha descripcion importe categoria')
+ResultadoImportacion = namedtuple('ResultadoImportacion', 'creados ignorados por_fondo')
+
+
+class ErrorImportacion(ValueError):
+    """Una línea del extracto no se puede interpretar."""
+
+    def __init__(self, linea, mensaje):
+        super().__init__(f'Línea {linea}: {mensaje}')
+        self.linea = linea
+
+
+def detectar_formato(nombre):
+    """Formato de un fichero según su extensión (``None`` si no se reconoce)."""
+    extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+    return EXTENSIONES.get(extension)
+
+
+def _limpiar_importe(texto):
+    return texto.replace('€', '').replace(' ', '').replace('\xa0', '')
+
+
+def _separador_decimal(texto):
+    """Separador decimal que indica un importe: ``''`` si no tiene ninguno y ``None`` si es ambiguo.
+
+    Un único separador seguido de tres cifras (``1,234``, ``1.234``) puede
+    ser cualquiera de los dos.
+    """
+    texto = _limpiar_importe(texto)
+    separadores = [caracter for caracter in texto if caracter in ',.']
+    if not separadores:
+        return ''
+    ultimo = separadores[-1]
+    if separadores.count(ultimo) > 1:
+        # «1.234.567»: el separador repetido solo puede ser de miles
+        return ',' if ultimo == '.' else '.'
+    if len(separadores) == 1 and len(texto.rpartition(ultimo)[2]) == 3:
+        return None
+    return ultimo
+
+
+def _importe(texto, decimal=None):
+    """Importe de un extracto: admite ``-1.234,56``, ``-1,234.56``, ``-1234.56`` o ``1.234,56 €``.
+
+    ``decimal`` es el separador decimal del fichero; si no se indica, el
+    separador decimal es el último ``,`` o ``.`` del importe y el otro
+    separa los miles, y los importes ambiguos (ver
+    :func:`_separador_decimal`) se rechazan.
+    """
+    texto = _limpiar_importe(texto)
+    if decimal is None:
+        decimal = _separador_decimal(texto)
+        if decimal is None:
+            raise ValueError(f'importe ambiguo: {texto!r} (no se sabe si separa miles o decimales)')
+        if not decimal:
+            return Decimal(texto)
+    miles = '.' if decimal == ',' else ','
+    entero, _, decimales = texto.rpartition(decimal) if decimal in texto else (texto, '', '')
+    if decimal in entero or miles in decimales:
+        raise ValueError(f'importe no válido: {texto!r}')
+    if miles in entero:
+        if not re.fullmatch(rf'[+-]?\d{{1,3}}(?:{re.escape(miles)}\d{{3}})+', entero):
+            raise ValueError(f'importe no válido: {texto!r}')
+        entero = entero.replace(miles, '')
+    return Decimal(f'{entero}.{decimales}' if decimales else entero)
+
+
+def _con_importes(movimientos):
+    """Convierte los importes de ``movimientos`` (texto) con el separador decimal del fichero.
+
+    El separador es el que indica el primer importe que no es ambiguo; los
+    ambiguos anteriores esperan a conocerlo y, si ningún importe del
+    fichero lo aclara, se leen con la coma decimal de los bancos españoles.
+    """
+    decimal = None
+    pendientes = []
+
+    def convertir(movimiento):
+        try:
+            return movimiento._replace(importe=_importe(movimiento.importe, decimal))
+        except (ValueError, InvalidOperation) as error:
+            raise ErrorImportacion(movimiento.linea, error) from error
+
+    for movimiento in movimientos:
+        if decimal is None:
+            separador = _separador_decimal(movimiento.importe)
+            if separador is None or pendientes and not separador:
+                # Ambiguo, o sin separadores detrás de uno ambiguo: se mantiene el orden
+                pendientes.append(movimiento)
+                continue
+            decimal = separador or None
+        for pendiente in pendientes:
+            yield convertir(pendiente)
+        pendientes = []
+        yield convertir(movimiento)
+    decimal = ','
+    for pendiente in pendientes:
+        yield convertir(pendiente)
+
+
+@functools.lru_cache(maxsize=1024)
+def _fecha(texto):
+    # Los extractos repiten mucho las fechas: se interpreta cada texto una vez
+    texto = texto.strip()
+    for formato in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y'):
+        try:
+            return datetime.datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f'fecha no válida: {texto!r}')
+
+
+# Nombres de columna aceptados en los CSV (en minúsculas y sin tildes)
+COLUMNAS_CSV = {
+    'fecha': ('fecha', 'fecha operacion', 'f. operacion', 'fecha valor', 'date'),
+    'descripcion': ('concepto', 'descripcion', 'movimiento', 'description', 'detalle'),
+    'importe': ('importe', 'cantidad', 'amount', 'importe (eur)'),
+    'categoria': ('categoria', 'category'),
+}
+
+
+def _sin_tildes(texto):
+    return texto.strip().lower().translate(str.maketrans('áéíóú', 'aeiou'))
+
+
+def leer_csv(lineas):
+    """Movimientos de un CSV con cabecera; ``lineas`` es un fichero de texto."""
+    return _con_importes(_filas_csv(lineas))
+
+
+def _filas_csv(lineas):
+    lineas = iter(lineas)
+    cabecera = next(lineas, '')
+    separador = ';' if cabecera.count(';') >= cabecera.count(',') else ','
+    nombres = [_sin_tildes(nombre) for nombre in next(csv.reader([cabecera], delimiter=separador), [])]
+    posiciones = {}
+    for campo, alias in COLUMNAS_CSV.items():
+        for nombre in alias:
+            if nombre in nombres:
+                posiciones[campo] = nombres.index(nombre)
+                break
+    faltan = [campo for campo in ('fecha', 'descripcion', 'importe') if campo not in posiciones]
+    if faltan:
+        raise ErrorImportacion(1, f'faltan las columnas {", ".join(faltan)}')
+
+    for numero, fila in enumerate(csv.reader(lineas, delimiter=separador), start=2):
+        if not any(celda.strip() for celda in fila):
+            continue
+        try:
+            yield MovimientoBancario(
+                linea=numero,
+                fecha=_fecha(fila[posiciones['fecha']]),
+                descripcion=fila[posiciones['descripcion']].strip(),
+                importe=fila[posiciones['importe']],
+                categoria=fila[posiciones['categoria']].strip() if 'categoria' in posiciones else None,
+            )
+        except (IndexError, ValueError) as error:
+            raise ErrorImportacion(numero, error) from error
+
+
+def leer_norma43(lineas):
+    """Movimientos de un fichero Norma 43.
+
+    Cada movimiento es un registro ``22`` (fecha de operación en las
+    posiciones 11-16 como AAMMDD, clave debe/haber en la 28 e importe con
+    dos decimales en las 29-42) seguido de hasta cinco registros ``23`` con
+    el concepto. Si no hay registros ``23`` se usa la segunda referencia.
+    """
+    actual = None
+    conceptos = []
+
+    def terminar():
+        descripcion = ' '.join(conceptos) or actual['referencia']
+        return MovimientoBancario(actual['linea'], actual['fecha'], descripcion, actual['importe'], None)
+
+    for numero, linea in enumerate(lineas, start=1):
+        registro = linea[:2]
+        if registro == '23' and actual is not None:
+            conceptos.extend(parte.strip() for parte in (linea[4:42], linea[42:80]) if parte.strip())
+            continue
+        if actual is not None:
+            yield terminar()
+            actual, conceptos = None, []
+        if registro != '22':
+            continue
+        try:
+            fecha = datetime.datetime.strptime(linea[10:16], '%y%m%d').date()
+            importe = Decimal(int(linea[28:42])) / 100
+        except ValueError as error:
+            raise ErrorImportacion(numero, error) from error
+        if linea[27] == '1':  # debe: cargo en cuenta
+            importe = -importe
+        actual = {'linea': numero, 'fecha': fecha, 'importe': importe, 'referencia': linea[64:80].strip()}
+    if actual is not None:
+        yield terminar()
+
+
+# Etiqueta OFX: ``<NOMBRE>valor`` (SGML, sin cierre) o ``</NOMBRE>``
+ETIQUETA_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def _etiquetas_ofx(lineas):
+    """Etiquetas de un OFX como ``(cierre, nombre, valor)``, aunque estén en una línea."""
+    pendiente = ''
+    numero = 0
+    for numero, linea in enumerate(lineas, start=1):
+        pendiente += linea
+        corte = pendiente.rfind('<')
+        if corte <= 0:
+            continue
+        # Lo que sigue al último «<» puede continuar en la línea siguiente
+        completo, pendiente = pendiente[:corte], pendiente[corte:]
+        for cierre, nombre, valor in ETIQUETA_OFX.findall(completo):
+            yield numero, bool(cierre), nombre.upper(), valor.strip()
+    for cierre, nombre, valor in ETIQUETA_OFX.findall(pendiente):
+        yield numero, bool(cierre), nombre.upper(), valor.strip()
+
+
+def leer_ofx(lineas):
+    """Movimientos (``<STMTTRN>``) de un fichero OFX 1.x o 2.x."""
+    return _con_importes(_transacciones_ofx(lineas))
+
+
+def _transacciones_ofx(lineas):
+    actual = None
+    for numero, cierre, nombre, valor in _etiquetas_ofx(lineas):
+        if nombre == 'STMTTRN':
+            if not cierre:
+                actual = {'linea': numero}
+                continue
+            if actual is None:
+                continue
+            try:
+                yield MovimientoBancario(
+                    linea=actual['linea'],
+                    fecha=datetime.datetime.strptime(actual['DTPOSTED'][:8], '%Y%m%d').date(),
+                    descripcion=actual.get('NAME') or actual.get('MEMO', ''),
+                    importe=actual['TRNAMT'],
+                    categoria=None,
+                )
+            except (KeyError, ValueError) as error:
+                raise ErrorImportacion(actual['linea'], f'movimiento incompleto ({error})') from error
+            actual = None
+        elif actual is not None and not cierre:
+            actual.setdefault(nombre, valor)
+
+
+LECTORES = {'csv': leer_csv, 'norma43': leer_norma43, 'ofx': leer_ofx}
+
+
+def abrir(fichero_binario, formato, codificacion=None):
+    """Envuelve un fichero binario para leerlo como texto línea a línea."""
+    lector = codecs.getreader(codificacion or CODIFICACIONES[formato])
+    return lector(fichero_binario, errors='replace')
+
+
+def importar(lineas, formato, pagador, categoria=None, fondo=None, tamano_lote=TAMANO_LOTE):
+    """Crea un gasto por cada cargo del extracto ``lineas``.
+
+    ``categoria`` es la categoría de los movimientos sin columna de
+    categoría. Si no se indica, se usa la que proponga ``core.clasificador``
+    para la descripción y, si no propone ninguna, «Otros». Si no se indica
+    ``fondo``, cada gasto sale del fondo asociado a su categoría, igual que
+    en ``crear_gasto``.
+    Un error en cualquier línea cancela toda la importación.
+    """
+    if formato not in LECTORES:
+        raise ValueError(f'Formato desconocido: {formato}')
+    por_defecto = categoria or categorias.por_codigo(CODIGO_POR_DEFECTO)
+    if por_defecto is None:
+        raise ValueError('No existe la categoría por defecto')
+    fondos = dict(FondoComun.objects.values_list('tipo', 'id'))
+    # Sin categoría elegida se propone una para cada movimiento
+    modelo = clasificador.modelo() if categoria is None else None
+    # Los extractos repiten pocas categorías: se resuelve cada texto (o id) una vez
+    resueltas = {}
+    propuestas = {}
+
+    creados = ignorados = 0
+    por_fondo = {}
+    lote = []
+    guardados = []
+
+    def guardar_lote():
+        Gasto.objects.bulk_create(lote)
+        guardados.extend(lote)
+
+    with transaction.atomic(), saldos_diferidos():
+        for movimiento in LECTORES[formato](lineas):
+            if movimiento.importe >= 0:
+                ignorados += 1
+                continue
+            categoria_fila = por_defecto
+            if movimiento.categoria:
+                if movimiento.categoria not in resueltas:
+                    resueltas[movimiento.categoria] = categorias.resolver(movimiento.categoria)
+                categoria_fila = resueltas[movimiento.categoria]
+                if categoria_fila is None:
+                    raise ErrorImportacion(movimiento.linea, f'categoría desconocida: {movimiento.categoria!r}')
+            elif modelo is not None:
+                propuesta = modelo.predecir(clasificador.palabras(movimiento.descripcion))
+                if propuesta is not None:
+                    if propuesta not in propuestas:
+                        propuestas[propuesta] = categorias.por_id(propuesta) or por_defecto
+                    categoria_fila = propuestas[propuesta]
+            fondo_id = fondo.id if fondo else fondos.get(categorias.tipo_fondo(categoria_fila))
+            descripcion = movimiento.descripcion[:200] or 'Movimiento bancario'
+            lote.append(
+                Gasto(
+                    descripcion=descripcion,
+                    # ``bulk_create`` no pasa por ``Gasto.save``
+                    comercio_normalizado=normalizar_comercio(descripcion),
+                    monto_total=-movimiento.importe,
+                    categoria_id=categoria_fila.id,
+                    pagado_por=pagador,
+                    fecha=movimiento.fecha,
+                    fondo_id=fondo_id,
+                )
+            )
+            if fondo_id:
+                por_fondo[fondo_id] = por_fondo.get(fondo_id, Decimal('0')) - movimiento.importe
+            creados += 1
+            if len(lote) >= tamano_lote:
+                guardar_lote()
+                lote = []
+        if lote:
+            guardar_lote()
+        if guardados:
+            # ``bulk_create`` no emite ``post_save``: el resumen, las
+            # liquidaciones, los fondos, los índices y el clasificador se
+            # actualizan una sola vez con todos los gastos del extracto
+            gastos_creados_en_bloque.send(sender=Gasto, gastos=guardados)
+    return ResultadoImportacion(creados, ignorados, por_fondo)
@@ -0,0 +1,42 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.recurrentes import aplicar_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera todas las ocurrencias pendientes de los gastos recurrentes y las '
+        'aportaciones de los objetivos de ahorro, una sola vez cada una.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasta', type=datetime.date.fromisoformat, default=None,
+            help='Fecha límite (AAAA-MM-DD) de las ocurrencias a generar; por defecto, hoy',
+        )
+        parser.add_argument(
+            '--simular', action='store_true',
+            help='Muestra lo que se generaría sin guardar nada',
+        )
+
+    def handle(self, *args, **options):
+        resultado = aplicar_pendientes(options['hasta'], simular=options['simular'])
+        if resultado is None:
+            raise CommandError('Los recurrentes se están aplicando en otro proceso; inténtalo de nuevo')
+
+        for gasto in resultado['gastos']:
+            fondo = f" (fondo {gasto.fondo_id})" if gasto.fondo_id else ''
+            self.stdout.write(f"{gasto.fecha}  {gasto.descripcion}: {gasto.monto_total}€{fondo}")
+        for ingreso in resultado['ingresos']:
+            self.stdout.write(
+                f"{ingreso.periodo:%Y-%m}  [Objetivo] {ingreso.objetivo.nombre}: "
+                f"+{ingreso.cantidad}€ (fondo {ingreso.fondo_id})"
+            )
+
+        accion = 'Se generarían' if options['simular'] else 'Generados'
+        self.stdout.write(self.style.SUCCESS(
+            f"{accion} {len(resultado['gastos'])} gastos y {len(resultado['ingresos'])} ingresos. "
+            f"Próxima ocurrencia: {resultado['proxima'] or '-'}"
+        ))
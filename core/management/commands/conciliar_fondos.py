@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import fondos
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el saldo y los cierres mensuales de cada fondo con la suma de sus '
+        'movimientos y muestra las diferencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cerrar', action='store_true',
+            help='Crea antes los cierres mensuales que falten (pensado para un cron mensual)',
+        )
+        parser.add_argument(
+            '--corregir', action='store_true',
+            help='Iguala los saldos a la suma de sus movimientos y rehace los cierres',
+        )
+
+    def handle(self, *args, **options):
+        if options['cerrar']:
+            self.stdout.write(f'Cierres creados: {fondos.cerrar_meses()}')
+
+        diferencias = fondos.conciliar()
+        for fondo, concepto, esperado, guardado in diferencias:
+            self.stderr.write(
+                f'{fondo.get_tipo_display()} ({fondo.id}), {concepto}: movimientos {esperado}€, '
+                f'guardado {guardado}€ (diferencia {guardado - esperado}€)'
+            )
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS('Los saldos y cierres coinciden con los movimientos'))
+            return
+
+        if not options['corregir']:
+            raise CommandError(f'Hay {len(diferencias)} diferencias con los movimientos')
+        cierres = fondos.corregir_desde_movimientos()
+        self.stdout.write(self.style.WARNING(f'Saldos corregidos y {cierres} cierres rehechos'))
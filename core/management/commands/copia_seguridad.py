@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core.copias import crear_copia
+
+
+class Command(BaseCommand):
+    help = (
+        'Guarda todos los datos del hogar (usuarias y perfiles, categorías, fondos, '
+        'gastos, ingresos, recurrentes, objetivos, liquidaciones y movimientos) en un '
+        'fichero JSON Lines comprimido con gzip, escribiendo a medida que se leen.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='Fichero de destino (p. ej. copia.jsonl.gz); «-» para la salida estándar')
+
+    def handle(self, *args, **options):
+        destino = sys.stdout.buffer if options['fichero'] == '-' else options['fichero']
+        filas = crear_copia(destino)
+        resumen = ', '.join(f'{modelo}: {numero}' for modelo, numero in filas.items())
+        self.stderr.write(self.style.SUCCESS(f'Copia creada ({resumen})'))
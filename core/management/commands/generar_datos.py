@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.generacion import generar
+from core.models import Gasto
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera datos sintéticos de un hogar (gastos, recurrentes, ingresos a los fondos y '
+        'objetivos de ahorro) de varios años, para medir el rendimiento. Todo se crea en una '
+        'transacción.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gastos', type=int, default=1000,
+            help='Gastos del día a día que se crean, sin contar los recurrentes (por defecto 1000)',
+        )
+        parser.add_argument('--anos', type=int, default=3, help='Años de historial (por defecto 3)')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de los datos aleatorios')
+        parser.add_argument(
+            '--anadir', action='store_true',
+            help='Añade los datos aunque ya haya gastos (por defecto solo se genera en una base vacía)',
+        )
+
+    def handle(self, *args, **options):
+        if options['gastos'] < 0 or options['anos'] < 1:
+            raise CommandError('--gastos no puede ser negativo y --anos debe ser al menos 1')
+        if Gasto.objects.exists() and not options['anadir']:
+            raise CommandError('La base de datos ya tiene gastos; usa --anadir para generar datos igualmente')
+        try:
+            resultado = generar(options['gastos'], options['anos'], options['semilla'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Creados {resultado.gastos} gastos, {resultado.recurrentes} gastos recurrentes, '
+            f'{resultado.ingresos} ingresos y {resultado.objetivos} objetivos de ahorro'
+        ))
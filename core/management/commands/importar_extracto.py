@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import categorias
+from core.importacion import FORMATOS, ErrorImportacion, abrir, detectar_formato, importar
+from core.models import FondoComun
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa como gastos los cargos de un extracto bancario (CSV, Norma 43 u OFX). '
+        'Todo el fichero se importa en una transacción: si una línea falla no se guarda nada.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='Ruta del extracto')
+        parser.add_argument(
+            '--formato', choices=FORMATOS, default=None,
+            help='Formato del fichero; por defecto se deduce de la extensión',
+        )
+        parser.add_argument(
+            '--usuario', default='sara',
+            help='Usuaria que figura como pagadora de los gastos (por defecto, sara)',
+        )
+        parser.add_argument(
+            '--categoria', default=None,
+            help='Categoría (id o nombre) de los movimientos sin categoría; por defecto, '
+                 'la que proponga el clasificador o, si no propone ninguna, Otros',
+        )
+        parser.add_argument(
+            '--fondo', default=None,
+            help='Tipo de fondo (p. ej. GASTOS) del que salen todos los gastos; '
+                 'por defecto, el asociado a la categoría de cada uno',
+        )
+        parser.add_argument(
+            '--codificacion', default=None,
+            help='Codificación del fichero (por defecto utf-8 para CSV y latin-1 para Norma 43 y OFX)',
+        )
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or detectar_formato(options['fichero'])
+        if formato is None:
+            raise CommandError('No se reconoce el formato del fichero; indícalo con --formato')
+        try:
+            pagador = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}")
+        categoria = None
+        if options['categoria']:
+            categoria = categorias.resolver(options['categoria'])
+            if categoria is None:
+                raise CommandError(f"No existe la categoría {options['categoria']}")
+        fondo = None
+        if options['fondo']:
+            fondo = FondoComun.objects.filter(tipo=options['fondo'].upper()).first()
+            if fondo is None:
+                raise CommandError(f"No existe el fondo {options['fondo']}")
+
+        try:
+            with open(options['fichero'], 'rb') as fichero:
+                resultado = importar(
+                    abrir(fichero, formato, options['codificacion']), formato, pagador, categoria, fondo
+                )
+        except (OSError, ErrorImportacion) as error:
+            raise CommandError(f'No se ha importado nada. {error}')
+
+        for fondo_id, total in sorted(resultado.por_fondo.items()):
+            self.stdout.write(f'Fondo {fondo_id}: -{total}€')
+        self.stdout.write(self.style.SUCCESS(
+            f'Importados {resultado.creados} gastos; {resultado.ignorados} abonos ignorados'
+        ))
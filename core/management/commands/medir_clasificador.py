@@ -0,0 +1,81 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.clasificador import UMBRAL, NaiveBayes, palabras
+from core.generacion import PESOS, descripcion_aleatoria
+
+# Proporción de gastos registrados en una categoría equivocada
+ERRORES = 0.05
+
+
+def historial(numero, aleatorio):
+    """``numero`` pares ``(descripción, categoría)`` sintéticos (ver ``core.generacion``)."""
+    nombres, pesos = list(PESOS), list(PESOS.values())
+    gastos = []
+    for _ in range(numero):
+        categoria = aleatorio.choices(nombres, pesos)[0]
+        descripcion = descripcion_aleatoria(categoria, aleatorio)
+        if aleatorio.random() < ERRORES:
+            categoria = aleatorio.choice(nombres)
+        gastos.append((descripcion, categoria))
+    return gastos
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el clasificador de categorías con historiales sintéticos: tiempo de '
+        'entrenamiento, predicciones por segundo y acierto. No usa la base de datos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gastos', type=int, nargs='+', default=[1000, 10000, 100000],
+            help='Tamaños del historial (por defecto 1000 10000 100000)',
+        )
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de los datos aleatorios')
+        parser.add_argument('--json', action='store_true', help='Muestra los resultados en JSON')
+
+    def handle(self, *args, **options):
+        resultados = []
+        for numero in options['gastos']:
+            gastos = historial(numero, random.Random(options['semilla']))
+            # El 80 % para entrenar, gasto a gasto como llegarían; el resto para evaluar
+            corte = int(numero * 0.8)
+            entrenamiento, prueba = gastos[:corte], gastos[corte:]
+
+            modelo = NaiveBayes()
+            inicio = time.perf_counter()
+            for descripcion, categoria in entrenamiento:
+                modelo.aprender(palabras(descripcion), categoria)
+            tiempo_entrenamiento = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            predicciones = [modelo.predecir(palabras(descripcion)) for descripcion, _ in prueba]
+            tiempo_prediccion = time.perf_counter() - inicio
+
+            propuestas = [(prediccion, real) for prediccion, (_, real) in zip(predicciones, prueba) if prediccion]
+            resultados.append({
+                'gastos': numero,
+                'vocabulario': len(modelo.conteos),
+                'entrenamiento_s': round(tiempo_entrenamiento, 4),
+                'aprender_us': round(tiempo_entrenamiento / max(len(entrenamiento), 1) * 1e6, 2),
+                'prediccion_us': round(tiempo_prediccion / max(len(prueba), 1) * 1e6, 2),
+                'predicciones_por_s': round(len(prueba) / tiempo_prediccion) if tiempo_prediccion else None,
+                # Gastos de prueba para los que se propone categoría (probabilidad >= UMBRAL)
+                'cobertura': round(len(propuestas) / max(len(prueba), 1), 4),
+                'acierto': round(sum(p == r for p, r in propuestas) / max(len(propuestas), 1), 4),
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps({'umbral': UMBRAL, 'resultados': resultados}, indent=2))
+            return
+        for fila in resultados:
+            self.stdout.write(
+                f"{fila['gastos']:>8} gastos: entrenamiento {fila['entrenamiento_s']:.3f} s "
+                f"({fila['aprender_us']} µs/gasto), predicción {fila['prediccion_us']} µs "
+                f"({fila['predicciones_por_s']}/s), cobertura {fila['cobertura']:.1%}, "
+                f"acierto {fila['acierto']:.1%}, vocabulario {fila['vocabulario']}"
+            )
@@ -0,0 +1,124 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rendimiento
+from core.generacion import generar
+from core.models import Gasto, GastoRecurrente, IngresoFondo, MovimientoFondo, ObjetivoAhorro
+
+
+def _filas():
+    modelos = (Gasto, IngresoFondo, MovimientoFondo, GastoRecurrente, ObjetivoAhorro)
+    return {modelo._meta.label_lower: modelo._default_manager.count() for modelo in modelos}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el tiempo, las consultas SQL y el pico de memoria de las vistas principales '
+        '(panel_gastos, panel_fondos, resumen_finanzas, lista_gastos y crear_gasto). Para cada '
+        'escala crea una base de datos temporal con datos generados (ver generar_datos) y '
+        'la borra al terminar; el informe JSON puede compararse con el de otro commit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--escalas', type=int, nargs='+', default=[1000, 100000],
+            help='Gastos generados en cada escala (por defecto 1000 100000; 1000000 tarda unos minutos)',
+        )
+        parser.add_argument('--anos', type=int, default=3, help='Años de historial generado (por defecto 3)')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de los datos generados')
+        parser.add_argument(
+            '--base-actual', action='store_true',
+            help='Mide la base de datos configurada, sin generar datos, en lugar de las escalas',
+        )
+        parser.add_argument(
+            '--usuario', default='sara',
+            help='Usuaria con la que se hacen las peticiones (por defecto, sara)',
+        )
+        parser.add_argument(
+            '--repeticiones', type=int, default=rendimiento.REPETICIONES,
+            help=f'Ejecuciones cronometradas de cada petición (por defecto {rendimiento.REPETICIONES})',
+        )
+        parser.add_argument('--salida', help='Fichero en el que se guarda el informe JSON')
+        parser.add_argument('--comparar', help='Informe JSON anterior con el que comparar los resultados')
+        parser.add_argument(
+            '--tolerancia', type=float, default=rendimiento.TOLERANCIA,
+            help='Empeoramiento del tiempo o la memoria que se tolera al comparar '
+                 f'(por defecto {rendimiento.TOLERANCIA}, es decir, un {rendimiento.TOLERANCIA:.0%})',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeticiones'] < 1:
+            raise CommandError('--repeticiones debe ser al menos 1')
+        anterior = None
+        if options['comparar']:
+            try:
+                with open(options['comparar'], encoding='utf-8') as fichero:
+                    anterior = json.load(fichero)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'No se puede leer el informe anterior: {error}')
+
+        escalas = []
+        if options['base_actual']:
+            escalas.append(self._medir(options))
+        else:
+            for numero in options['escalas']:
+                self.stderr.write(f'Generando {numero} gastos...')
+                with rendimiento.base_de_datos_temporal():
+                    inicio = time.perf_counter()
+                    generar(numero, options['anos'], options['semilla'])
+                    escalas.append(self._medir(options, generacion_s=round(time.perf_counter() - inicio, 2)))
+
+        informe = {
+            'formato': rendimiento.FORMATO,
+            'version': rendimiento.VERSION,
+            'entorno': rendimiento.entorno(),
+            'repeticiones': options['repeticiones'],
+            'escalas': escalas,
+        }
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fichero:
+                json.dump(informe, fichero, indent=2, ensure_ascii=False)
+                fichero.write('\n')
+
+        for escala in escalas:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {escala['gastos']} gastos"))
+            for vista, medida in escala['vistas'].items():
+                tiempos = medida['tiempo_ms']
+                self.stdout.write(
+                    f"{vista:<24} {tiempos['mediana']:>9.2f} ms (mín. {tiempos['minimo']:.2f}, "
+                    f"máx. {tiempos['maximo']:.2f})  {medida['consultas']:>3} consultas  "
+                    f"{medida['memoria_pico_kb']:>7} KB  [{medida['estado']}]"
+                )
+
+        if anterior is not None:
+            self._comparar(anterior, informe, options['tolerancia'])
+
+    def _medir(self, options, generacion_s=None):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}")
+        filas = _filas()
+        escala = {'gastos': filas['core.gasto'], 'filas': filas}
+        if generacion_s is not None:
+            escala['generacion_s'] = generacion_s
+        escala['vistas'] = rendimiento.medir_vistas(usuario, options['repeticiones'])
+        return escala
+
+    def _comparar(self, anterior, informe, tolerancia):
+        commit = anterior.get('entorno', {}).get('commit') or 'informe anterior'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n== Comparación con {commit}'))
+        empeoran = []
+        for gastos, vista, metrica, antes, despues, empeora in rendimiento.comparar(anterior, informe, tolerancia):
+            linea = f'{gastos:>8} {vista:<24} {metrica:<16} {antes:>10} -> {despues:<10}'
+            if empeora:
+                empeoran.append(linea)
+                self.stdout.write(self.style.WARNING(linea))
+            elif despues != antes:
+                self.stdout.write(linea)
+        if empeoran:
+            raise CommandError(f'{len(empeoran)} métricas empeoran respecto al informe anterior')
+        self.stdout.write(self.style.SUCCESS('Ninguna métrica empeora respecto al informe anterior'))
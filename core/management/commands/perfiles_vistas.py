@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import perfilado
+
+
+class Command(BaseCommand):
+    help = (
+        'Lista los perfiles de CPU guardados con ?perfilar=1 (ver core.perfilado), '
+        'muestra uno o borra los antiguos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mostrar', metavar='FICHERO', help='Muestra la tabla de un perfil guardado')
+        parser.add_argument(
+            '--orden', choices=perfilado.ORDENES, default='acumulado',
+            help='Orden de la tabla de --mostrar (por defecto, acumulado)',
+        )
+        parser.add_argument(
+            '--limite', type=int, default=perfilado.LIMITE,
+            help=f'Filas de la tabla de --mostrar (por defecto {perfilado.LIMITE})',
+        )
+        parser.add_argument('--dias', type=int, help='Borra los perfiles de hace más de tantos días')
+        parser.add_argument('--conservar', type=int, help='Borra todos salvo los tantos más recientes')
+
+    def handle(self, *args, **options):
+        if options['mostrar']:
+            # Solo ficheros del directorio de perfiles
+            ruta = perfilado.directorio() / Path(options['mostrar']).name
+            if not ruta.is_file():
+                raise CommandError(f'No existe el perfil {ruta}')
+            self.stdout.write(perfilado.tabla(ruta, options['orden'], options['limite']))
+            return
+
+        if options['dias'] is not None or options['conservar'] is not None:
+            if (options['dias'] or 0) < 0 or (options['conservar'] or 0) < 0:
+                raise CommandError('--dias y --conservar no pueden ser negativos')
+            borrados = perfilado.podar(options['dias'], options['conservar'])
+            self.stdout.write(self.style.SUCCESS(f'Borrados {len(borrados)} perfiles'))
+            return
+
+        perfiles = perfilado.listar()
+        for perfil in perfiles:
+            self.stdout.write(
+                f'{perfil.momento:%Y-%m-%d %H:%M:%S}  {perfil.vista:<24} '
+                f'{perfil.tamano / 1024:>8.1f} KB  {perfil.ruta.name}'
+            )
+        self.stdout.write(f'{len(perfiles)} perfiles en {perfilado.directorio()}')
@@ -0,0 +1,108 @@
+import datetime
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from core import categorias, views
+
+# Tablas grandes en las que un recorrido completo es un problema
+TABLAS_VIGILADAS = ('core_gasto', 'core_ingresofondo')
+
+
+def _peticiones():
+    """Vistas y parámetros cuyas consultas se analizan."""
+    hoy = datetime.date.today()
+    supermercado = categorias.por_codigo('1')
+    cat = supermercado.id if supermercado else ''
+    return [
+        ('panel_gastos', views.panel_gastos, {}),
+        ('panel_gastos', views.panel_gastos, {'cat': cat, 'month': hoy.month}),
+        ('panel_gastos', views.panel_gastos, {'month': hoy.month, 'year': hoy.year}),
+        ('lista_gastos', views.lista_gastos, {'year': hoy.year, 'month': hoy.month}),
+        ('resumen_finanzas', views.resumen_finanzas, {}),
+        ('panel_fondos', views.panel_fondos, {}),
+        ('panel_fondos', views.panel_fondos, {'desde': f'{hoy.year - 1}-01-01', 'hasta': f'{hoy.year}-01-01'}),
+    ]
+
+
+def _recorrido_completo(linea):
+    """Indica si una línea del plan es un recorrido completo de una tabla vigilada."""
+    for tabla in TABLAS_VIGILADAS:
+        # SQLite: «SCAN core_gasto» (sin «USING ... INDEX»); PostgreSQL: «Seq Scan on core_gasto»
+        if re.search(rf'\bSCAN {tabla}\b', linea) and 'USING' not in linea:
+            return True
+        if re.search(rf'\bSeq Scan on {tabla}\b', linea):
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta las vistas principales y muestra el plan de la base de datos '
+        '(SQLite o PostgreSQL, según DATABASE_URL) para cada consulta sobre las '
+        'tablas de la aplicación. No guarda ningún cambio.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--usuario', default='sara',
+            help='Usuario con el que se ejecutan las vistas (por defecto, sara)',
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Solo PostgreSQL: ejecuta las consultas (EXPLAIN ANALYZE) para ver tiempos reales',
+        )
+        parser.add_argument(
+            '--estricto', action='store_true',
+            help=f'Termina con error si alguna consulta recorre entera {" o ".join(TABLAS_VIGILADAS)}',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}")
+        opciones_explain = {'analyze': True} if options['analyze'] else {}
+        if opciones_explain and connection.vendor != 'postgresql':
+            raise CommandError('--analyze solo está disponible con PostgreSQL')
+        prefijo = connection.ops.explain_query_prefix(**opciones_explain)
+
+        self.stdout.write(f'Base de datos: {connection.vendor}')
+        recorridos = []
+        factory = RequestFactory()
+        with transaction.atomic():
+            for nombre, vista, parametros in _peticiones():
+                peticion = factory.get('/', parametros)
+                peticion.user = usuario
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {nombre} {peticion.GET.urlencode()}'))
+                with CaptureQueriesContext(connection) as capturadas:
+                    try:
+                        vista(peticion)
+                    except Exception as error:  # la vista puede fallar; se analiza lo ejecutado
+                        self.stderr.write(f'La vista ha fallado: {error!r}')
+                for consulta in capturadas.captured_queries:
+                    sql = consulta['sql']
+                    if not sql.lstrip().upper().startswith('SELECT') or 'core_' not in sql:
+                        continue
+                    self.stdout.write(f'\n{sql}')
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'{prefijo} {sql}')
+                        plan = [str(fila[-1]) for fila in cursor.fetchall()]
+                    for linea in plan:
+                        self.stdout.write(f'    {linea}')
+                        if _recorrido_completo(linea):
+                            recorridos.append((nombre, linea))
+            # Las vistas pueden aplicar recurrentes pendientes: no se guarda nada
+            transaction.set_rollback(True)
+
+        self.stdout.write('')
+        for nombre, linea in recorridos:
+            self.stdout.write(self.style.WARNING(f'{nombre}: recorrido completo ({linea.strip()})'))
+        if recorridos and options['estricto']:
+            raise CommandError(f'{len(recorridos)} consultas recorren tablas completas')
+        if not recorridos:
+            self.stdout.write(self.style.SUCCESS('Ninguna consulta recorre entera las tablas vigiladas'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import resumen
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero la tabla ResumenMensual y/o la verifica contra los gastos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--solo-verificar', action='store_true',
+            help='No reconstruye; solo compara el resumen actual con los gastos',
+        )
+
+    def handle(self, *args, **options):
+        if not options['solo_verificar']:
+            filas = resumen.reconstruir()
+            self.stdout.write(f'Resumen reconstruido: {filas} filas')
+
+        diferencias = resumen.verificar()
+        for clave, esperado, actual in diferencias:
+            self.stderr.write(f'{clave}: esperado {esperado}, en el resumen {actual}')
+        if diferencias:
+            raise CommandError(f'El resumen no coincide con los gastos ({len(diferencias)} diferencias)')
+        self.stdout.write(self.style.SUCCESS('El resumen coincide con los gastos'))
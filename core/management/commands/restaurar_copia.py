@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.copias import ErrorCopia, restaurar_copia
+
+
+class Command(BaseCommand):
+    help = (
+        'Restaura una copia creada con copia_seguridad en una única transacción y '
+        'recalcula después los saldos, cierres, resumen mensual y liquidaciones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='Copia a restaurar; «-» para la entrada estándar')
+        parser.add_argument(
+            '--reemplazar', action='store_true',
+            help='Borra antes los gastos, fondos, ingresos, recurrentes, objetivos y '
+                 'liquidaciones existentes (las usuarias y categorías se conservan)',
+        )
+
+    def handle(self, *args, **options):
+        origen = sys.stdin.buffer if options['fichero'] == '-' else options['fichero']
+        try:
+            filas = restaurar_copia(origen, reemplazar=options['reemplazar'])
+        except (OSError, ErrorCopia) as error:
+            raise CommandError(f'No se ha restaurado nada. {error}')
+        resumen = ', '.join(f'{modelo}: {numero}' for modelo, numero in filas.items())
+        self.stdout.write(self.style.SUCCESS(f'Copia restaurada ({resumen})'))
@@ -0,0 +1,287 @@
+"""
+Métricas de la aplicación en el formato de texto de Prometheus.
+
+Cada proceso acumula en memoria contadores e histogramas
+(:func:`incrementar`, :func:`observar`); guardar un valor es sumar en un
+diccionario. Las peticiones las registra ``MetricasMiddleware`` (ver
+``core.middleware``): latencia por nombre de URL, estado y consultas SQL
+(número y tiempo). Los módulos con copias en memoria (``categorias``,
+``sugerencias``, ``clasificador``, ``recurrentes``) registran sus aciertos
+y fallos con :func:`registrar_cache`, y las señales de ``Gasto`` y
+``core.recurrentes`` los gastos creados y los recurrentes aplicados.
+
+Con varios procesos (gunicorn con varios *workers*) cada uno tiene sus
+propios valores. Si se define ``METRICAS_DIR`` (variable de entorno
+``DJANGO_METRICAS_DIR``), cada proceso escribe los suyos en un fichero
+JSON de ese directorio como mucho una vez cada
+:data:`INTERVALO_ESCRITURA` segundos, y :func:`exposicion` suma los de
+todos los ficheros. Al terminar, cada proceso suma sus valores a
+:data:`AGREGADO` y borra su fichero (:func:`cerrar`), de modo que los
+contadores no retroceden y el directorio no crece con cada proceso nuevo.
+Sin ``METRICAS_DIR`` solo se ven los valores del proceso que atiende
+``/metrics``.
+
+Los indicadores del hogar (saldo de cada fondo, gastos registrados,
+recurrentes activos) se consultan al generar la exposición.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso con ``runserver``
+    fcntl = None
+
+INTERVALO_ESCRITURA = 1.0
+# Fichero con los valores de los procesos que ya han terminado
+AGREGADO = 'agregado.json'
+# Límites superiores (en segundos) de las cubetas de los histogramas de duración
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# nombre -> (tipo, ayuda)
+DESCRIPCIONES = {
+    'gastos_peticiones_total': ('counter', 'Peticiones atendidas por nombre de URL y estado'),
+    'gastos_peticion_duracion_segundos': ('histogram', 'Duración de las peticiones por nombre de URL'),
+    'gastos_db_consultas_total': ('counter', 'Consultas SQL por nombre de URL'),
+    'gastos_db_duracion_segundos_total': ('counter', 'Tiempo en consultas SQL por nombre de URL'),
+    'gastos_cache_consultas_total': ('counter', 'Consultas a las copias en memoria y cachés, por resultado'),
+    'gastos_gastos_creados_total': ('counter', 'Gastos creados, uno a uno o en bloque'),
+    'gastos_recurrentes_aplicaciones_total': ('counter', 'Ejecuciones de la aplicación de recurrentes pendientes'),
+    'gastos_recurrentes_generados_total': ('counter', 'Gastos e ingresos generados por recurrentes y objetivos'),
+    'gastos_fondo_saldo_euros': ('gauge', 'Saldo de cada fondo común'),
+    'gastos_gastos_registrados': ('gauge', 'Gastos registrados en total'),
+    'gastos_recurrentes_activos': ('gauge', 'Gastos recurrentes activos'),
+}
+
+
+class _Registro:
+    """Contadores e histogramas de este proceso."""
+
+    def __init__(self):
+        self.cerrojo = threading.Lock()
+        # (nombre, etiquetas) -> valor
+        self.contadores = defaultdict(float)
+        # (nombre, etiquetas) -> [recuento por cubeta..., recuento total, suma]
+        self.histogramas = {}
+        self.ultima_escritura = 0.0
+        self.fichero = None
+
+    def incrementar(self, nombre, valor, etiquetas):
+        with self.cerrojo:
+            self.contadores[(nombre, etiquetas)] += valor
+
+    def observar(self, nombre, valor, etiquetas):
+        with self.cerrojo:
+            datos = self.histogramas.get((nombre, etiquetas))
+            if datos is None:
+                datos = self.histogramas[(nombre, etiquetas)] = [0] * (len(CUBETAS) + 1) + [0.0]
+            for posicion, limite in enumerate(CUBETAS):
+                if valor <= limite:
+                    datos[posicion] += 1
+                    break
+            datos[-2] += 1
+            datos[-1] += valor
+
+    def instantanea(self, vaciar=False):
+        """Valores actuales, serializables en JSON; con ``vaciar`` vuelven a cero."""
+        with self.cerrojo:
+            instantanea = {
+                'contadores': [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in self.contadores.items()],
+                'histogramas': [[nombre, list(etiquetas), list(datos)] for (nombre, etiquetas), datos in self.histogramas.items()],
+            }
+            if vaciar:
+                self.contadores.clear()
+                self.histogramas.clear()
+        return instantanea
+
+
+_registro = _Registro()
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((clave, str(valor)) for clave, valor in etiquetas.items()))
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """Suma ``valor`` al contador ``nombre`` con esas etiquetas."""
+    _registro.incrementar(nombre, valor, _etiquetas(etiquetas))
+
+
+def observar(nombre, valor, **etiquetas):
+    """Añade ``valor`` (segundos) al histograma ``nombre`` con esas etiquetas."""
+    _registro.observar(nombre, valor, _etiquetas(etiquetas))
+
+
+def registrar_cache(nombre, acierto):
+    """Cuenta un acierto o un fallo de la copia en memoria o caché ``nombre``."""
+    incrementar('gastos_cache_consultas_total', cache=nombre, resultado='acierto' if acierto else 'fallo')
+
+
+def _directorio():
+    directorio = getattr(settings, 'METRICAS_DIR', None)
+    return Path(directorio) if directorio else None
+
+
+def escribir(forzar=False):
+    """Escribe los valores de este proceso en ``METRICAS_DIR`` si ha pasado el intervalo."""
+    directorio = _directorio()
+    if directorio is None:
+        return
+    ahora = time.monotonic()
+    if not forzar and ahora - _registro.ultima_escritura < INTERVALO_ESCRITURA:
+        return
+    _registro.ultima_escritura = ahora
+    if _registro.fichero is None:
+        # Único por proceso aunque el sistema reutilice el pid
+        _registro.fichero = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        atexit.register(cerrar)
+    directorio.mkdir(parents=True, exist_ok=True)
+    _guardar(directorio / _registro.fichero, _registro.instantanea())
+
+
+def _guardar(fichero, instantanea):
+    temporal = fichero.with_name(f'{fichero.name}.tmp')
+    temporal.write_text(json.dumps(instantanea), encoding='utf-8')
+    os.replace(temporal, fichero)
+
+
+@contextmanager
+def _bloqueo(directorio, exclusivo):
+    """Excluye la lectura de los ficheros mientras un proceso suma los suyos a :data:`AGREGADO`."""
+    if fcntl is None:
+        yield
+        return
+    with open(directorio / '.bloqueo', 'a') as fichero:
+        fcntl.flock(fichero, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(fichero, fcntl.LOCK_UN)
+
+
+def cerrar():
+    """Suma los valores de este proceso a :data:`AGREGADO` y borra su fichero (al terminar).
+
+    Los valores del proceso vuelven a cero, así que no se cuentan dos veces
+    si después se registra algo más.
+    """
+    directorio = _directorio()
+    if directorio is None:
+        return
+    directorio.mkdir(parents=True, exist_ok=True)
+    with _bloqueo(directorio, exclusivo=True):
+        agregado = directorio / AGREGADO
+        try:
+            anteriores = [json.loads(agregado.read_text(encoding='utf-8'))]
+        except (OSError, ValueError):
+            anteriores = []
+        _guardar(agregado, _a_instantanea(*_sumar([*anteriores, _registro.instantanea(vaciar=True)])))
+        if _registro.fichero is not None:
+            (directorio / _registro.fichero).unlink(missing_ok=True)
+            _registro.fichero = None
+
+
+def _sumar(instantaneas):
+    contadores = defaultdict(float)
+    histogramas = {}
+    for instantanea in instantaneas:
+        for nombre, etiquetas, valor in instantanea.get('contadores', []):
+            contadores[(nombre, tuple(map(tuple, etiquetas)))] += valor
+        for nombre, etiquetas, datos in instantanea.get('histogramas', []):
+            clave = (nombre, tuple(map(tuple, etiquetas)))
+            if clave in histogramas:
+                histogramas[clave] = [a + b for a, b in zip(histogramas[clave], datos)]
+            else:
+                histogramas[clave] = list(datos)
+    return contadores, histogramas
+
+
+def _a_instantanea(contadores, histogramas):
+    """Resultado de :func:`_sumar` en el formato de los ficheros."""
+    return {
+        'contadores': [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in contadores.items()],
+        'histogramas': [[nombre, list(etiquetas), datos] for (nombre, etiquetas), datos in histogramas.items()],
+    }
+
+
+def _instantaneas():
+    """Valores de este proceso y, con ``METRICAS_DIR``, los de los demás."""
+    escribir(forzar=True)
+    propia = _registro.instantanea()
+    directorio = _directorio()
+    if directorio is None or not directorio.is_dir():
+        return [propia]
+    instantaneas = [propia]
+    with _bloqueo(directorio, exclusivo=False):
+        for fichero in directorio.glob('*.json'):
+            if fichero.name == _registro.fichero:
+                continue
+            try:
+                instantaneas.append(json.loads(fichero.read_text(encoding='utf-8')))
+            except (OSError, ValueError):
+                # Un fichero a medio escribir por otro proceso: se lee en la siguiente
+                continue
+    return instantaneas
+
+
+def _indicadores():
+    """Indicadores del hogar, consultados en el momento."""
+    from django.db.models import Sum
+
+    from .models import FondoComun, GastoRecurrente, ResumenMensual
+
+    indicadores = [
+        ('gastos_fondo_saldo_euros', (('fondo', tipo),), saldo)
+        for tipo, saldo in FondoComun.objects.values_list('tipo').annotate(total=Sum('saldo')).order_by('tipo')
+    ]
+    registrados = ResumenMensual.objects.aggregate(total=Sum('numero'))['total'] or 0
+    indicadores.append(('gastos_gastos_registrados', (), registrados))
+    indicadores.append(('gastos_recurrentes_activos', (), GastoRecurrente.objects.filter(activo=True).count()))
+    return indicadores
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _serie(nombre, etiquetas, valor):
+    if etiquetas:
+        texto = ','.join(f'{clave}="{_escapar(valor_etiqueta)}"' for clave, valor_etiqueta in sorted(etiquetas))
+        return f'{nombre}{{{texto}}} {float(valor)!r}'
+    return f'{nombre} {float(valor)!r}'
+
+
+def exposicion():
+    """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+    contadores, histogramas = _sumar(_instantaneas())
+    series = defaultdict(list)
+    for (nombre, etiquetas), valor in contadores.items():
+        series[nombre].append(_serie(nombre, etiquetas, valor))
+    for (nombre, etiquetas), datos in histogramas.items():
+        acumulado = 0
+        for limite, recuento in zip(CUBETAS, datos):
+            acumulado += recuento
+            series[nombre].append(_serie(f'{nombre}_bucket', (*etiquetas, ('le', f'{limite:g}')), acumulado))
+        series[nombre].append(_serie(f'{nombre}_bucket', (*etiquetas, ('le', '+Inf')), datos[-2]))
+        series[nombre].append(_serie(f'{nombre}_count', etiquetas, datos[-2]))
+        series[nombre].append(_serie(f'{nombre}_sum', etiquetas, datos[-1]))
+    for nombre, etiquetas, valor in _indicadores():
+        series[nombre].append(_serie(nombre, etiquetas, valor))
+
+    lineas = []
+    for nombre in sorted(series):
+        tipo, ayuda = DESCRIPCIONES.get(nombre, ('untyped', nombre))
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        lineas.extend(sorted(series[nombre]) if tipo != 'histogram' else series[nombre])
+    return '\n'.join(lineas) + '\n'
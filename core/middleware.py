@@ -0,0 +1,275 @@
+"""
+Medición y perfilado de las peticiones.
+
+``MedicionPeticionesMiddleware`` solo se activa con ``MEDIR_PETICIONES``
+(variable de entorno ``DJANGO_MEDIR_PETICIONES=True``); si no, Django lo
+descarta al arrancar (``MiddlewareNotUsed``) y no añade nada a las
+peticiones. Activado, para cada petición:
+
+* cuenta y cronometra cada consulta con ``connection.execute_wrapper``;
+* mide la vista (debe ser el último middleware, de modo que lo que ocurre
+  entre ``process_view`` y la respuesta es solo la vista) y el tiempo de
+  renderizado de las plantillas;
+* añade la cabecera ``Server-Timing`` (``db``, ``plantillas``, ``vista`` y
+  ``total``), que las herramientas de desarrollo del navegador muestran
+  junto a la petición;
+* si tarda más de ``PETICION_LENTA_MS`` milisegundos, escribe en el log
+  ``core.middleware`` una línea JSON con los tiempos y las consultas más
+  repetidas. Las consultas se agrupan por su forma (el SQL con los
+  parámetros sin sustituir), así que un N+1 aparece como una misma forma
+  repetida muchas veces.
+
+En las respuestas en flujo (exportaciones) solo se miden las consultas
+hechas antes de empezar a enviar el contenido.
+
+``PerfiladoMiddleware`` ejecuta con ``cProfile`` las peticiones que pide
+el personal (ver ``core.perfilado``).
+
+``MetricasMiddleware`` registra la duración, el estado y las consultas SQL
+de cada petición para ``/metrics`` (ver ``core.metricas``).
+"""
+
+import cProfile
+import contextvars
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+from . import metricas, perfilado
+
+logger = logging.getLogger(__name__)
+
+# Formas de consulta más repetidas que se incluyen en el log de peticiones lentas
+FORMAS_EN_LOG = 5
+LONGITUD_FORMA = 300
+
+# Listas de parámetros de longitud variable: ``IN (%s, %s, %s)``
+_LISTA_PARAMETROS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_ESPACIOS = re.compile(r'\s+')
+
+# Medición de la petición en curso (para el renderizado de plantillas)
+_medicion_actual = contextvars.ContextVar('medicion_peticion', default=None)
+
+
+def forma_consulta(sql):
+    """SQL normalizado para agrupar las consultas que solo difieren en sus parámetros."""
+    return _ESPACIOS.sub(' ', _LISTA_PARAMETROS.sub('(%s, ...)', sql)).strip()
+
+
+class MedicionPeticion:
+    """Tiempos (en segundos) y consultas de una petición."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.inicio_vista = None
+        self.vista = 0.0
+        self.plantillas = 0.0
+        self.db = 0.0
+        self.consultas = 0
+        # forma -> [veces, segundos]
+        self.formas = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        """Envoltorio de ``connection.execute_wrapper``."""
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.db += duracion
+            self.consultas += 1
+            forma = self.formas[forma_consulta(sql)]
+            forma[0] += 1
+            forma[1] += duracion
+
+    def mas_repetidas(self, numero=FORMAS_EN_LOG):
+        """Las ``numero`` formas de consulta más repetidas (y, a igualdad, más lentas)."""
+        ordenadas = sorted(self.formas.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [
+            {'sql': forma[:LONGITUD_FORMA], 'veces': veces, 'ms': round(segundos * 1000, 2)}
+            for forma, (veces, segundos) in ordenadas[:numero]
+        ]
+
+    def server_timing(self, total):
+        metricas = [
+            ('db', self.db, f'SQL ({self.consultas} consultas)'),
+            ('plantillas', self.plantillas, 'Plantillas'),
+            ('vista', self.vista, 'Vista (incluye SQL y plantillas)'),
+            ('total', total, 'Total'),
+        ]
+        return ', '.join(f'{nombre};dur={segundos * 1000:.1f};desc="{desc}"' for nombre, segundos, desc in metricas)
+
+
+_plantillas_instrumentadas = False
+
+
+def _instrumentar_plantillas():
+    """Cronometra el renderizado de las plantillas de Django (una sola vez por proceso).
+
+    Se envuelve ``render`` de las plantillas del motor de Django, que es lo
+    que llaman ``render()`` y ``render_to_string()``; los ``include`` se
+    renderizan dentro y no se cuentan dos veces.
+    """
+    global _plantillas_instrumentadas
+    if _plantillas_instrumentadas:
+        return
+    from django.template.backends.django import Template
+
+    render_original = Template.render
+
+    def render(self, context=None, request=None):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return render_original(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return render_original(self, context, request)
+        finally:
+            medicion.plantillas += time.perf_counter() - inicio
+
+    Template.render = render
+    _plantillas_instrumentadas = True
+
+
+class MedicionPeticionesMiddleware:
+    """Cabecera ``Server-Timing`` y log de peticiones lentas (ver el módulo)."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MEDIR_PETICIONES', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.umbral = getattr(settings, 'PETICION_LENTA_MS', 500) / 1000
+        _instrumentar_plantillas()
+
+    def __call__(self, request):
+        medicion = MedicionPeticion()
+        request.medicion = medicion
+        token = _medicion_actual.set(medicion)
+        try:
+            with ExitStack() as pila:
+                for conexion in connections.all():
+                    pila.enter_context(conexion.execute_wrapper(medicion))
+                response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        fin = time.perf_counter()
+        if medicion.inicio_vista is not None:
+            medicion.vista = fin - medicion.inicio_vista
+        total = fin - medicion.inicio
+
+        response['Server-Timing'] = medicion.server_timing(total)
+        if total >= self.umbral:
+            datos = {
+                'evento': 'peticion_lenta',
+                'metodo': request.method,
+                'ruta': request.path,
+                'estado': response.status_code,
+                'total_ms': round(total * 1000, 1),
+                'vista_ms': round(medicion.vista * 1000, 1),
+                'db_ms': round(medicion.db * 1000, 1),
+                'plantillas_ms': round(medicion.plantillas * 1000, 1),
+                'consultas': medicion.consultas,
+                'repetidas': medicion.mas_repetidas(),
+            }
+            logger.warning(json.dumps(datos, ensure_ascii=False), extra={'peticion': datos})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        medicion = getattr(request, 'medicion', None)
+        if medicion is not None:
+            medicion.inicio_vista = time.perf_counter()
+        return None
+
+
+class PerfiladoMiddleware:
+    """Perfil de CPU de la petición si lo pide una usuaria del personal.
+
+    Debe ir después de ``AuthenticationMiddleware``. Para las demás
+    usuarias el parámetro ``perfilar`` y la cabecera ``X-Perfilar`` se
+    ignoran y la petición sigue su curso sin cambios.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        modo = request.GET.get('perfilar') or request.headers.get('X-Perfilar')
+        if not modo:
+            return self.get_response(request)
+        usuario = getattr(request, 'user', None)
+        if usuario is None or not usuario.is_active or not usuario.is_staff:
+            return self.get_response(request)
+
+        perfilador = cProfile.Profile()
+        response = perfilador.runcall(self.get_response, request)
+        coincidencia = getattr(request, 'resolver_match', None)
+        ruta = perfilado.guardar(perfilador, coincidencia.view_name if coincidencia else None)
+        if modo != 'tabla':
+            response['X-Perfil'] = ruta.name
+            return response
+        try:
+            limite = int(request.GET.get('limite', perfilado.LIMITE))
+        except ValueError:
+            limite = perfilado.LIMITE
+        texto = perfilado.tabla(perfilador, request.GET.get('orden', 'acumulado'), limite)
+        return HttpResponse(
+            f'Perfil guardado en {ruta}\nRespuesta original: {response.status_code}\n\n{texto}',
+            content_type='text/plain; charset=utf-8',
+        )
+
+
+class ContadorConsultas:
+    """Número y tiempo (en segundos) de las consultas de una petición."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.db = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Envoltorio de ``connection.execute_wrapper``."""
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+class MetricasMiddleware:
+    """Duración, estado y consultas SQL de cada petición, por nombre de URL.
+
+    Va justo después de ``WhiteNoiseMiddleware`` para no contar los
+    estáticos. Las peticiones que no corresponden a ninguna URL se agrupan
+    en ``sin_ruta``. Se desactiva con ``METRICAS = False``.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICAS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inicio = time.perf_counter()
+        contador = ContadorConsultas()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(contador))
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = (coincidencia.url_name if coincidencia else None) or 'sin_ruta'
+        metricas.observar('gastos_peticion_duracion_segundos', duracion, vista=vista)
+        metricas.incrementar('gastos_peticiones_total', vista=vista, estado=response.status_code)
+        metricas.incrementar('gastos_db_consultas_total', contador.consultas, vista=vista)
+        metricas.incrementar('gastos_db_duracion_segundos_total', contador.db, vista=vista)
+        metricas.escribir()
+        return response
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_alter_ingresofondo_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Liquidacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('saldo', models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=14)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('pagado_por', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='liquidaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Liquidación',
+                'verbose_name_plural': 'Liquidaciones',
+                'ordering': ['-fecha', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_liquidacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDatos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=30, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versión de datos',
+                'verbose_name_plural': 'Versiones de datos',
+            },
+        ),
+        migrations.AddField(
+            model_name='gasto',
+            name='periodo',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gasto',
+            name='recurrente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gastos_generados', to='core.gastorecurrente'),
+        ),
+        migrations.AddField(
+            model_name='ingresofondo',
+            name='objetivo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingresos_generados', to='core.objetivoahorro'),
+        ),
+        migrations.AddField(
+            model_name='ingresofondo',
+            name='periodo',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='gasto',
+            constraint=models.UniqueConstraint(fields=('recurrente', 'periodo'), name='gasto_recurrente_unico_por_periodo'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingresofondo',
+            constraint=models.UniqueConstraint(fields=('objetivo', 'periodo'), name='ingreso_objetivo_unico_por_periodo'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:23
+
+import datetime
+from django.db import migrations, models
+
+
+def convertir_ultimo_mes_aplicado(apps, schema_editor):
+    """Traduce el último mes aplicado a la fecha de la última ocurrencia.
+
+    Los recurrentes ya aplicados pasan a repetirse el día 1 de cada periodo;
+    los que nunca se aplicaron empezarán el día en que se apliquen.
+    """
+    GastoRecurrente = apps.get_model('core', 'GastoRecurrente')
+    for rec in GastoRecurrente.objects.all():
+        if rec.ultimo_ano_aplicado and rec.ultimo_mes_aplicado:
+            rec.ultima_fecha_aplicada = datetime.date(rec.ultimo_ano_aplicado, rec.ultimo_mes_aplicado, 1)
+            rec.fecha_inicio = rec.ultima_fecha_aplicada
+        else:
+            rec.fecha_inicio = None
+        rec.save(update_fields=['ultima_fecha_aplicada', 'fecha_inicio'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_gasto_recurrente_periodo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gastorecurrente',
+            name='fecha_inicio',
+            field=models.DateField(blank=True, default=datetime.date.today, null=True),
+        ),
+        migrations.AddField(
+            model_name='gastorecurrente',
+            name='intervalo_dias',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gastorecurrente',
+            name='ultima_fecha_aplicada',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='gastorecurrente',
+            name='periodicidad',
+            field=models.CharField(choices=[('SEMANAL', 'Semanal'), ('MENSUAL', 'Mensual'), ('TRIMESTRAL', 'Trimestral'), ('ANUAL', 'Anual'), ('PERSONALIZADA', 'Cada N días')], default='MENSUAL', max_length=15),
+        ),
+        migrations.RunPython(convertir_ultimo_mes_aplicado, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='gastorecurrente',
+            name='ultimo_ano_aplicado',
+        ),
+        migrations.RemoveField(
+            model_name='gastorecurrente',
+            name='ultimo_mes_aplicado',
+        ),
+    ]
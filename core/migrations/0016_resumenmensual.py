@@ -0,0 +1,67 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def construir_resumen(apps, schema_editor):
+    """Genera el resumen mensual a partir de los gastos existentes."""
+    from decimal import Decimal
+
+    from django.db.models import Count, Sum
+    from django.db.models.functions import ExtractMonth, ExtractYear
+
+    Gasto = apps.get_model('core', 'Gasto')
+    ResumenMensual = apps.get_model('core', 'ResumenMensual')
+    filas = (
+        Gasto.objects.order_by()
+        .annotate(ano=ExtractYear('fecha'), mes=ExtractMonth('fecha'))
+        .values('ano', 'mes', 'categoria', 'fondo_id', 'pagado_por_id')
+        .annotate(total=Sum('monto_total'), numero=Count('id'))
+    )
+    ResumenMensual.objects.bulk_create(
+        [
+            ResumenMensual(
+                ano=fila['ano'],
+                mes=fila['mes'],
+                categoria=fila['categoria'],
+                fondo_id=fila['fondo_id'],
+                pagado_por_id=fila['pagado_por_id'],
+                total=fila['total'].quantize(Decimal('0.01')),
+                numero=fila['numero'],
+            )
+            for fila in filas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_gastorecurrente_periodicidades'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('categoria', models.CharField(max_length=20)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('numero', models.PositiveIntegerField(default=0)),
+                ('fondo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.fondocomun')),
+                ('pagado_por', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual',
+                'verbose_name_plural': 'Resúmenes mensuales',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('fondo__isnull', False)), fields=('ano', 'mes', 'categoria', 'fondo', 'pagado_por'), name='resumen_mensual_unico_con_fondo'), models.UniqueConstraint(condition=models.Q(('fondo__isnull', True)), fields=('ano', 'mes', 'categoria', 'pagado_por'), name='resumen_mensual_unico_sin_fondo')],
+            },
+        ),
+        migrations.RunPython(construir_resumen, migrations.RunPython.noop),
+    ]
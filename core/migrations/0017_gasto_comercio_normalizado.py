@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rellenar_comercio(apps, schema_editor):
+    """Calcula ``comercio_normalizado`` para los gastos existentes."""
+    Gasto = apps.get_model('core', 'Gasto')
+    pendientes = []
+    for gasto in Gasto.objects.only('id', 'descripcion').iterator(chunk_size=2000):
+        # Misma normalización que ``core.models.normalizar_comercio``
+        gasto.comercio_normalizado = ' '.join((gasto.descripcion or '').split()).title()
+        pendientes.append(gasto)
+        if len(pendientes) >= 2000:
+            Gasto.objects.bulk_update(pendientes, ['comercio_normalizado'])
+            pendientes = []
+    Gasto.objects.bulk_update(pendientes, ['comercio_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_resumenmensual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gasto',
+            name='comercio_normalizado',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(rellenar_comercio, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['comercio_normalizado', 'fecha'], name='gasto_comercio_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Categorías iniciales (``Categoria.INICIALES``): (código, nombre)
+INICIALES = [
+    ('1', 'Supermercado'),
+    ('2', 'Viajes'),
+    ('3', 'Gastos piso'),
+    ('4', 'Ocio'),
+    ('5', 'Otros'),
+    ('6', 'Compras piso'),
+]
+
+
+def quitar_duplicados(apps, schema_editor):
+    """Deja una sola categoría por nombre antes de hacerlo único.
+
+    Hasta ahora ``Categoria`` no se referenciaba desde ningún modelo, así
+    que basta con borrar las repetidas.
+    """
+    Categoria = apps.get_model('core', 'Categoria')
+    vistos = set()
+    for categoria in Categoria.objects.order_by('id'):
+        clave = categoria.nombre.strip().lower()
+        if clave in vistos:
+            categoria.delete()
+        else:
+            vistos.add(clave)
+
+
+def crear_iniciales(apps, schema_editor):
+    """Crea (o reutiliza por nombre) las categorías iniciales con su código."""
+    Categoria = apps.get_model('core', 'Categoria')
+    for codigo, nombre in INICIALES:
+        categoria = Categoria.objects.filter(nombre__iexact=nombre).first()
+        if categoria is None:
+            Categoria.objects.create(nombre=nombre, codigo=codigo)
+        else:
+            categoria.codigo = codigo
+            categoria.save(update_fields=['codigo'])
+
+
+def asignar_categorias(apps, schema_editor):
+    """Traduce el texto guardado en ``categoria`` a la clave foránea.
+
+    Los registros pueden guardar el código (``'1'``) o el nombre legible
+    (``'Supermercado'``), con cualquier capitalización. Los valores que no
+    corresponden a ninguna categoría se conservan creando una nueva; los
+    vacíos pasan a «Otros». Se hace un ``UPDATE`` por cada valor distinto.
+    """
+    Categoria = apps.get_model('core', 'Categoria')
+    por_codigo = {c.codigo: c for c in Categoria.objects.exclude(codigo=None)}
+    por_nombre = {c.nombre.strip().lower(): c for c in Categoria.objects.all()}
+
+    def resolver(valor):
+        valor = (valor or '').strip()
+        if not valor:
+            return por_codigo['5']
+        categoria = por_codigo.get(valor) or por_nombre.get(valor.lower())
+        if categoria is None:
+            categoria = Categoria.objects.create(nombre=valor)
+            por_nombre[valor.lower()] = categoria
+        return categoria
+
+    for nombre_modelo in ('Gasto', 'GastoRecurrente'):
+        modelo = apps.get_model('core', nombre_modelo)
+        valores = modelo.objects.order_by().values_list('categoria', flat=True).distinct()
+        for valor in list(valores):
+            modelo.objects.filter(categoria=valor).update(categoria_nueva=resolver(valor))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_gasto_comercio_normalizado'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_duplicados, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='categoria',
+            options={'ordering': ['id']},
+        ),
+        migrations.AlterField(
+            model_name='categoria',
+            name='nombre',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='codigo',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.RunPython(crear_iniciales, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='gasto',
+            name='categoria_nueva',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.categoria'
+            ),
+        ),
+        migrations.AddField(
+            model_name='gastorecurrente',
+            name='categoria_nueva',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.categoria'
+            ),
+        ),
+        migrations.RunPython(asignar_categorias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,123 @@
+"""Sustituye la categoría en texto por la clave foránea rellenada en 0018.
+
+Va en una migración aparte para que en PostgreSQL los ``ALTER TABLE`` no
+compartan transacción con los ``UPDATE`` de la migración anterior.
+"""
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def vaciar_resumen(apps, schema_editor):
+    apps.get_model('core', 'ResumenMensual').objects.all().delete()
+
+
+def construir_resumen(apps, schema_editor):
+    """Vuelve a generar el resumen mensual, ahora por ``categoria_id``."""
+    from decimal import Decimal
+
+    from django.db.models import Count, Sum
+    from django.db.models.functions import ExtractMonth, ExtractYear
+
+    Gasto = apps.get_model('core', 'Gasto')
+    ResumenMensual = apps.get_model('core', 'ResumenMensual')
+    filas = (
+        Gasto.objects.order_by()
+        .annotate(ano=ExtractYear('fecha'), mes=ExtractMonth('fecha'))
+        .values('ano', 'mes', 'categoria_id', 'fondo_id', 'pagado_por_id')
+        .annotate(total=Sum('monto_total'), numero=Count('id'))
+    )
+    ResumenMensual.objects.bulk_create(
+        [
+            ResumenMensual(
+                ano=fila['ano'],
+                mes=fila['mes'],
+                categoria_id=fila['categoria_id'],
+                fondo_id=fila['fondo_id'],
+                pagado_por_id=fila['pagado_por_id'],
+                total=fila['total'].quantize(Decimal('0.01')),
+                numero=fila['numero'],
+            )
+            for fila in filas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_categoria_fk'),
+    ]
+
+    operations = [
+        # El resumen se agrupa por categoría: se vacía y se reconstruye al final
+        migrations.RunPython(vaciar_resumen, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='resumenmensual',
+            name='resumen_mensual_unico_con_fondo',
+        ),
+        migrations.RemoveConstraint(
+            model_name='resumenmensual',
+            name='resumen_mensual_unico_sin_fondo',
+        ),
+        migrations.RemoveField(
+            model_name='resumenmensual',
+            name='categoria',
+        ),
+        migrations.AddField(
+            model_name='resumenmensual',
+            name='categoria',
+            field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, to='core.categoria'),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='resumenmensual',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('fondo__isnull', False)),
+                fields=('ano', 'mes', 'categoria', 'fondo', 'pagado_por'),
+                name='resumen_mensual_unico_con_fondo',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='resumenmensual',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('fondo__isnull', True)),
+                fields=('ano', 'mes', 'categoria', 'pagado_por'),
+                name='resumen_mensual_unico_sin_fondo',
+            ),
+        ),
+        migrations.RemoveField(
+            model_name='gasto',
+            name='categoria',
+        ),
+        migrations.RenameField(
+            model_name='gasto',
+            old_name='categoria_nueva',
+            new_name='categoria',
+        ),
+        migrations.AlterField(
+            model_name='gasto',
+            name='categoria',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT, related_name='gastos', to='core.categoria'
+            ),
+        ),
+        migrations.RemoveField(
+            model_name='gastorecurrente',
+            name='categoria',
+        ),
+        migrations.RenameField(
+            model_name='gastorecurrente',
+            old_name='categoria_nueva',
+            new_name='categoria',
+        ),
+        migrations.AlterField(
+            model_name='gastorecurrente',
+            name='categoria',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT, related_name='recurrentes', to='core.categoria'
+            ),
+        ),
+        migrations.RunPython(construir_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_categoria_fk_final'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Primero los índices compuestos y después se quitan los de las claves
+        # foráneas, que pasan a estar cubiertos por ellos
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['fecha', 'id'], name='gasto_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['categoria', 'fecha'], name='gasto_categoria_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['fondo', 'fecha'], name='gasto_fondo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingresofondo',
+            index=models.Index(fields=['fondo', 'fecha'], name='ingreso_fondo_fecha_idx'),
+        ),
+        migrations.AlterField(
+            model_name='gasto',
+            name='categoria',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='gastos', to='core.categoria'),
+        ),
+        migrations.AlterField(
+            model_name='gasto',
+            name='fondo',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.fondocomun'),
+        ),
+        migrations.AlterField(
+            model_name='ingresofondo',
+            name='fondo',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.fondocomun'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def registrar_historico(apps, schema_editor):
+    """Crea los movimientos de los gastos e ingresos existentes.
+
+    Los saldos guardados hasta ahora no siempre coinciden con la suma de
+    gastos e ingresos (ajustes manuales, gastos creados desde el admin...):
+    la diferencia se registra como saldo inicial, de modo que la suma de
+    los movimientos de cada fondo sea su saldo actual. Lleva la fecha del
+    primer movimiento del fondo (o la de hoy si no tiene ninguno), para que
+    los saldos históricos también la incluyan.
+    """
+    import datetime
+    from decimal import Decimal
+
+    FondoComun = apps.get_model('core', 'FondoComun')
+    Gasto = apps.get_model('core', 'Gasto')
+    IngresoFondo = apps.get_model('core', 'IngresoFondo')
+    MovimientoFondo = apps.get_model('core', 'MovimientoFondo')
+
+    for fondo in FondoComun.objects.all():
+        movimientos = [
+            MovimientoFondo(
+                fondo_id=fondo.id, fecha=gasto.fecha, importe=-gasto.monto_total, tipo='GASTO',
+                descripcion=gasto.descripcion[:200], gasto_id=gasto.id,
+            )
+            for gasto in Gasto.objects.filter(fondo_id=fondo.id).only('id', 'fecha', 'monto_total', 'descripcion')
+        ]
+        movimientos += [
+            MovimientoFondo(
+                fondo_id=fondo.id, fecha=ingreso.fecha, importe=ingreso.cantidad, tipo='INGRESO',
+                descripcion='Aportación automática' if ingreso.es_automatico else 'Aportación',
+                ingreso_id=ingreso.id,
+            )
+            for ingreso in IngresoFondo.objects.filter(fondo_id=fondo.id)
+        ]
+        diferencia = fondo.saldo - sum((mov.importe for mov in movimientos), Decimal('0'))
+        if diferencia:
+            movimientos.append(MovimientoFondo(
+                fondo_id=fondo.id, fecha=min([datetime.date.today(), *(mov.fecha for mov in movimientos)]),
+                importe=diferencia, tipo='APERTURA',
+                descripcion='Diferencia con el saldo anterior al registro de movimientos',
+            ))
+        MovimientoFondo.objects.bulk_create(movimientos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreFondo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('fondo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cierres', to='core.fondocomun')),
+            ],
+            options={
+                'verbose_name': 'Cierre de fondo',
+                'verbose_name_plural': 'Cierres de fondos',
+                'ordering': ['fondo', 'fecha'],
+                'constraints': [models.UniqueConstraint(fields=('fondo', 'fecha'), name='cierre_fondo_unico_por_fecha')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovimientoFondo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('importe', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('tipo', models.CharField(choices=[('GASTO', 'Gasto'), ('INGRESO', 'Ingreso'), ('AJUSTE', 'Ajuste manual'), ('APERTURA', 'Saldo inicial')], max_length=10)),
+                ('descripcion', models.CharField(blank=True, default='', max_length=200)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('fondo', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='core.fondocomun')),
+                ('gasto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='core.gasto')),
+                ('ingreso', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='core.ingresofondo')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de fondo',
+                'verbose_name_plural': 'Movimientos de fondos',
+                'ordering': ['fecha', 'id'],
+                'indexes': [models.Index(fields=['fondo', 'fecha'], name='movimiento_fondo_fecha_idx')],
+            },
+        ),
+        migrations.RunPython(registrar_historico, migrations.RunPython.noop),
+    ]
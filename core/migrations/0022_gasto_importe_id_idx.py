@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_movimientos_fondo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['monto_total', 'id'], name='gasto_importe_id_idx'),
+        ),
+    ]
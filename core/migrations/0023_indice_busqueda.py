@@ -0,0 +1,52 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:31
+
+from django.db import DatabaseError, migrations, transaction
+
+
+def crear_indice(apps, schema_editor):
+    """Crea el índice de búsqueda de la descripción de los gastos (ver ``core.busqueda``).
+
+    Si la base de datos no lo admite (SQLite sin FTS5 o sin su tokenizador
+    ``trigram``, PostgreSQL sin permiso para crear ``pg_trgm``) no se crea y
+    la búsqueda usa ``icontains``.
+    """
+    vendor = schema_editor.connection.vendor
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            if vendor == 'sqlite':
+                schema_editor.execute(
+                    "CREATE VIRTUAL TABLE core_gasto_fts USING fts5(descripcion, tokenize = 'trigram')"
+                )
+            elif vendor == 'postgresql':
+                schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            else:
+                return
+    except DatabaseError:
+        return
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            'INSERT INTO core_gasto_fts (rowid, descripcion) SELECT id, descripcion FROM core_gasto'
+        )
+    else:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS gasto_descripcion_trgm_idx '
+            'ON core_gasto USING gin (UPPER(descripcion::text) gin_trgm_ops)'
+        )
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_gasto_fts')
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS gasto_descripcion_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_gasto_importe_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.3 on 2026-10-18 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def construir_usos(apps, schema_editor):
+    """Genera los usos de cada comercio a partir de los gastos existentes."""
+    import time
+
+    from django.db.models import Count, Max
+
+    Gasto = apps.get_model('core', 'Gasto')
+    UsoComercio = apps.get_model('core', 'UsoComercio')
+    VersionDatos = apps.get_model('core', 'VersionDatos')
+    version = time.time_ns()
+    for clave in ('sugerencias', 'sugerencias:reconstruccion'):
+        VersionDatos.objects.update_or_create(clave=clave, defaults={'version': version})
+    filas = (
+        Gasto.objects.exclude(comercio_normalizado='').order_by()
+        .values_list('comercio_normalizado', 'categoria_id', 'fondo_id')
+        .annotate(veces=Count('id'), ultima=Max('fecha'))
+    )
+    UsoComercio.objects.bulk_create(
+        [
+            UsoComercio(
+                comercio=comercio, categoria_id=categoria_id, fondo_id=fondo_id,
+                veces=veces, ultima=ultima, version=version,
+            )
+            for comercio, categoria_id, fondo_id, veces, ultima in filas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsoComercio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comercio', models.CharField(max_length=200)),
+                ('veces', models.IntegerField(default=0)),
+                ('ultima', models.DateField()),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.categoria')),
+                ('fondo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.fondocomun')),
+            ],
+            options={
+                'verbose_name': 'Uso de comercio',
+                'verbose_name_plural': 'Usos de comercios',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('fondo__isnull', False)), fields=('comercio', 'categoria', 'fondo'), name='uso_comercio_unico_con_fondo'), models.UniqueConstraint(condition=models.Q(('fondo__isnull', True)), fields=('comercio', 'categoria'), name='uso_comercio_unico_sin_fondo')],
+            },
+        ),
+        migrations.RunPython(construir_usos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def construir_conteos(apps, schema_editor):
+    """Cuenta las palabras de los gastos existentes como ``core.clasificador.palabras``."""
+    import re
+    import time
+    import unicodedata
+    from collections import Counter
+
+    from django.db.models import Count
+
+    Gasto = apps.get_model('core', 'Gasto')
+    ConteoPalabra = apps.get_model('core', 'ConteoPalabra')
+    VersionDatos = apps.get_model('core', 'VersionDatos')
+    version = time.time_ns()
+    for clave in ('clasificador', 'clasificador:reconstruccion'):
+        VersionDatos.objects.update_or_create(clave=clave, defaults={'version': version})
+    palabra = re.compile(r'[a-z0-9]{2,}')
+    conteos = Counter()
+    filas = (
+        Gasto.objects.order_by()
+        .values_list('comercio_normalizado', 'categoria_id')
+        .annotate(veces=Count('id'))
+    )
+    for comercio, categoria_id, veces in filas:
+        conteos['', categoria_id] += veces
+        sin_tildes = unicodedata.normalize('NFKD', comercio or '').encode('ascii', 'ignore').decode()
+        for token in palabra.findall(sin_tildes.lower()):
+            conteos[token, categoria_id] += veces
+    ConteoPalabra.objects.bulk_create(
+        [
+            ConteoPalabra(palabra=token, categoria_id=categoria_id, veces=veces, version=version)
+            for (token, categoria_id), veces in conteos.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_uso_comercio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteoPalabra',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('palabra', models.CharField(blank=True, max_length=200)),
+                ('veces', models.IntegerField(default=0)),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.categoria')),
+            ],
+            options={
+                'verbose_name': 'Conteo de palabra',
+                'verbose_name_plural': 'Conteos de palabras',
+                'constraints': [models.UniqueConstraint(fields=('palabra', 'categoria'), name='conteo_palabra_unico')],
+            },
+        ),
+        migrations.RunPython(construir_conteos, migrations.RunPython.noop),
+    ]
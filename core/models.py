@@ -1,10 +1,11 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from decimal import Decimal
 from datetime import date
-from django.db import connection, OperationalError, ProgrammingError
+from django.db import connection, OperationalError, ProgrammingError, transaction
 import logging
 
 
@@ -19,7 +20,7 @@ Se añaden dos ampliaciones importantes respecto al código base del repositorio
    mostrará en el panel de fondos como «Supermercado».
 
 2. **Nueva categoría de gasto** ``Compras piso``: dentro de la lista
-   ``CATEGORIAS`` se incorpora una clave adicional (``'6'``) para agrupar
+   ``Categoria.INICIALES`` se incorpora una clave adicional (``'6'``) para agrupar
    desembolsos destinados a mobiliario, arreglos o compras puntuales del
    hogar. Esta ampliación garantiza que los usuarios puedan distinguir
    claramente entre gastos recurrentes del piso y compras de objetos.
@@ -33,12 +34,31 @@ logger = logging.getLogger(__name__)
 
 
 class Categoria(models.Model):
-    """Modelo sencillo para almacenar categorías personalizadas.
-
-    Aunque no se utiliza directamente en el código actual, este modelo
-    permanece por compatibilidad y posibles extensiones futuras.
+    """Categoría de un gasto.
+
+    ``Gasto`` y ``GastoRecurrente`` la referencian mediante una clave
+    foránea, de modo que los filtros por categoría son comparaciones de
+    igualdad sobre una columna indexada. ``codigo`` conserva la clave
+    antigua (``'1'``-``'6'``) de las categorías iniciales, que se usa para
+    asociar cada categoría con su fondo. La tabla es pequeña y se mantiene
+    en memoria (ver ``core.categorias``).
     """
-    nombre = models.CharField(max_length=100)
+
+    # Categorías iniciales: (código, nombre)
+    INICIALES = [
+        ('1', 'Supermercado'),
+        ('2', 'Viajes'),
+        ('3', 'Gastos piso'),
+        ('4', 'Ocio'),
+        ('5', 'Otros'),
+        ('6', 'Compras piso'),  # Compras de mobiliario o arreglos puntuales
+    ]
+
+    nombre = models.CharField(max_length=100, unique=True)
+    codigo = models.CharField(max_length=20, unique=True, null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
 
     def __str__(self) -> str:  # pragma: no cover - representación trivial
         return self.nombre
@@ -97,7 +117,8 @@ class FondoComun(models.Model):
         return f"{self.get_tipo_display()} - Saldo: {self.saldo}€"
 
 class IngresoFondo(models.Model):
-    fondo = models.ForeignKey('FondoComun', on_delete=models.CASCADE)
+    # Indexado junto con la fecha (ver ``Meta.indexes``)
+    fondo = models.ForeignKey('FondoComun', on_delete=models.CASCADE, db_index=False)
     cantidad = models.DecimalField(max_digits=10, decimal_places=2)
     fecha = models.DateField(auto_now_add=True)
     # ✅ permitir nulos (así no se atribuye a Sara/Adri cuando sea automático)
@@ -105,41 +126,168 @@ class IngresoFondo(models.Model):
 
     # ✅ nuevo: distinguir ingresos automáticos (objetivos) de los manuales
     es_automatico = models.BooleanField(default=False)
+    # Objetivo de ahorro que generó el ingreso automático y su periodo
+    objetivo = models.ForeignKey(
+        'ObjetivoAhorro', on_delete=models.SET_NULL, null=True, blank=True, related_name='ingresos_generados'
+    )
+    periodo = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['objetivo', 'periodo'], name='ingreso_objetivo_unico_por_periodo'),
+        ]
+        indexes = [
+            models.Index(fields=['fondo', 'fecha'], name='ingreso_fondo_fecha_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores leídos, para poder compensar el movimiento del fondo si el
+        # ingreso se edita o se borra (ver ``core.fondos``)
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._valores_originales = {campo.attname: getattr(self, campo.attname) for campo in self._meta.concrete_fields}
 
     def __str__(self):
         who = self.usuario.username if self.usuario else "automático"
         return f"{who} +{self.cantidad} → {self.fondo.nombre}"
 
+def normalizar_comercio(descripcion):
+    """Nombre del comercio con el que se agrupan los gastos de una misma tienda.
+
+    Se eliminan los espacios sobrantes y se pone en mayúscula la primera
+    letra de cada palabra, de modo que « mercadona» y «MERCADONA» cuenten
+    como el mismo comercio.
+    """
+    return ' '.join((descripcion or '').split()).title()
+
+
 class Gasto(models.Model):
     """Modelo que representa un gasto individual.
 
     Cada gasto contiene una descripción, la cantidad total, una fecha,
-    una categoría seleccionada de la lista ``CATEGORIAS``, el usuario que
-    pagó y opcionalmente el fondo del que se descontará el importe.
-
-    Se amplía ``CATEGORIAS`` con una entrada para «Compras piso» (clave
-    ``'6'``) para diferenciar los gastos en muebles o arreglos puntuales
-    respecto a los gastos recurrentes del piso.
+    una ``Categoria``, el usuario que pagó y opcionalmente el fondo del que
+    se descontará el importe.
     """
 
-    CATEGORIAS = [
-        ('1', 'Supermercado'),
-        ('2', 'Viajes'),
-        ('3', 'Gastos piso'),
-        ('4', 'Ocio'),
-        ('5', 'Otros'),
-        ('6', 'Compras piso'),  # Nueva categoría para compras de mobiliario
-    ]
-
     descripcion = models.CharField(max_length=200)
     monto_total = models.DecimalField(max_digits=10, decimal_places=2)
     fecha = models.DateField(auto_now_add=False)
-    categoria = models.CharField(max_length=20, choices=CATEGORIAS)
+    categoria = models.ForeignKey(Categoria, on_delete=models.PROTECT, related_name='gastos', db_index=False)
     pagado_por = models.ForeignKey(User, on_delete=models.CASCADE)
-    fondo = models.ForeignKey(FondoComun, on_delete=models.CASCADE, null=True, blank=True)
+    fondo = models.ForeignKey(FondoComun, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    # Gasto recurrente que lo generó y periodo al que corresponde (vacíos en
+    # los gastos introducidos a mano). La restricción de unicidad impide que
+    # dos procesos apliquen dos veces el mismo recurrente en un periodo.
+    recurrente = models.ForeignKey(
+        'GastoRecurrente', on_delete=models.SET_NULL, null=True, blank=True, related_name='gastos_generados'
+    )
+    periodo = models.DateField(null=True, blank=True)
+    # Descripción normalizada (ver ``normalizar_comercio``) para agrupar los
+    # gastos por tienda en SQL. Se rellena al guardar.
+    comercio_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False)
 
     class Meta:
         ordering = ['-fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['recurrente', 'periodo'], name='gasto_recurrente_unico_por_periodo'),
+        ]
+        # Índices para las consultas habituales: listados y saldos por
+        # intervalos de fechas (ordenados por fecha e id), listados por
+        # importe (ordenados por importe e id) y filtros por
+        # categoría, fondo o comercio dentro de un intervalo. Los índices
+        # compuestos sirven también para las claves foráneas, que por eso no
+        # crean el suyo propio.
+        indexes = [
+            models.Index(fields=['fecha', 'id'], name='gasto_fecha_id_idx'),
+            models.Index(fields=['monto_total', 'id'], name='gasto_importe_id_idx'),
+            models.Index(fields=['categoria', 'fecha'], name='gasto_categoria_fecha_idx'),
+            models.Index(fields=['fondo', 'fecha'], name='gasto_fondo_fecha_idx'),
+            models.Index(fields=['comercio_normalizado', 'fecha'], name='gasto_comercio_fecha_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guardamos los valores leídos para poder detectar qué ha cambiado al
+        # guardar o borrar el gasto (ver señales más abajo).
+        instance._valores_originales = dict(zip(field_names, values))
+        return instance
+
+    def valor_normalizado(self, attname):
+        """Devuelve el valor actual de ``attname`` convertido a su tipo Python.
+
+        Las vistas asignan a veces cadenas sin convertir (p. ej. la fecha
+        recibida por POST); esta función las normaliza antes de comparar.
+        """
+        campo = self._meta.get_field(attname.removesuffix('_id'))
+        valor = getattr(self, attname)
+        return valor if campo.is_relation else campo.to_python(valor)
+
+    def save(self, *args, **kwargs):
+        self.comercio_normalizado = normalizar_comercio(self.descripcion)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'descripcion' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'comercio_normalizado'}
+        super().save(*args, **kwargs)
+        # Las señales ``post_save`` ya han comparado con los valores anteriores
+        self.refrescar_valores_originales()
+
+    def refrescar_valores_originales(self):
+        """Toma los valores actuales como referencia para el próximo guardado."""
+        self._valores_originales = {
+            campo.attname: self.valor_normalizado(campo.attname)
+            for campo in self._meta.concrete_fields
+        }
+
+
+class Liquidacion(models.Model):
+    """Momento en el que Sara y Adri saldan cuentas.
+
+    Además de la transferencia realizada (quién la hace y por cuánto) se
+    guarda el balance acumulado hasta la fecha de la liquidación, expresado
+    desde el punto de vista de Sara (positivo: Adri le debe dinero a Sara) e
+    incluyendo todos los gastos con fecha igual o anterior. De este modo el
+    balance actual solo necesita agregar los gastos posteriores a la última
+    liquidación. El campo ``saldo`` se mantiene automáticamente: se recalcula
+    al crear la liquidación y cada vez que se modifica un gasto anterior.
+    """
+
+    fecha = models.DateField()
+    pagado_por = models.ForeignKey(User, on_delete=models.PROTECT, related_name='liquidaciones')
+    cantidad = models.DecimalField(max_digits=10, decimal_places=2)
+    # Los repartos proporcionales generan hasta cuatro decimales
+    saldo = models.DecimalField(max_digits=14, decimal_places=4, default=0, editable=False)
+    creada = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-fecha', '-id']
+        verbose_name = 'Liquidación'
+        verbose_name_plural = 'Liquidaciones'
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.fecha} - {self.pagado_por} transfiere {self.cantidad}€"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Si se cambia la fecha hay que recalcular también desde la anterior
+        instance._fecha_original = instance.__dict__.get('fecha')
+        return instance
+
+    def saldo_tras_liquidar(self):
+        """Balance (punto de vista de Sara) una vez hecha la transferencia.
+
+        Si paga Sara, Adri pasa a deberle esa cantidad más; si paga Adri, al
+        revés.
+        """
+        if self.pagado_por.username == 'sara':
+            return self.saldo + self.cantidad
+        return self.saldo - self.cantidad
 
 
 @receiver(post_save, sender=User)
@@ -166,38 +314,410 @@ def guardar_perfil_usuario(sender, instance, **kwargs):
     except (OperationalError, ProgrammingError):
         # base aún sin migrar: no bloqueamos el login
         pass
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 
+
+class ResumenMensual(models.Model):
+    """Totales de gastos agregados por mes, categoría, fondo y pagador.
+
+    Es una tabla derivada de ``Gasto`` que las señales mantienen al día con
+    incrementos atómicos (ver ``core.resumen``), de modo que el resumen
+    financiero y las gráficas no dependen del número de gastos. Se puede
+    reconstruir y verificar con ``python manage.py reconstruir_resumen``.
+    """
+
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    fondo = models.ForeignKey(FondoComun, on_delete=models.CASCADE, null=True, blank=True)
+    pagado_por = models.ForeignKey(User, on_delete=models.CASCADE)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    numero = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Resumen mensual'
+        verbose_name_plural = 'Resúmenes mensuales'
+        constraints = [
+            # Los NULL no chocan en un índice único: los gastos sin fondo
+            # necesitan su propia restricción
+            models.UniqueConstraint(
+                fields=['ano', 'mes', 'categoria', 'fondo', 'pagado_por'],
+                condition=models.Q(fondo__isnull=False),
+                name='resumen_mensual_unico_con_fondo',
+            ),
+            models.UniqueConstraint(
+                fields=['ano', 'mes', 'categoria', 'pagado_por'],
+                condition=models.Q(fondo__isnull=True),
+                name='resumen_mensual_unico_sin_fondo',
+            ),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.ano}-{self.mes:02d} {self.categoria}: {self.total}€"
+
+
+class MovimientoFondo(models.Model):
+    """Movimiento (inmutable) del saldo de un fondo común.
+
+    Cada gasto con fondo genera un cargo, cada ``IngresoFondo`` un abono y
+    cada ajuste manual del saldo un movimiento de ajuste. Las ediciones y
+    los borrados no modifican movimientos anteriores sino que añaden otros
+    que los compensan, de modo que la suma de los movimientos de un fondo
+    hasta una fecha es su saldo en esa fecha. ``FondoComun.saldo`` es la
+    suma de todos ellos (ver ``core.fondos``).
+    """
+
+    TIPOS = [
+        ('GASTO', 'Gasto'),
+        ('INGRESO', 'Ingreso'),
+        ('AJUSTE', 'Ajuste manual'),
+        ('APERTURA', 'Saldo inicial'),
+    ]
+
+    fondo = models.ForeignKey(FondoComun, on_delete=models.PROTECT, related_name='movimientos', db_index=False)
+    fecha = models.DateField()
+    importe = models.DecimalField(max_digits=12, decimal_places=2)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    descripcion = models.CharField(max_length=200, blank=True, default='')
+    gasto = models.ForeignKey(
+        Gasto, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos'
+    )
+    ingreso = models.ForeignKey(
+        IngresoFondo, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos'
+    )
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['fecha', 'id']
+        verbose_name = 'Movimiento de fondo'
+        verbose_name_plural = 'Movimientos de fondos'
+        indexes = [
+            models.Index(fields=['fondo', 'fecha'], name='movimiento_fondo_fecha_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Los movimientos de fondo no se pueden modificar; registra uno que lo compense')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Los movimientos de fondo no se pueden borrar; registra uno que lo compense')
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.fecha} {self.get_tipo_display()} {self.importe}€ ({self.fondo_id})"
+
+
+class CierreFondo(models.Model):
+    """Saldo de un fondo al final de un día (normalmente el último del mes).
+
+    Permite calcular el saldo en cualquier fecha partiendo del cierre
+    anterior más cercano y sumando solo los movimientos posteriores. Los
+    movimientos con fecha anterior a un cierre ya existente lo corrigen al
+    registrarse.
+    """
+
+    fondo = models.ForeignKey(FondoComun, on_delete=models.CASCADE, related_name='cierres')
+    fecha = models.DateField()
+    saldo = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        ordering = ['fondo', 'fecha']
+        verbose_name = 'Cierre de fondo'
+        verbose_name_plural = 'Cierres de fondos'
+        constraints = [
+            models.UniqueConstraint(fields=['fondo', 'fecha'], name='cierre_fondo_unico_por_fecha'),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.fondo_id} a {self.fecha}: {self.saldo}€"
+
+
+class VersionDatos(models.Model):
+    """Versión de unos datos que los procesos copian en memoria o en la caché.
+
+    Cada ``clave`` (``'categorias'``...) cambia de versión al cambiar sus
+    datos, en la misma transacción; es la referencia común a todos los
+    procesos para saber si su copia sigue valiendo (ver ``core.versiones``).
+    """
+
+    clave = models.CharField(max_length=30, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Versión de datos'
+        verbose_name_plural = 'Versiones de datos'
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.clave}: {self.version}"
+
+
+class UsoComercio(models.Model):
+    """Usos de un comercio con una categoría y un fondo, para las sugerencias.
+
+    Es la forma compacta del índice de ``core.sugerencias``: las señales de
+    ``Gasto`` la mantienen en la misma transacción con incrementos
+    atómicos y cada fila guarda la versión de su último cambio, de modo que
+    los procesos leen solo las filas cambiadas desde su copia.
+    """
+
+    comercio = models.CharField(max_length=200)
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    fondo = models.ForeignKey(FondoComun, on_delete=models.CASCADE, null=True, blank=True)
+    veces = models.IntegerField(default=0)
+    ultima = models.DateField()
+    version = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Uso de comercio'
+        verbose_name_plural = 'Usos de comercios'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['comercio', 'categoria', 'fondo'],
+                condition=models.Q(fondo__isnull=False),
+                name='uso_comercio_unico_con_fondo',
+            ),
+            models.UniqueConstraint(
+                fields=['comercio', 'categoria'],
+                condition=models.Q(fondo__isnull=True),
+                name='uso_comercio_unico_sin_fondo',
+            ),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.comercio} ({self.categoria_id}, {self.fondo_id}): {self.veces}"
+
+
+class ConteoPalabra(models.Model):
+    """Apariciones de una palabra en los gastos de una categoría, para el clasificador.
+
+    Son los recuentos del modelo de ``core.clasificador``; con ``palabra``
+    vacía, el número de gastos de la categoría. Como ``UsoComercio``, se
+    mantienen con las señales de ``Gasto`` y cada fila guarda la versión de
+    su último cambio.
+    """
+
+    palabra = models.CharField(max_length=200, blank=True)
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    veces = models.IntegerField(default=0)
+    version = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Conteo de palabra'
+        verbose_name_plural = 'Conteos de palabras'
+        constraints = [
+            models.UniqueConstraint(fields=['palabra', 'categoria'], name='conteo_palabra_unico'),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - representación trivial
+        return f"{self.palabra!r} en {self.categoria_id}: {self.veces}"
+
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+
+# ``bulk_create`` no emite ``post_save``: quien inserte gastos en bloque debe
+# enviar esta señal con ``gastos=<lista de Gasto>`` para que se mantengan los
+# datos derivados (liquidaciones, etc.).
+gastos_creados_en_bloque = Signal()
+
+# Campos de ``Gasto`` que influyen en el balance de deuda
+CAMPOS_BALANCE = ('fecha', 'monto_total', 'pagado_por_id', 'fondo_id')
+
+
+@receiver(post_save, sender=Gasto)
+def actualizar_liquidaciones_gasto_guardado(sender, instance, created, **kwargs):
+    """Recalcula las liquidaciones si se crea o edita un gasto anterior a ellas."""
+    from .balance import invalidar_por_fechas
+
+    originales = getattr(instance, '_valores_originales', {})
+    cambia_balance = created or any(
+        originales.get(campo) != instance.valor_normalizado(campo) for campo in CAMPOS_BALANCE
+    )
+    if cambia_balance:
+        invalidar_por_fechas(instance.valor_normalizado('fecha'), originales.get('fecha'))
+
+
+@receiver(post_delete, sender=Gasto)
+def actualizar_liquidaciones_gasto_borrado(sender, instance, **kwargs):
+    from .balance import invalidar_por_fechas
+
+    invalidar_por_fechas(instance.valor_normalizado('fecha'))
+
+
+@receiver(post_save, sender=Gasto)
+def actualizar_resumen_gasto_guardado(sender, instance, created, **kwargs):
+    """Mueve el importe del gasto en la tabla ``ResumenMensual``."""
+    from . import resumen
+
+    if created:
+        resumen.registrar_gastos([instance])
+    else:
+        resumen.registrar_cambio(instance)
+
+
+@receiver(post_delete, sender=Gasto)
+def actualizar_resumen_gasto_borrado(sender, instance, **kwargs):
+    from . import resumen
+
+    resumen.registrar_gastos([instance], signo=-1)
+
+
+@receiver(gastos_creados_en_bloque)
+def actualizar_resumen_gastos_en_bloque(sender, gastos, **kwargs):
+    from . import resumen
+
+    resumen.registrar_gastos(gastos)
+
+
+@receiver(gastos_creados_en_bloque)
+def actualizar_liquidaciones_gastos_en_bloque(sender, gastos, **kwargs):
+    from .balance import invalidar_por_fechas
+
+    invalidar_por_fechas(*{gasto.valor_normalizado('fecha') for gasto in gastos})
+
+
+@receiver(post_save, sender=Liquidacion)
+@receiver(post_delete, sender=Liquidacion)
+def recalcular_liquidaciones_posteriores(sender, instance, **kwargs):
+    """Una liquidación nueva, editada o borrada altera las siguientes."""
+    from .balance import recalcular_liquidaciones
+
+    fecha = instance._meta.get_field('fecha').to_python(instance.fecha)
+    fecha_original = getattr(instance, '_fecha_original', None)
+    recalcular_liquidaciones(min(fecha, fecha_original) if fecha_original else fecha)
+    instance._fecha_original = fecha
+
+
+@receiver(post_save, sender=Gasto)
 @receiver(post_save, sender=IngresoFondo)
-def actualizar_saldo_fondo(sender, instance, created, **kwargs):
+def registrar_movimiento_guardado(sender, instance, created, **kwargs):
+    """Carga el gasto o abona el ingreso en su fondo (o corrige el movimiento si se ha editado)."""
+    from .fondos import movimientos_por_cambio, registrar_movimientos
+
+    registrar_movimientos(movimientos_por_cambio(instance, creado=created))
+
+
+@receiver(post_delete, sender=Gasto)
+@receiver(post_delete, sender=IngresoFondo)
+def registrar_movimiento_borrado(sender, instance, **kwargs):
+    from .fondos import movimientos_por_cambio, registrar_movimientos
+
+    registrar_movimientos(movimientos_por_cambio(instance, borrado=True))
+
+
+@receiver(gastos_creados_en_bloque)
+def registrar_movimientos_gastos_en_bloque(sender, gastos, **kwargs):
+    from .fondos import movimientos_por_cambio, registrar_movimientos
+
+    registrar_movimientos([mov for gasto in gastos for mov in movimientos_por_cambio(gasto, creado=True)])
+
+
+@receiver(post_save, sender=Gasto)
+def indexar_gasto_guardado(sender, instance, created, **kwargs):
+    """Lleva la descripción nueva o editada al índice de búsqueda."""
+    from . import busqueda
+
+    if created or getattr(instance, '_valores_originales', {}).get('descripcion') != instance.descripcion:
+        busqueda.indexar([instance])
+
+
+@receiver(post_delete, sender=Gasto)
+def quitar_gasto_borrado_del_indice(sender, instance, **kwargs):
+    from . import busqueda
+
+    busqueda.quitar([instance.pk])
+
+
+@receiver(gastos_creados_en_bloque)
+def indexar_gastos_en_bloque(sender, gastos, **kwargs):
+    from . import busqueda
+
+    busqueda.indexar(gastos)
+
+
+@receiver(post_save, sender=Gasto)
+def actualizar_sugerencias_gasto_guardado(sender, instance, created, **kwargs):
+    """Lleva el gasto al índice de sugerencias del formulario de gastos."""
+    from . import sugerencias
+
+    if created:
+        sugerencias.registrar_gastos([instance])
+    else:
+        sugerencias.registrar_cambio(instance)
+
+
+@receiver(post_delete, sender=Gasto)
+def actualizar_sugerencias_gasto_borrado(sender, instance, **kwargs):
+    from . import sugerencias
+
+    sugerencias.registrar_borrado(instance)
+
+
+@receiver(gastos_creados_en_bloque)
+def actualizar_sugerencias_gastos_en_bloque(sender, gastos, **kwargs):
+    from . import sugerencias
+
+    sugerencias.registrar_gastos(gastos)
+
+
+@receiver(post_save, sender=Gasto)
+def entrenar_clasificador_gasto_guardado(sender, instance, created, **kwargs):
+    """Enseña al clasificador de categorías el gasto nuevo o corregido."""
+    from . import clasificador
+
     if created:
-        fondo = instance.fondo
-        fondo.saldo += instance.cantidad
-        fondo.save()
+        clasificador.registrar_gastos([instance])
+    else:
+        clasificador.registrar_cambio(instance)
+
+
+@receiver(post_delete, sender=Gasto)
+def entrenar_clasificador_gasto_borrado(sender, instance, **kwargs):
+    from . import clasificador
+
+    clasificador.registrar_borrado(instance)
+
+
+@receiver(gastos_creados_en_bloque)
+def entrenar_clasificador_gastos_en_bloque(sender, gastos, **kwargs):
+    from . import clasificador
+
+    clasificador.registrar_gastos(gastos)
 
 class GastoRecurrente(models.Model):
+    """Gasto que se repite con una periodicidad fija (suscripciones, seguros...).
+
+    Las ocurrencias se calculan a partir de ``fecha_inicio`` (el día del mes
+    de esa fecha se respeta en las periodicidades mensuales) y se generan
+    todas las pendientes desde ``ultima_fecha_aplicada``, de modo que no se
+    pierde ninguna aunque nadie abra la aplicación durante un tiempo. Ver
+    ``core.recurrentes``.
+    """
+
     PERIODICIDADES = [
+        ('SEMANAL', 'Semanal'),
         ('MENSUAL', 'Mensual'),
+        ('TRIMESTRAL', 'Trimestral'),
         ('ANUAL', 'Anual'),
+        ('PERSONALIZADA', 'Cada N días'),
     ]
     nombre = models.CharField(max_length=120)
     monto = models.DecimalField(max_digits=10, decimal_places=2)
-    periodicidad = models.CharField(max_length=10, choices=PERIODICIDADES, default='MENSUAL')
-    categoria = models.CharField(max_length=20, choices=[  # usa las mismas categorías que Gasto
-        ('1', 'Supermercado'),
-        ('2', 'Viajes'),
-        ('3', 'Gastos piso'),
-        ('4', 'Ocio'),
-        ('5', 'Otros'),
-        ('6', 'Compras piso'),
-    ], default='5')
+    periodicidad = models.CharField(max_length=15, choices=PERIODICIDADES, default='MENSUAL')
+    # Solo para la periodicidad PERSONALIZADA
+    intervalo_dias = models.PositiveIntegerField(null=True, blank=True)
+    categoria = models.ForeignKey(Categoria, on_delete=models.PROTECT, related_name='recurrentes')
     fondo = models.ForeignKey('FondoComun', on_delete=models.SET_NULL, null=True, blank=True)
     prorratear = models.BooleanField(default=False)  # solo relevante si periodicidad = ANUAL
     activo = models.BooleanField(default=True)
-    # Para evitar duplicados, guardamos el último mes/año aplicado
-    ultimo_ano_aplicado = models.IntegerField(null=True, blank=True)
-    ultimo_mes_aplicado = models.IntegerField(null=True, blank=True)
+    # Fecha de la primera ocurrencia; si está vacía se empieza el día en que
+    # se aplica por primera vez
+    fecha_inicio = models.DateField(null=True, blank=True, default=date.today)
+    # Para evitar duplicados, guardamos la fecha de la última ocurrencia aplicada
+    ultima_fecha_aplicada = models.DateField(null=True, blank=True)
+
+    def clean(self):
+        if self.periodicidad == 'PERSONALIZADA' and not self.intervalo_dias:
+            raise ValidationError({'intervalo_dias': 'Indica cada cuántos días se repite el gasto.'})
 
     def __str__(self):
         return f"{self.nombre} ({self.periodicidad})"
@@ -219,3 +739,60 @@ class ObjetivoAhorro(models.Model):
 
     def __str__(self):
         return f"{self.nombre} → objetivo {self.monto_objetivo}€"
+
+
+@receiver(post_save, sender=GastoRecurrente)
+@receiver(post_save, sender=ObjetivoAhorro)
+def olvidar_periodo_aplicado_al_cambiar(sender, instance, **kwargs):
+    """Un recurrente u objetivo nuevo (o reactivado) debe aplicarse este mes."""
+    from .recurrentes import olvidar_periodo_aplicado
+
+    olvidar_periodo_aplicado()
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def olvidar_categorias_al_cambiar(sender, instance, **kwargs):
+    """Invalida la copia en memoria de la tabla de categorías."""
+    from .categorias import olvidar_categorias
+
+    olvidar_categorias()
+
+
+@receiver(post_save, sender=Gasto)
+def contar_gasto_creado(sender, instance, created, **kwargs):
+    """Cuenta el gasto para ``gastos_gastos_creados_total`` (ver ``core.metricas``)."""
+    from . import metricas
+
+    if created:
+        transaction.on_commit(lambda: metricas.incrementar('gastos_gastos_creados_total', origen='individual'))
+
+
+@receiver(gastos_creados_en_bloque)
+def contar_gastos_en_bloque(sender, gastos, **kwargs):
+    from . import metricas
+
+    numero = len(gastos)
+    transaction.on_commit(lambda: metricas.incrementar('gastos_gastos_creados_total', numero, origen='bloque'))
+
+
+@receiver(post_save, sender=Gasto)
+@receiver(post_delete, sender=Gasto)
+@receiver(post_save, sender=IngresoFondo)
+@receiver(post_delete, sender=IngresoFondo)
+@receiver(post_save, sender=FondoComun)
+@receiver(post_delete, sender=FondoComun)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_paneles(sender, instance, **kwargs):
+    """Los paneles guardados en la caché dejan de valer (ver ``core.paneles``)."""
+    from . import paneles
+
+    paneles.invalidar()
+
+
+@receiver(gastos_creados_en_bloque)
+def invalidar_paneles_en_bloque(sender, gastos, **kwargs):
+    from . import paneles
+
+    paneles.invalidar()
@@ -0,0 +1,130 @@
+"""
+Paginación por clave (*keyset* o *seek*) para los listados de gastos.
+
+En lugar de ``OFFSET`` se recuerda la clave de ordenación de la última fila
+mostrada (por ejemplo ``(fecha, id)``) y la página siguiente se obtiene con
+una condición ``WHERE`` sobre esa clave. Así cada página cuesta lo mismo
+con independencia de su posición, solo se leen de la base de datos las
+filas que se van a mostrar y las páginas no se desplazan aunque se inserten
+gastos nuevos mientras alguien está navegando.
+
+El cursor viaja en la URL como los valores de la clave separados por ``_``
+(p. ej. ``2025-09-12_123``). Los campos de la clave no pueden ser nulos y el
+último debe ser único (normalmente ``id``).
+"""
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+TAMANO_PAGINA = 10
+SEPARADOR = '_'
+
+
+class PaginaKeyset:
+    """Resultado de :func:`paginar_keyset`.
+
+    ``object_list`` contiene las filas de la página y los cursores permiten
+    construir los enlaces a la página siguiente y a la anterior.
+    """
+
+    def __init__(self, object_list, has_next, has_previous, cursor_siguiente, cursor_anterior):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def is_paginated(self):
+        return self.has_next or self.has_previous
+
+
+def _campos(orden):
+    """Convierte ``['-fecha', 'id']`` en ``[('fecha', True), ('id', False)]``."""
+    return [(campo.lstrip('-'), campo.startswith('-')) for campo in orden]
+
+
+def codificar_cursor(obj, orden):
+    """Cursor con los valores de la clave de ordenación de ``obj``."""
+    return SEPARADOR.join(str(getattr(obj, nombre)) for nombre, _ in _campos(orden))
+
+
+def decodificar_cursor(model, orden, cursor):
+    """Devuelve los valores del cursor convertidos, o ``None`` si no es válido."""
+    partes = cursor.split(SEPARADOR) if cursor else []
+    campos = _campos(orden)
+    if len(partes) != len(campos):
+        return None
+    try:
+        # ``clean`` además valida el rango (p. ej. ``max_digits``): un valor
+        # fuera de él dejaría la página vacía
+        return [
+            model._meta.get_field(nombre).clean(valor, None)
+            for (nombre, _), valor in zip(campos, partes)
+        ]
+    except ValidationError:
+        return None
+
+
+def _filtro_seek(orden, valores, hacia_atras):
+    """Condición «estrictamente después de ``valores``» en el orden dado.
+
+    Para una clave ``(a, b)`` descendente equivale a
+    ``a <= va AND (a < va OR (a = va AND b < vb))``. Con ``hacia_atras`` se
+    invierte el sentido para obtener las filas anteriores al cursor.
+
+    La primera condición es redundante, pero con parámetros enlazados
+    SQLite no deduce del ``OR`` un intervalo sobre ``a`` y recorrería el
+    índice entero; con ella la consulta empieza directamente en el cursor.
+    """
+    campos = _campos(orden)
+    condicion = Q()
+    iguales = Q()
+    for (nombre, descendente), valor in zip(campos, valores):
+        menor = descendente != hacia_atras
+        condicion |= iguales & Q(**{f'{nombre}__{"lt" if menor else "gt"}': valor})
+        iguales &= Q(**{nombre: valor})
+    nombre, descendente = campos[0]
+    return Q(**{f'{nombre}__{"lte" if descendente != hacia_atras else "gte"}': valores[0]}) & condicion
+
+
+def paginar_keyset(queryset, orden, despues=None, antes=None, tamano=TAMANO_PAGINA):
+    """Devuelve la página de ``queryset`` situada tras ``despues`` o antes de ``antes``.
+
+    Sin cursor se devuelve la primera página. Se lee una fila de más para
+    saber si hay página siguiente (o anterior, al retroceder) sin necesidad
+    de contar el total.
+    """
+    model = queryset.model
+    valores_antes = decodificar_cursor(model, orden, antes)
+    valores_despues = None if valores_antes else decodificar_cursor(model, orden, despues)
+
+    if valores_antes:
+        invertido = [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in orden]
+        filas = list(
+            queryset.filter(_filtro_seek(orden, valores_antes, True)).order_by(*invertido)[:tamano + 1]
+        )
+        has_previous = len(filas) > tamano
+        filas = filas[:tamano][::-1]
+        has_next = True
+    else:
+        if valores_despues:
+            queryset = queryset.filter(_filtro_seek(orden, valores_despues, False))
+        filas = list(queryset.order_by(*orden)[:tamano + 1])
+        has_next = len(filas) > tamano
+        filas = filas[:tamano]
+        has_previous = valores_despues is not None
+
+    return PaginaKeyset(
+        filas,
+        has_next=has_next and bool(filas),
+        has_previous=has_previous and bool(filas),
+        cursor_siguiente=codificar_cursor(filas[-1], orden) if filas else None,
+        cursor_anterior=codificar_cursor(filas[0], orden) if filas else None,
+    )
@@ -0,0 +1,54 @@
+"""
+Caché del contexto de los paneles (``panel_fondos`` y ``resumen_finanzas``).
+
+Los dos paneles muestran los mismos agregados (saldos, aportaciones,
+totales por categoría y por mes, series de los gráficos) a las dos
+usuarias, y los datos cambian pocas veces al día. :func:`contexto` guarda
+en la caché de Django el contexto ya calculado bajo una clave que incluye
+la versión de los datos, así que entre dos cambios cada visita es una
+sola lectura de la caché.
+
+La versión vive en la base de datos (ver ``core.versiones``), así que
+todos los procesos ven la misma. Se cambia, dentro de la transacción del
+cambio, con las señales de ``Gasto``, ``IngresoFondo``, ``FondoComun`` y
+``Categoria`` (ver ``models.py``), con ``gastos_creados_en_bloque``, cada
+vez que ``core.fondos`` actualiza saldos con ``UPDATE`` y al reconstruir
+el resumen mensual, de modo que ningún panel se sirve con datos
+anteriores al último cambio. Hay una sola versión porque la aplicación
+gestiona un solo hogar. Los contextos de versiones anteriores no se
+borran: dejan de leerse y caducan a las :data:`DURACION` segundos.
+
+Los contextos se guardan en la caché configurada en ``CACHES`` (en
+memoria de cada proceso por defecto; en ficheros o en la base de datos,
+compartida entre procesos, con ``DJANGO_CACHE``). Los aciertos y fallos
+se cuentan en ``gastos_cache_consultas_total`` (ver ``core.metricas``).
+"""
+
+from django.core.cache import cache
+
+from . import metricas, versiones
+
+CLAVE_VERSION = 'paneles'
+# Los contextos dependen del día, que ya forma parte de la clave
+DURACION = 24 * 60 * 60
+
+
+def invalidar():
+    """Descarta los contextos guardados tras un cambio en los datos.
+
+    La versión cambia en la transacción en curso: la propia transacción ya
+    no lee contextos anteriores, los demás procesos ven la versión nueva a
+    la vez que los datos y, si se deshace, la versión tampoco cambia.
+    """
+    versiones.cambiar(CLAVE_VERSION)
+
+
+def contexto(panel, clave, calcular):
+    """Contexto de ``panel`` para ``clave`` (texto), calculado con ``calcular()`` si no está guardado."""
+    clave_cache = f'paneles:{panel}:{versiones.leer(CLAVE_VERSION)}:{clave}'
+    guardado = cache.get(clave_cache)
+    metricas.registrar_cache(panel, guardado is not None)
+    if guardado is None:
+        guardado = calcular()
+        cache.set(clave_cache, guardado, DURACION)
+    return guardado
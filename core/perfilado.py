@@ -0,0 +1,89 @@
+"""
+Perfiles de CPU de peticiones concretas, a petición del personal.
+
+Una usuaria con ``is_staff`` puede añadir ``?perfilar=1`` a cualquier URL
+(o enviar la cabecera ``X-Perfilar: 1``) para que la petición se ejecute
+con ``cProfile`` (ver ``PerfiladoMiddleware`` en ``core.middleware``). El
+perfil se guarda en :func:`directorio` (``PERFILES_DIR``) con el nombre de
+la vista y la hora, y se puede abrir con ``pstats``, ``snakeviz`` o
+``python manage.py perfiles_vistas --mostrar``. Con ``perfilar=tabla``
+la respuesta se sustituye por la tabla de las funciones más costosas,
+ordenada por ``orden`` (``acumulado``, ``propio`` o ``llamadas``) y con
+``limite`` filas. Para el resto de usuarias el parámetro no hace nada.
+"""
+
+import datetime
+import io
+import pstats
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+EXTENSION = '.prof'
+# Orden de la tabla: nombre en la URL -> clave de ``pstats``
+ORDENES = {'acumulado': 'cumulative', 'propio': 'tottime', 'llamadas': 'calls'}
+LIMITE = 40
+# Caracteres permitidos en el nombre de la vista dentro del nombre del fichero
+_NO_PERMITIDOS = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+@dataclass
+class PerfilGuardado:
+    ruta: Path
+    vista: str
+    momento: datetime.datetime
+    tamano: int
+
+
+def directorio():
+    """Directorio de los perfiles (``PERFILES_DIR``), que se crea si no existe."""
+    ruta = Path(getattr(settings, 'PERFILES_DIR', Path(settings.BASE_DIR) / 'perfiles'))
+    ruta.mkdir(parents=True, exist_ok=True)
+    return ruta
+
+
+def guardar(perfilador, vista, momento=None):
+    """Guarda el perfil de ``perfilador`` (``cProfile.Profile``) y devuelve su ruta."""
+    momento = momento or datetime.datetime.now()
+    vista = _NO_PERMITIDOS.sub('-', vista or 'desconocida').strip('-') or 'desconocida'
+    ruta = directorio() / f'{momento:%Y%m%d-%H%M%S-%f}_{vista}{EXTENSION}'
+    perfilador.dump_stats(ruta)
+    return ruta
+
+
+def listar():
+    """Perfiles guardados, del más reciente al más antiguo."""
+    perfiles = []
+    for ruta in directorio().glob(f'*{EXTENSION}'):
+        marca, _, vista = ruta.stem.partition('_')
+        try:
+            momento = datetime.datetime.strptime(marca, '%Y%m%d-%H%M%S-%f')
+        except ValueError:
+            continue
+        perfiles.append(PerfilGuardado(ruta, vista, momento, ruta.stat().st_size))
+    return sorted(perfiles, key=lambda perfil: perfil.momento, reverse=True)
+
+
+def podar(dias=None, conservar=None):
+    """Borra los perfiles de hace más de ``dias`` días y los que pasen de los ``conservar`` más recientes.
+
+    Devuelve los perfiles borrados.
+    """
+    perfiles = listar()
+    limite = datetime.datetime.now() - datetime.timedelta(days=dias) if dias is not None else None
+    borrados = []
+    for posicion, perfil in enumerate(perfiles):
+        if (limite and perfil.momento < limite) or (conservar is not None and posicion >= conservar):
+            perfil.ruta.unlink(missing_ok=True)
+            borrados.append(perfil)
+    return borrados
+
+
+def tabla(origen, orden='acumulado', limite=LIMITE):
+    """Texto con las ``limite`` funciones más costosas de ``origen`` (perfilador o ruta)."""
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(str(origen) if isinstance(origen, Path) else origen, stream=salida)
+    estadisticas.strip_dirs().sort_stats(ORDENES.get(orden, ORDENES['acumulado'])).print_stats(limite)
+    return salida.getvalue()
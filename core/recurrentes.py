@@ -0,0 +1,281 @@
+"""
+Motor de aplicación de gastos recurrentes y objetivos de ahorro.
+
+Cada ``GastoRecurrente`` tiene una periodicidad (semanal, mensual,
+trimestral, anual o cada N días) y una fecha de inicio a partir de la cual
+se calculan sus ocurrencias. :func:`aplicar_pendientes` genera de una sola
+vez todas las ocurrencias pendientes entre la última aplicada y la fecha
+indicada, de modo que si nadie abre la aplicación durante unos meses no se
+pierde ninguna: se insertan con un único ``bulk_create``, se marcan como
+aplicadas con un ``UPDATE`` por tabla y los movimientos de los fondos se
+registran también en bloque, con un único ajuste de saldo por fondo. Los
+objetivos de ahorro aportan una vez por cada mes pendiente.
+
+Las vistas se limitan a llamar a :func:`asegurar_periodo_aplicado`, que
+recuerda (en memoria y en la caché) la fecha de la próxima ocurrencia y,
+hasta que llega, solo lee su versión (``core.versiones``), que cambia
+cuando se crea o modifica un recurrente u objetivo en cualquier proceso.
+
+Las restricciones de unicidad ``(recurrente, periodo)`` en ``Gasto`` y
+``(objetivo, periodo)`` en ``IngresoFondo`` garantizan que, aunque varios
+procesos de gunicorn apliquen a la vez, cada ocurrencia se aplique una sola
+vez: el proceso que pierde la carrera deshace su transacción y lo vuelve a
+comprobar en la siguiente petición.
+
+El comando ``python manage.py aplicar_recurrentes`` permite lanzar la
+aplicación desde un cron o simularla con ``--simular``.
+"""
+
+import calendar
+import datetime
+import logging
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Value, When
+
+from . import metricas, versiones
+from .fondos import movimientos_por_cambio, registrar_movimientos
+from .models import (
+    Gasto,
+    GastoRecurrente,
+    IngresoFondo,
+    ObjetivoAhorro,
+    gastos_creados_en_bloque,
+    normalizar_comercio,
+)
+
+logger = logging.getLogger(__name__)
+
+# (versión, fecha de la próxima ocurrencia) conocida por este proceso
+_proxima_ocurrencia = None
+
+CLAVE_VERSION = 'recurrentes'
+CLAVE_CACHE = 'recurrentes:proxima_ocurrencia:{version}'
+
+# Paso de cada periodicidad: (días, meses)
+PASOS = {
+    'SEMANAL': (7, 0),
+    'MENSUAL': (0, 1),
+    'TRIMESTRAL': (0, 3),
+    'ANUAL': (0, 12),
+}
+
+
+def _sumar_meses(fecha, meses, dia):
+    """``fecha`` desplazada ``meses`` meses, en el día ``dia`` (o el último del mes)."""
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    ano, mes = divmod(total, 12)
+    mes += 1
+    return datetime.date(ano, mes, min(dia, calendar.monthrange(ano, mes)[1]))
+
+
+def _primer_dia_mes_siguiente(fecha):
+    return _sumar_meses(fecha, 1, 1)
+
+
+def paso(recurrente):
+    """Devuelve el paso ``(días, meses)`` entre dos ocurrencias."""
+    if recurrente.periodicidad == 'PERSONALIZADA':
+        return (max(recurrente.intervalo_dias or 1, 1), 0)
+    if recurrente.periodicidad == 'ANUAL' and recurrente.prorratear:
+        # Un anual prorrateado se carga mes a mes
+        return (0, 1)
+    return PASOS.get(recurrente.periodicidad, (0, 1))
+
+
+def importe(recurrente):
+    """Importe de cada ocurrencia: completo o anual prorrateado."""
+    if recurrente.periodicidad == 'ANUAL' and recurrente.prorratear:
+        cantidad = recurrente.monto / Decimal('12')
+    else:
+        cantidad = recurrente.monto
+    return cantidad.quantize(Decimal('0.01'))
+
+
+def _ocurrencia(inicio, dias, meses, indice):
+    if dias:
+        return inicio + datetime.timedelta(days=dias * indice)
+    return _sumar_meses(inicio, meses * indice, inicio.day)
+
+
+def ocurrencias_pendientes(recurrente, hasta):
+    """Fechas de las ocurrencias pendientes de ``recurrente`` hasta ``hasta``.
+
+    Devuelve también la fecha de la primera ocurrencia posterior a
+    ``hasta``. Las ocurrencias se calculan siempre desde la fecha de inicio
+    para no acumular desfases al recortar los días 29-31 en meses cortos.
+    """
+    ultima = recurrente.ultima_fecha_aplicada
+    inicio = recurrente.fecha_inicio or ultima or hasta
+    dias, meses = paso(recurrente)
+
+    # Saltamos directamente a la primera ocurrencia posterior a la última aplicada
+    indice = 0
+    if ultima is not None and ultima >= inicio:
+        if dias:
+            indice = (ultima - inicio).days // dias
+        else:
+            indice = ((ultima.year - inicio.year) * 12 + ultima.month - inicio.month) // meses
+
+    fechas = []
+    while True:
+        fecha = _ocurrencia(inicio, dias, meses, indice)
+        if fecha > hasta:
+            return fechas, fecha
+        if ultima is None or fecha > ultima:
+            fechas.append(fecha)
+        indice += 1
+
+
+def meses_pendientes(objetivo, hasta):
+    """Primeros días de los meses pendientes de aportar para ``objetivo``."""
+    if objetivo.ultimo_ano_aplicado and objetivo.ultimo_mes_aplicado:
+        mes = _primer_dia_mes_siguiente(
+            datetime.date(objetivo.ultimo_ano_aplicado, objetivo.ultimo_mes_aplicado, 1)
+        )
+    else:
+        mes = hasta.replace(day=1)
+    meses = []
+    while mes <= hasta:
+        meses.append(mes)
+        mes = _primer_dia_mes_siguiente(mes)
+    return meses
+
+
+def aplicar_pendientes(hasta=None, simular=False):
+    """Genera todas las ocurrencias pendientes hasta ``hasta`` (hoy por defecto).
+
+    Devuelve un diccionario con los ``gastos`` e ``ingresos`` generados (o
+    que se generarían, si ``simular`` es cierto) y la fecha ``proxima`` en
+    la que habrá nuevas ocurrencias. Devuelve ``None`` si otro proceso estaba
+    aplicando a la vez; en ese caso no se guarda nada.
+    """
+    hasta = hasta or datetime.date.today()
+    try:
+        with transaction.atomic():
+            recurrentes = list(GastoRecurrente.objects.select_for_update().filter(activo=True))
+            objetivos = list(ObjetivoAhorro.objects.select_for_update().filter(activo=True))
+            proxima = _primer_dia_mes_siguiente(hasta) if objetivos else None
+
+            # Los gastos siempre salen de la cuenta conjunta; da igual quién
+            # aparezca como pagador.
+            pagador = User.objects.filter(username__in=['sara', 'adri']).first()
+            if recurrentes and pagador is None:
+                logger.warning('No hay usuarios sara/adri: no se aplican los gastos recurrentes')
+                recurrentes = []
+
+            candidatos = []
+            ultimas = {}
+            for rec in recurrentes:
+                fechas, siguiente = ocurrencias_pendientes(rec, hasta)
+                proxima = min(proxima, siguiente) if proxima else siguiente
+                candidatos.extend((rec, fecha) for fecha in fechas)
+                if fechas:
+                    ultimas[rec.pk] = fechas[-1]
+
+            # Ocurrencias ya generadas (por si las marcas no estuvieran al día)
+            ya_generados = set(
+                Gasto.objects.filter(
+                    recurrente__in=ultimas, periodo__gte=min(fecha for _, fecha in candidatos)
+                ).values_list('recurrente_id', 'periodo')
+            ) if candidatos else set()
+
+            gastos = [
+                Gasto(
+                    descripcion=f"[Recurrente] {rec.nombre}",
+                    # ``bulk_create`` no pasa por ``Gasto.save``
+                    comercio_normalizado=normalizar_comercio(f"[Recurrente] {rec.nombre}"),
+                    monto_total=importe(rec),
+                    categoria_id=rec.categoria_id,
+                    pagado_por=pagador,
+                    fecha=fecha,
+                    fondo_id=rec.fondo_id,
+                    recurrente=rec,
+                    periodo=fecha,
+                )
+                for rec, fecha in candidatos
+                if (rec.pk, fecha) not in ya_generados
+            ]
+
+            # Ingresos automáticos a los fondos (no se adjudican a Sara/Adri)
+            ingresos = [
+                IngresoFondo(
+                    fondo_id=obj.fondo_destino_id,
+                    cantidad=obj.aporte_mensual.quantize(Decimal('0.01')),
+                    usuario=None,
+                    es_automatico=True,
+                    objetivo=obj,
+                    periodo=mes,
+                )
+                for obj in objetivos
+                for mes in meses_pendientes(obj, hasta)
+            ]
+
+            if simular:
+                return {'gastos': gastos, 'ingresos': ingresos, 'proxima': proxima}
+
+            Gasto.objects.bulk_create(gastos)
+            if ultimas:
+                # Cada recurrente avanza a su última ocurrencia en un único UPDATE
+                GastoRecurrente.objects.filter(pk__in=ultimas).update(
+                    ultima_fecha_aplicada=Case(
+                        *[When(pk=pk, then=Value(fecha)) for pk, fecha in ultimas.items()]
+                    )
+                )
+            IngresoFondo.objects.bulk_create(ingresos)
+            ObjetivoAhorro.objects.filter(pk__in={ingreso.objetivo_id for ingreso in ingresos}).update(
+                ultimo_ano_aplicado=hasta.year, ultimo_mes_aplicado=hasta.month
+            )
+
+            # ``bulk_create`` no dispara ``post_save``: los movimientos de los
+            # fondos se registran en bloque (los de los gastos, con la señal)
+            registrar_movimientos(
+                [mov for ingreso in ingresos for mov in movimientos_por_cambio(ingreso, creado=True)]
+            )
+            if gastos:
+                gastos_creados_en_bloque.send(sender=Gasto, gastos=gastos)
+    except IntegrityError:
+        logger.info('Los recurrentes se están aplicando en otro proceso')
+        return None
+
+    metricas.incrementar('gastos_recurrentes_aplicaciones_total')
+    metricas.incrementar('gastos_recurrentes_generados_total', len(gastos), tipo='gasto')
+    metricas.incrementar('gastos_recurrentes_generados_total', len(ingresos), tipo='ingreso')
+    return {'gastos': gastos, 'ingresos': ingresos, 'proxima': proxima}
+
+
+def asegurar_periodo_aplicado(hoy=None):
+    """Garantiza que no quedan ocurrencias pendientes; pensado para cada petición.
+
+    Mientras no llegue la próxima ocurrencia conocida (en este proceso o en
+    la caché, compartida entre procesos si se configura un backend común) ni
+    cambie su versión no se hace más consulta que la de leerla.
+    """
+    global _proxima_ocurrencia
+    hoy = hoy or datetime.date.today()
+    version = versiones.leer(CLAVE_VERSION)
+    if _proxima_ocurrencia and _proxima_ocurrencia[0] == version and hoy < _proxima_ocurrencia[1]:
+        metricas.registrar_cache('recurrentes', True)
+        return
+
+    clave = CLAVE_CACHE.format(version=version)
+    proxima = cache.get(clave)
+    metricas.registrar_cache('recurrentes', bool(proxima) and hoy < proxima)
+    if not proxima or hoy >= proxima:
+        resultado = aplicar_pendientes(hoy)
+        if resultado is None:
+            return
+        # Sin recurrentes ni objetivos activos basta con volver a mirar mañana
+        proxima = resultado['proxima'] or hoy + datetime.timedelta(days=1)
+        cache.set(clave, proxima, max(int((proxima - hoy).total_seconds()), 1))
+    _proxima_ocurrencia = (version, proxima)
+
+
+def olvidar_periodo_aplicado():
+    """Da una versión nueva a la próxima ocurrencia para que todos los procesos la recalculen."""
+    global _proxima_ocurrencia
+    _proxima_ocurrencia = None
+    versiones.cambiar(CLAVE_VERSION)
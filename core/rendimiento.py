@@ -0,0 +1,196 @@
+"""
+Medición del rendimiento de las vistas principales.
+
+:func:`medir_vistas` ejecuta cada petición de :func:`peticiones` con el
+cliente de pruebas de Django (middleware, sesión y plantillas incluidos)
+y devuelve para cada una:
+
+* ``tiempo_ms``: mediana, mínimo y máximo de varias ejecuciones, tras una
+  primera que llena las cachés en memoria del proceso;
+* ``consultas``: número de consultas SQL de una ejecución;
+* ``memoria_pico_kb``: pico de memoria reservada por Python durante una
+  ejecución (``tracemalloc``; no incluye la que reserve la base de datos).
+
+Cada cosa se mide en ejecuciones distintas, porque registrar las
+consultas o la memoria ralentiza la vista. Las peticiones que guardan
+datos se deshacen al terminar.
+
+:func:`base_de_datos_temporal` crea una base de datos vacía como la de los
+tests, de modo que ``python manage.py medir_vistas`` puede generar datos a
+varias escalas (ver ``core.generacion``) sin tocar la base de datos real,
+y :func:`comparar` compara dos informes (por ejemplo, de dos commits).
+"""
+
+import datetime
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import categorias, clasificador, paneles, sugerencias
+from .recurrentes import olvidar_periodo_aplicado
+
+FORMATO = 'medir_vistas'
+VERSION = 1
+REPETICIONES = 5
+# Empeoramiento relativo del tiempo o la memoria que se tolera al comparar
+TOLERANCIA = 0.25
+
+
+def peticiones(usuario):
+    """``(nombre, método, ruta, datos)`` de las peticiones que se miden."""
+    supermercado = categorias.por_codigo('1')
+    return [
+        ('panel_gastos', 'get', reverse('panel_gastos'), {}),
+        ('panel_fondos', 'get', reverse('panel_fondos'), {}),
+        ('resumen_finanzas', 'get', reverse('resumen'), {}),
+        ('lista_gastos', 'get', reverse('lista_gastos'), {}),
+        ('lista_gastos_busqueda', 'get', reverse('lista_gastos'), {'q': 'mercadona'}),
+        ('crear_gasto', 'get', reverse('crear_gasto'), {}),
+        ('crear_gasto_guardar', 'post', reverse('crear_gasto'), {
+            'descripcion': 'Mercadona compra',
+            'monto_total': '23.45',
+            'categoria': supermercado.id if supermercado else '',
+            'pagado_por': usuario.id,
+            'fecha': datetime.date.today().isoformat(),
+        }),
+    ]
+
+
+def _ejecutar(cliente, metodo, ruta, datos):
+    if metodo == 'get':
+        return getattr(cliente, metodo)(ruta, datos)
+    # Lo que guarde la petición se deshace
+    with transaction.atomic():
+        respuesta = getattr(cliente, metodo)(ruta, datos)
+        transaction.set_rollback(True)
+    return respuesta
+
+
+def medir_vistas(usuario, repeticiones=REPETICIONES):
+    """Tiempo, consultas y memoria de cada petición, ejecutada como ``usuario``."""
+    resultados = {}
+    # El cliente de pruebas usa el host «testserver»
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        cliente = Client()
+        cliente.force_login(usuario)
+        for nombre, metodo, ruta, datos in peticiones(usuario):
+            respuesta = _ejecutar(cliente, metodo, ruta, datos)
+
+            with CaptureQueriesContext(connection) as capturadas:
+                _ejecutar(cliente, metodo, ruta, datos)
+            consultas = len(capturadas.captured_queries)
+
+            tracemalloc.start()
+            try:
+                _ejecutar(cliente, metodo, ruta, datos)
+                pico = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                _ejecutar(cliente, metodo, ruta, datos)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+
+            resultados[nombre] = {
+                'estado': respuesta.status_code,
+                'tiempo_ms': {
+                    'mediana': round(statistics.median(tiempos), 2),
+                    'minimo': round(min(tiempos), 2),
+                    'maximo': round(max(tiempos), 2),
+                },
+                'consultas': consultas,
+                'memoria_pico_kb': round(pico / 1024),
+            }
+    return resultados
+
+
+def olvidar_datos_en_memoria():
+    """Descarta las copias en memoria de este proceso (al cambiar de base de datos)."""
+    categorias.olvidar_categorias()
+    sugerencias.olvidar_indice()
+    clasificador.olvidar_modelo()
+    olvidar_periodo_aplicado()
+    paneles.invalidar()
+
+
+@contextmanager
+def base_de_datos_temporal():
+    """Usa durante el bloque una base de datos nueva y migrada, que se borra al salir.
+
+    Se crea como la de los tests (``create_test_db``); con SQLite, en un
+    fichero temporal en lugar de en memoria, para que el rendimiento sea el
+    de una base de datos real.
+    """
+    nombre = connection.settings_dict['NAME']
+    opciones_test = connection.settings_dict.setdefault('TEST', {})
+    nombre_test = opciones_test.get('NAME')
+    with tempfile.TemporaryDirectory() as directorio:
+        if connection.vendor == 'sqlite':
+            opciones_test['NAME'] = os.path.join(directorio, 'medicion.sqlite3')
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            olvidar_datos_en_memoria()
+            yield
+        finally:
+            connection.creation.destroy_test_db(nombre, verbosity=0)
+            opciones_test['NAME'] = nombre_test
+            olvidar_datos_en_memoria()
+
+
+def entorno():
+    """Datos del entorno de la medición, para interpretar y comparar informes."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'base_de_datos': connection.vendor,
+        'version_base_de_datos': connection.Database.sqlite_version if connection.vendor == 'sqlite' else None,
+    }
+
+
+def comparar(anterior, actual, tolerancia=TOLERANCIA):
+    """Diferencias entre dos informes, para las escalas y vistas que tengan ambos.
+
+    Devuelve una lista de ``(gastos, vista, métrica, antes, después,
+    empeora)``. Una métrica empeora si el tiempo (mediana) o la memoria
+    crecen más de ``tolerancia`` (en proporción) o si hay más consultas.
+    """
+    previas = {escala['gastos']: escala['vistas'] for escala in anterior.get('escalas', [])}
+    diferencias = []
+    for escala in actual.get('escalas', []):
+        vistas_previas = previas.get(escala['gastos'], {})
+        for vista, medida in escala['vistas'].items():
+            previa = vistas_previas.get(vista)
+            if previa is None:
+                continue
+            metricas = [
+                ('tiempo_ms', previa['tiempo_ms']['mediana'], medida['tiempo_ms']['mediana'], tolerancia),
+                ('consultas', previa['consultas'], medida['consultas'], 0),
+                ('memoria_pico_kb', previa['memoria_pico_kb'], medida['memoria_pico_kb'], tolerancia),
+            ]
+            for metrica, antes, despues, margen in metricas:
+                empeora = despues > antes * (1 + margen)
+                diferencias.append((escala['gastos'], vista, metrica, antes, despues, empeora))
+    return diferencias
@@ -0,0 +1,214 @@
+"""
+Mantenimiento y consulta de la tabla agregada ``ResumenMensual``.
+
+Cada fila acumula el importe y el número de gastos de un mes para una
+combinación de categoría, fondo y pagador. Las señales de ``Gasto`` llaman
+a :func:`registrar_gastos` y :func:`registrar_cambio`, que aplican los
+incrementos con expresiones ``F()`` (un ``UPDATE`` atómico por clave), y el
+resumen financiero lee solo de esta tabla, por lo que su coste no depende
+del número de gastos.
+
+:func:`reconstruir` rehace la tabla desde cero a partir de ``Gasto`` y
+:func:`verificar` la compara con los datos originales; ambas se usan desde
+el comando ``python manage.py reconstruir_resumen``.
+"""
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from . import paneles
+from .models import Gasto, ResumenMensual
+
+CAMPOS_CLAVE = ('ano', 'mes', 'categoria_id', 'fondo_id', 'pagado_por_id')
+CAMPOS_GASTO = ('fecha', 'categoria_id', 'fondo_id', 'pagado_por_id', 'monto_total')
+
+
+def _clave(valores):
+    """Clave de la fila de resumen a partir de los valores de un gasto."""
+    fecha = valores['fecha']
+    return (fecha.year, fecha.month, valores['categoria_id'], valores['fondo_id'], valores['pagado_por_id'])
+
+
+def _valores(gasto):
+    """Valores actuales (normalizados) de ``gasto`` que afectan al resumen."""
+    return {campo: gasto.valor_normalizado(campo) for campo in CAMPOS_GASTO}
+
+
+def _valores_guardados(gasto):
+    """Valores con los que se leyó ``gasto``, si se cargaron todos."""
+    originales = getattr(gasto, '_valores_originales', {})
+    if all(campo in originales for campo in CAMPOS_GASTO):
+        return originales
+    return None
+
+
+def _incrementar(clave, total, numero):
+    """Suma ``total`` y ``numero`` a la fila ``clave``, creándola si no existe."""
+    filtro = dict(zip(CAMPOS_CLAVE, clave))
+    actualizadas = ResumenMensual.objects.filter(**filtro).update(
+        total=F('total') + total, numero=F('numero') + numero
+    )
+    if actualizadas:
+        return
+    try:
+        with transaction.atomic():
+            ResumenMensual.objects.create(**filtro, total=total, numero=numero)
+    except IntegrityError:
+        # Otro proceso creó la fila a la vez: basta con incrementarla
+        ResumenMensual.objects.filter(**filtro).update(
+            total=F('total') + total, numero=F('numero') + numero
+        )
+
+
+def registrar_gastos(gastos, signo=1):
+    """Suma (o resta, con ``signo=-1``) ``gastos`` en el resumen.
+
+    Los gastos se agrupan antes por clave, de modo que una inserción en
+    bloque cuesta un ``UPDATE`` por combinación distinta y no uno por gasto.
+    Para los gastos leídos de la base de datos se usan los valores
+    guardados, que son los que se sumaron en su momento.
+    """
+    acumulado = defaultdict(lambda: [Decimal('0'), 0])
+    for gasto in gastos:
+        valores = _valores_guardados(gasto) or _valores(gasto)
+        fila = acumulado[_clave(valores)]
+        fila[0] += valores['monto_total']
+        fila[1] += 1
+    for clave, (total, numero) in acumulado.items():
+        _incrementar(clave, signo * total, signo * numero)
+
+
+def registrar_cambio(gasto):
+    """Mueve un gasto editado de su fila anterior a la nueva, si ha cambiado."""
+    originales = _valores_guardados(gasto)
+    if originales is None:
+        return
+    nuevos = _valores(gasto)
+    if _clave(originales) == _clave(nuevos) and originales['monto_total'] == nuevos['monto_total']:
+        return
+    _incrementar(_clave(originales), -originales['monto_total'], -1)
+    _incrementar(_clave(nuevos), nuevos['monto_total'], 1)
+
+
+def _agregado_desde_gastos():
+    """Agregación de ``Gasto`` con la misma granularidad que el resumen."""
+    return (
+        Gasto.objects.order_by()
+        .annotate(ano=ExtractYear('fecha'), mes=ExtractMonth('fecha'))
+        .values(*CAMPOS_CLAVE)
+        .annotate(total=Sum('monto_total'), numero=Count('id'))
+    )
+
+
+def reconstruir():
+    """Vacía la tabla de resumen y la vuelve a generar desde ``Gasto``.
+
+    Devuelve el número de filas creadas.
+    """
+    with transaction.atomic():
+        ResumenMensual.objects.all().delete()
+        filas = [
+            ResumenMensual(
+                **{campo: fila[campo] for campo in CAMPOS_CLAVE},
+                # SQLite suma los decimales como coma flotante
+                total=fila['total'].quantize(Decimal('0.01')),
+                numero=fila['numero'],
+            )
+            for fila in _agregado_desde_gastos()
+        ]
+        ResumenMensual.objects.bulk_create(filas, batch_size=1000)
+        paneles.invalidar()
+    return len(filas)
+
+
+def verificar():
+    """Compara el resumen con los gastos y devuelve las diferencias.
+
+    Cada diferencia es una tupla ``(clave, (total, número) esperado,
+    (total, número) en el resumen)``. Una lista vacía indica que el
+    resumen es correcto.
+    """
+    esperado = {
+        tuple(fila[campo] for campo in CAMPOS_CLAVE): (fila['total'].quantize(Decimal('0.01')), fila['numero'])
+        for fila in _agregado_desde_gastos()
+    }
+    actual = {
+        tuple(fila[campo] for campo in CAMPOS_CLAVE): (fila['total'], fila['numero'])
+        for fila in ResumenMensual.objects.filter(numero__gt=0).values(*CAMPOS_CLAVE, 'total', 'numero')
+    }
+    return [
+        (clave, esperado.get(clave), actual.get(clave))
+        for clave in sorted(set(esperado) | set(actual), key=str)
+        if esperado.get(clave) != actual.get(clave)
+    ]
+
+
+def _posteriores(dia):
+    """Gastos del mes de ``dia`` con fecha posterior, como ``{categoria_id: (total, número)}``.
+
+    El resumen acumula meses enteros; para no contar los gastos ya
+    anotados con fecha futura se resta este resto, que es un rango pequeño
+    del índice por fecha.
+    """
+    siguiente = (dia.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    filas = (
+        Gasto.objects.filter(fecha__gt=dia, fecha__lt=siguiente)
+        .values('categoria_id')
+        .annotate(suma=Sum('monto_total'), numero=Count('id'))
+        .order_by()
+    )
+    return {fila['categoria_id']: (fila['suma'], fila['numero']) for fila in filas}
+
+
+def totales_por_categoria(ano, mes, dia=None):
+    """Total gastado en cada categoría en un mes, como ``{categoria_id: total}``.
+
+    Con ``dia`` (un día de ese mes) no se cuentan los gastos posteriores.
+    """
+    filas = (
+        ResumenMensual.objects.filter(ano=ano, mes=mes, numero__gt=0)
+        .values('categoria_id')
+        .annotate(suma=Sum('total'), cuenta=Sum('numero'))
+        .order_by('categoria_id')
+    )
+    posteriores = _posteriores(dia) if dia else {}
+    totales = {}
+    for fila in filas:
+        resta, numero = posteriores.get(fila['categoria_id'], (Decimal('0'), 0))
+        if fila['cuenta'] > numero:
+            totales[fila['categoria_id']] = (fila['suma'] - resta).quantize(Decimal('0.01'))
+    return totales
+
+
+def totales_por_mes(desde, hasta, dia=None):
+    """Total gastado en cada mes entre ``desde`` y ``hasta`` (tuplas año, mes).
+
+    Devuelve una lista ordenada de ``((año, mes), total)``; los meses sin
+    gastos no aparecen. Con ``dia`` (un día del mes ``hasta``) no se cuentan
+    los gastos posteriores de ese mes.
+    """
+    (ano_desde, mes_desde), (ano_hasta, mes_hasta) = desde, hasta
+    filas = (
+        ResumenMensual.objects.filter(numero__gt=0)
+        .annotate(periodo=F('ano') * 100 + F('mes'))
+        .filter(periodo__gte=ano_desde * 100 + mes_desde, periodo__lte=ano_hasta * 100 + mes_hasta)
+        .values('ano', 'mes')
+        .annotate(suma=Sum('total'), cuenta=Sum('numero'))
+        .order_by('ano', 'mes')
+    )
+    posteriores = _posteriores(dia).values() if dia else []
+    resta = sum((total for total, _ in posteriores), Decimal('0'))
+    numero = sum(numero for _, numero in posteriores)
+    totales = []
+    for fila in filas:
+        suma, cuenta = fila['suma'], fila['cuenta']
+        if (fila['ano'], fila['mes']) == hasta:
+            suma, cuenta = suma - resta, cuenta - numero
+        if cuenta > 0:
+            totales.append(((fila['ano'], fila['mes']), suma.quantize(Decimal('0.01'))))
+    return totales
@@ -0,0 +1,330 @@
+"""
+Sugerencias de descripción, categoría y fondo al registrar un gasto.
+
+Cada proceso guarda en memoria un índice de prefijos con las descripciones
+ya usadas, agrupadas por comercio (``Gasto.comercio_normalizado``, ver
+``core.comercios``). De cada una se conoce cuántas veces se ha usado, la
+fecha del último gasto y en qué categorías y fondos se ha registrado, de
+modo que al elegir una sugerencia se pueden rellenar también la categoría
+y el fondo más habituales.
+
+El índice es una lista ordenada de pares ``(texto, comercio)`` en la que
+se busca con ``bisect``: para cada comercio se guarda el texto completo y
+el que empieza en cada una de sus palabras, así que «compra» encuentra
+«Mercadona Compra». El texto se compara en minúsculas y sin tildes.
+
+Los usos de cada comercio por categoría y fondo se guardan también en la
+tabla ``UsoComercio``, que las señales de ``Gasto`` mantienen en la misma
+transacción y que es la fuente del índice de cada proceso. Cada cambio da una versión nueva al índice (ver
+``core.versiones``) y la apunta en las filas que toca, así que un proceso
+con una copia anterior solo lee las filas cambiadas desde su versión y
+las aplica a su índice, sin volver a recorrer los gastos.
+:func:`reconstruir` rehace la tabla desde ``Gasto`` (tras cambios hechos
+sin señales, como restaurar una copia) y obliga a los procesos a cargarla
+entera.
+"""
+
+import bisect
+import datetime
+import heapq
+import math
+import threading
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import metricas, versiones
+from .models import Gasto, UsoComercio, normalizar_comercio
+
+CLAVE_VERSION = 'sugerencias'
+# Cambia al reconstruir la tabla: los procesos deben cargarla entera
+CLAVE_RECONSTRUCCION = 'sugerencias:reconstruccion'
+SUGERENCIAS = 8
+# Los resultados de los prefijos de hasta tantas letras, que encuentran
+# muchos comercios, se recuerdan hasta el siguiente cambio del índice
+LONGITUD_RECORDADA = 2
+# La frecuencia de una descripción cuenta la mitad cada tantos días sin usarla
+VIDA_MEDIA_DIAS = 90
+
+
+def _texto(descripcion):
+    """Texto de búsqueda: minúsculas, sin tildes y con los espacios normalizados."""
+    sin_tildes = unicodedata.normalize('NFKD', descripcion).encode('ascii', 'ignore').decode()
+    return ' '.join(sin_tildes.lower().split())
+
+
+class _Comercio:
+    __slots__ = ('nombre', 'veces', 'ultima', 'categorias', 'fondos', 'peso')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.veces = 0
+        self.ultima = datetime.date.min
+        self.categorias = Counter()
+        self.fondos = Counter()
+        self.peso = 0.0
+
+    def actualizar_peso(self):
+        """``veces · 0,5^(días desde el último uso / VIDA_MEDIA_DIAS)`` en escala logarítmica.
+
+        El factor que depende de hoy es el mismo para todos los comercios,
+        así que el orden no cambia con los días y el peso puede guardarse.
+        """
+        self.peso = math.log2(max(self.veces, 1)) + self.ultima.toordinal() / VIDA_MEDIA_DIAS
+
+
+class IndicePrefijos:
+    """Descripciones usadas, buscables por el principio de cualquiera de sus palabras."""
+
+    def __init__(self):
+        self.comercios = {}
+        self.textos = []
+        self.recordados = {}
+        # Usos por (comercio, categoría, fondo), como en ``UsoComercio``
+        self.usos = {}
+
+    def fijar(self, nombre, categoria_id, fondo_id, veces, ultima):
+        """Pone en ``veces`` los usos de una combinación (una fila de ``UsoComercio``)."""
+        clave = (nombre, categoria_id, fondo_id)
+        diferencia = veces - self.usos.get(clave, 0)
+        if veces > 0:
+            self.usos[clave] = veces
+        else:
+            self.usos.pop(clave, None)
+        if diferencia < 0:
+            self.quitar(nombre, categoria_id, fondo_id, -diferencia)
+        elif diferencia > 0 or nombre in self.comercios:
+            self.anadir(nombre, categoria_id, fondo_id, ultima, diferencia)
+
+    def anadir(self, nombre, categoria_id, fondo_id, fecha, veces=1):
+        if not nombre:
+            return
+        self.recordados.clear()
+        comercio = self.comercios.get(nombre)
+        if comercio is None:
+            comercio = self.comercios[nombre] = _Comercio(nombre)
+            for texto in self._textos(nombre):
+                bisect.insort(self.textos, (texto, nombre))
+        comercio.veces += veces
+        comercio.ultima = max(comercio.ultima, fecha)
+        comercio.categorias[categoria_id] += veces
+        comercio.fondos[fondo_id] += veces
+        comercio.actualizar_peso()
+
+    def quitar(self, nombre, categoria_id, fondo_id, veces=1):
+        """Descuenta un uso; la fecha del último uso no se retrocede."""
+        comercio = self.comercios.get(nombre)
+        if comercio is None:
+            return
+        self.recordados.clear()
+        comercio.veces -= veces
+        comercio.categorias[categoria_id] -= veces
+        comercio.fondos[fondo_id] -= veces
+        comercio.actualizar_peso()
+        if comercio.veces <= 0:
+            del self.comercios[nombre]
+            for texto in self._textos(nombre):
+                posicion = bisect.bisect_left(self.textos, (texto, nombre))
+                if posicion < len(self.textos) and self.textos[posicion] == (texto, nombre):
+                    del self.textos[posicion]
+
+    @staticmethod
+    def _textos(nombre):
+        palabras = _texto(nombre).split(' ')
+        return {' '.join(palabras[inicio:]) for inicio in range(len(palabras))}
+
+    def buscar(self, prefijo, limite=SUGERENCIAS):
+        """Los ``limite`` comercios más usados y recientes que empiezan por ``prefijo``.
+
+        Se ordenan todos los textos con ese prefijo: los prefijos cortos
+        recorren buena parte del índice, pero su resultado se recuerda.
+        """
+        prefijo = _texto(prefijo)
+        if not prefijo:
+            return []
+        clave = (prefijo, limite)
+        if clave in self.recordados:
+            return self.recordados[clave]
+        inicio = bisect.bisect_left(self.textos, (prefijo,))
+        fin = bisect.bisect_left(self.textos, (prefijo + '\uffff',), inicio)
+        encontrados = {self.comercios[nombre] for _, nombre in self.textos[inicio:fin]}
+        resultado = heapq.nlargest(limite, encontrados, key=lambda comercio: comercio.peso)
+        if len(prefijo) <= LONGITUD_RECORDADA:
+            self.recordados[clave] = resultado
+        return resultado
+
+
+# (reconstrucción, versión, IndicePrefijos) de este proceso
+_indice = None
+_cerrojo = threading.Lock()
+# Versión del último cambio de este hilo aún sin confirmar
+_hilo = threading.local()
+
+
+def _cargar(indice, filas):
+    for nombre, categoria_id, fondo_id, veces, ultima in filas.values_list(
+        'comercio', 'categoria_id', 'fondo_id', 'veces', 'ultima'
+    ):
+        indice.fijar(nombre, categoria_id, fondo_id, veces, ultima)
+
+
+def indice():
+    """Índice de este proceso, al día con la tabla ``UsoComercio``.
+
+    Si la tabla se ha reconstruido (o la versión ha retrocedido) se carga
+    entera; si solo ha cambiado la versión, se leen las filas cambiadas
+    desde la copia. Dentro de una transacción con cambios propios sin
+    confirmar se usa un índice aparte, que no se guarda: si la transacción
+    se deshace, la copia del proceso no debe incluirlos.
+    """
+    global _indice
+    reconstruccion = versiones.leer(CLAVE_RECONSTRUCCION)
+    version = versiones.leer(CLAVE_VERSION)
+    if version == getattr(_hilo, 'pendiente', None):
+        metricas.registrar_cache('sugerencias', False)
+        propio = IndicePrefijos()
+        _cargar(propio, UsoComercio.objects.all())
+        return propio
+    local = _indice
+    acierto = local is not None and local[:2] == (reconstruccion, version)
+    metricas.registrar_cache('sugerencias', acierto)
+    if not acierto:
+        with _cerrojo:
+            local = _indice
+            if local is None or local[0] != reconstruccion or local[1] > version:
+                nuevo = IndicePrefijos()
+                _cargar(nuevo, UsoComercio.objects.all())
+                _indice = (reconstruccion, version, nuevo)
+            elif local[1] < version:
+                _cargar(local[2], UsoComercio.objects.filter(version__gt=local[1]))
+                _indice = (reconstruccion, version, local[2])
+    return _indice[2]
+
+
+def sugerir(prefijo, limite=SUGERENCIAS):
+    """Sugerencias para ``prefijo`` como diccionarios listos para JSON."""
+    return [
+        {
+            'descripcion': comercio.nombre,
+            'categoria': comercio.categorias.most_common(1)[0][0],
+            'fondo': comercio.fondos.most_common(1)[0][0],
+            'veces': comercio.veces,
+        }
+        for comercio in indice().buscar(prefijo, limite)
+    ]
+
+
+def _aplicar(acumulado, version):
+    """Suma a ``UsoComercio`` los usos de ``acumulado`` con una lectura y una escritura en bloque."""
+    existentes = UsoComercio.objects.filter(
+        comercio__in={comercio for comercio, _, _ in acumulado},
+        categoria_id__in={categoria_id for _, categoria_id, _ in acumulado},
+    )
+    cambiadas = []
+    for fila in existentes:
+        clave = (fila.comercio, fila.categoria_id, fila.fondo_id)
+        if clave in acumulado:
+            veces, ultima = acumulado.pop(clave)
+            fila.veces += veces
+            fila.ultima = max(fila.ultima, ultima or fila.ultima)
+            fila.version = version
+            cambiadas.append(fila)
+    UsoComercio.objects.bulk_update(cambiadas, ['veces', 'ultima', 'version'])
+    UsoComercio.objects.bulk_create([
+        UsoComercio(
+            comercio=comercio, categoria_id=categoria_id, fondo_id=fondo_id,
+            veces=veces, ultima=ultima, version=version,
+        )
+        for (comercio, categoria_id, fondo_id), (veces, ultima) in acumulado.items()
+        if veces > 0
+    ])
+
+
+def _registrar(anadidos=(), quitados=()):
+    """Aplica los cambios a ``UsoComercio`` con una versión nueva del índice.
+
+    Todo ocurre en la transacción en curso, así que los demás procesos ven
+    la versión nueva a la vez que los gastos y las filas (y, si se deshace,
+    nada cambia). La fila de la versión queda bloqueada hasta el final, de
+    modo que nadie más cambia la tabla entre la lectura de las filas y su
+    escritura. Los cambios se agrupan por comercio, categoría y fondo: una
+    inserción en bloque cuesta unas pocas consultas, no una por gasto.
+    """
+    acumulado = {}
+    for nombre, categoria_id, fondo_id, fecha in anadidos:
+        veces, ultima = acumulado.get((nombre, categoria_id, fondo_id), (0, fecha))
+        acumulado[nombre, categoria_id, fondo_id] = (veces + 1, max(ultima or fecha, fecha))
+    for nombre, categoria_id, fondo_id in quitados:
+        veces, ultima = acumulado.get((nombre, categoria_id, fondo_id), (0, None))
+        acumulado[nombre, categoria_id, fondo_id] = (veces - 1, ultima)
+    acumulado = {clave: cambio for clave, cambio in acumulado.items() if clave[0]}
+    if not acumulado:
+        return
+    with transaction.atomic():
+        version = versiones.cambiar(CLAVE_VERSION)
+        _aplicar(acumulado, version)
+        _hilo.pendiente = version
+        transaction.on_commit(lambda: setattr(_hilo, 'pendiente', None))
+
+
+def _valores(gasto):
+    return (gasto.comercio_normalizado, gasto.categoria_id, gasto.fondo_id)
+
+
+def registrar_gastos(gastos):
+    """Suma los gastos creados a los usos de sus comercios."""
+    anadidos = [(*_valores(gasto), gasto.valor_normalizado('fecha')) for gasto in gastos]
+    _registrar(anadidos=anadidos)
+
+
+def registrar_cambio(gasto):
+    """Mueve un gasto editado (si cambia su descripción, categoría o fondo)."""
+    originales = getattr(gasto, '_valores_originales', {})
+    if not all(campo in originales for campo in ('descripcion', 'categoria_id', 'fondo_id')):
+        return
+    anterior = (normalizar_comercio(originales['descripcion']), originales['categoria_id'], originales['fondo_id'])
+    if anterior != _valores(gasto):
+        nuevo = (*_valores(gasto), gasto.valor_normalizado('fecha'))
+        _registrar(anadidos=[nuevo], quitados=[anterior])
+
+
+def registrar_borrado(gasto):
+    """Descuenta un gasto borrado de los usos de su comercio."""
+    _registrar(quitados=[_valores(gasto)])
+
+
+def reconstruir():
+    """Rehace ``UsoComercio`` desde ``Gasto`` con una sola consulta agregada.
+
+    Devuelve el número de filas creadas. Los procesos cargan la tabla
+    entera la próxima vez que usen el índice.
+    """
+    with transaction.atomic():
+        versiones.cambiar(CLAVE_RECONSTRUCCION)
+        version = versiones.cambiar(CLAVE_VERSION)
+        UsoComercio.objects.all().delete()
+        filas = (
+            Gasto.objects.exclude(comercio_normalizado='').order_by()
+            .values_list('comercio_normalizado', 'categoria_id', 'fondo_id')
+            .annotate(veces=Count('id'), ultima=Max('fecha'))
+        )
+        creadas = UsoComercio.objects.bulk_create(
+            [
+                UsoComercio(
+                    comercio=comercio, categoria_id=categoria_id, fondo_id=fondo_id,
+                    veces=veces, ultima=ultima, version=version,
+                )
+                for comercio, categoria_id, fondo_id, veces, ultima in filas
+            ],
+            batch_size=1000,
+        )
+    return len(creadas)
+
+
+def olvidar_indice():
+    """Descarta el índice de este proceso (por ejemplo, al cambiar de base de datos)."""
+    global _indice
+    with _cerrojo:
+        _indice = None
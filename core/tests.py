@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import busqueda, categorias, clasificador, copias, fondos, metricas, paneles, perfilado, recurrentes, resumen, sugerencias, versiones
+from .balance import PORCENTAJE_ADRI, PORCENTAJE_SARA, calcular_deuda, calcular_deuda_actual
+from .comercios import historial_comercio, totales_por_comercio
+from .exportacion import filas as filas_exportacion, xlsx_en_flujo
+from .fechas import filtrar_periodo, rango_mes
+from .fondos import ajustar_saldo, ajustar_saldos, aportaciones_por_fondo, historial_saldos
+from .generacion import generar
+from .importacion import ErrorImportacion, _importe, importar, leer_csv, leer_norma43, leer_ofx
+from .middleware import forma_consulta
+from .models import (
+    Categoria,
+    ConteoPalabra,
+    FondoComun,
+    Gasto,
+    GastoRecurrente,
+    IngresoFondo,
+    Liquidacion,
+    MovimientoFondo,
+    ObjetivoAhorro,
+    ResumenMensual,
+    UsoComercio,
+    gastos_creados_en_bloque,
+)
+from .paginacion import TAMANO_PAGINA, paginar_keyset
+from .recurrentes import (
+    aplicar_pendientes,
+    asegurar_periodo_aplicado,
+    importe,
+    ocurrencias_pendientes,
+    olvidar_periodo_aplicado,
+)
+from .rendimiento import medir_vistas
+from .views import ORDENES_LISTA
+
+
+def _gasto(pagado_por, monto, fecha, fondo=None, descripcion='Mercadona', codigo='1'):
+    return Gasto.objects.create(
+        descripcion=descripcion, monto_total=Decimal(monto), fecha=fecha, pagado_por=pagado_por,
+        fondo=fondo, categoria=categorias.por_codigo(codigo),
+    )
+
+
+class CalcularDeudaTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.adri = User.objects.create(username='adri')
+        self.fondo = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('500.00'))
+        dia = datetime.date(2025, 3, 1)
+        _gasto(self.sara, '10.10', dia)
+        _gasto(self.sara, '33.33', dia)
+        _gasto(self.adri, '7.77', dia)
+        # Sale de la cuenta conjunta: no genera deuda
+        _gasto(self.adri, '100.00', dia, fondo=self.fondo)
+
+    def test_una_consulta_y_mismo_resultado_que_gasto_a_gasto(self):
+        esperado = Decimal('0')
+        for gasto in Gasto.objects.filter(fondo__isnull=True):
+            if gasto.pagado_por == self.sara:
+                esperado += gasto.monto_total * PORCENTAJE_ADRI
+            else:
+                esperado -= gasto.monto_total * PORCENTAJE_SARA
+        with self.assertNumQueries(1):
+            deuda = calcular_deuda(Gasto.objects.all(), self.sara, PORCENTAJE_SARA, PORCENTAJE_ADRI)
+        self.assertEqual(deuda, esperado)
+        self.assertEqual(
+            calcular_deuda(Gasto.objects.all(), self.adri, PORCENTAJE_ADRI, PORCENTAJE_SARA),
+            Decimal('7.77') * PORCENTAJE_SARA - Decimal('43.43') * PORCENTAJE_ADRI,
+        )
+
+    def test_sin_gastos_es_cero(self):
+        self.assertEqual(calcular_deuda(Gasto.objects.none(), self.sara, PORCENTAJE_SARA, PORCENTAJE_ADRI), 0)
+
+
+class LiquidacionesTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.adri = User.objects.create(username='adri')
+        self.antiguo = _gasto(self.sara, '40.00', datetime.date(2025, 1, 10))
+        _gasto(self.adri, '15.00', datetime.date(2025, 1, 20))
+        self.liquidacion = Liquidacion.objects.create(
+            fecha=datetime.date(2025, 1, 31), pagado_por=self.adri, cantidad=Decimal('5.00')
+        )
+        _gasto(self.adri, '12.00', datetime.date(2025, 2, 5))
+
+    def _deuda_completa(self):
+        """Balance de Sara agregando todo el historial y restando las transferencias de Adri."""
+        transferido = sum((l.cantidad for l in Liquidacion.objects.filter(pagado_por=self.adri)), Decimal('0'))
+        return calcular_deuda(Gasto.objects.all(), self.sara, PORCENTAJE_SARA, PORCENTAJE_ADRI) - transferido
+
+    def _deuda_actual(self):
+        return calcular_deuda_actual(self.sara, self.sara, PORCENTAJE_SARA, PORCENTAJE_ADRI)
+
+    def test_parte_de_la_ultima_liquidacion(self):
+        self.liquidacion.refresh_from_db()
+        self.assertEqual(
+            self.liquidacion.saldo, Decimal('40.00') * PORCENTAJE_ADRI - Decimal('15.00') * PORCENTAJE_SARA
+        )
+        with CaptureQueriesContext(connection) as consultas:
+            deuda = self._deuda_actual()
+        self.assertEqual(deuda, self._deuda_completa())
+        # Solo se agregan los gastos posteriores a la liquidación
+        agregacion = [c['sql'] for c in consultas.captured_queries if 'core_gasto' in c['sql']]
+        self.assertEqual(len(agregacion), 1)
+        self.assertIn('"fecha" >', agregacion[0])
+        self.assertEqual(
+            calcular_deuda_actual(self.adri, self.sara, PORCENTAJE_ADRI, PORCENTAJE_SARA), -deuda
+        )
+
+    def test_editar_o_mover_gastos_anteriores_recalcula(self):
+        self.antiguo.monto_total = Decimal('50.00')
+        self.antiguo.save()
+        self.assertEqual(self._deuda_actual(), self._deuda_completa())
+
+        # Un gasto posterior que pasa a antes de la liquidación también cuenta
+        posterior = Gasto.objects.get(monto_total=Decimal('12.00'))
+        posterior.fecha = datetime.date(2025, 1, 15)
+        posterior.save()
+        self.antiguo.delete()
+        self.assertEqual(self._deuda_actual(), self._deuda_completa())
+
+    def test_gastos_posteriores_no_tocan_las_liquidaciones(self):
+        with CaptureQueriesContext(connection) as consultas:
+            _gasto(self.sara, '8.00', datetime.date(2025, 3, 1))
+        self.assertFalse([c for c in consultas.captured_queries if c['sql'].startswith('UPDATE "core_liquidacion"')])
+        self.assertEqual(self._deuda_actual(), self._deuda_completa())
+
+
+class PaginacionKeysetTests(TestCase):
+    ORDEN = ['-fecha', '-id']
+
+    def setUp(self):
+        sara = User.objects.create(username='sara')
+        # Muchos gastos comparten fecha: el id desempata
+        for numero in range(23):
+            _gasto(sara, f'{numero}.00', datetime.date(2025, 5, 1 + numero % 4))
+        self.todos = list(Gasto.objects.order_by(*self.ORDEN))
+
+    def test_recorre_todas_las_paginas_en_ambos_sentidos(self):
+        vistos, pagina = [], paginar_keyset(Gasto.objects.all(), self.ORDEN, tamano=5)
+        self.assertFalse(pagina.has_previous)
+        paginas = [pagina]
+        while pagina.has_next:
+            vistos.extend(pagina)
+            pagina = paginar_keyset(Gasto.objects.all(), self.ORDEN, despues=pagina.cursor_siguiente, tamano=5)
+            paginas.append(pagina)
+        vistos.extend(pagina)
+        self.assertEqual(vistos, self.todos)
+        self.assertEqual([len(p) for p in paginas], [5, 5, 5, 5, 3])
+
+        # Hacia atrás desde la última se obtienen las mismas páginas
+        for anterior in reversed(paginas[:-1]):
+            pagina = paginar_keyset(Gasto.objects.all(), self.ORDEN, antes=pagina.cursor_anterior, tamano=5)
+            self.assertEqual(list(pagina), list(anterior))
+        self.assertFalse(pagina.has_previous)
+
+    def test_cursor_no_valido_da_la_primera_pagina(self):
+        for cursor in ('basura', '2025-13-01_4', '2025-05-01', '2025-05-01_x_3', ''):
+            pagina = paginar_keyset(Gasto.objects.all(), self.ORDEN, despues=cursor, tamano=5)
+            self.assertEqual(list(pagina), self.todos[:5], cursor)
+            self.assertFalse(pagina.has_previous, cursor)
+
+    def test_cursor_por_importe(self):
+        orden = ['monto_total', 'id']
+        pagina = paginar_keyset(Gasto.objects.all(), orden, despues='9.00_0', tamano=3)
+        self.assertEqual([g.monto_total for g in pagina], [Decimal('9.00'), Decimal('10.00'), Decimal('11.00')])
+
+
+class AplicarRecurrentesTests(TestCase):
+    def setUp(self):
+        User.objects.create(username='sara')
+        self.fondo = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('100.00'))
+        self.ahorro = FondoComun.objects.create(tipo='AHORRO', saldo=Decimal('0.00'))
+        self.hoy = datetime.date(2025, 6, 15)
+        GastoRecurrente.objects.create(
+            nombre='Internet', monto=Decimal('30.00'), categoria=categorias.por_codigo('3'),
+            fondo=self.fondo, fecha_inicio=datetime.date(2025, 6, 1),
+        )
+        ObjetivoAhorro.objects.create(
+            nombre='Sofá', monto_objetivo=Decimal('600.00'), aporte_mensual=Decimal('50.00'), fondo_destino=self.ahorro,
+        )
+        olvidar_periodo_aplicado()
+
+    def test_aplicar_dos_veces_no_duplica(self):
+        primera = aplicar_pendientes(self.hoy)
+        self.assertEqual((len(primera['gastos']), len(primera['ingresos'])), (1, 1))
+        segunda = aplicar_pendientes(self.hoy)
+        self.assertEqual((segunda['gastos'], segunda['ingresos']), ([], []))
+        self.assertEqual(Gasto.objects.filter(recurrente__isnull=False).count(), 1)
+        self.assertEqual(IngresoFondo.objects.filter(es_automatico=True).count(), 1)
+        self.fondo.refresh_from_db()
+        self.ahorro.refresh_from_db()
+        self.assertEqual((self.fondo.saldo, self.ahorro.saldo), (Decimal('70.00'), Decimal('50.00')))
+        self.assertEqual(primera['proxima'], datetime.date(2025, 7, 1))
+
+    def test_sin_consultas_hasta_la_proxima_ocurrencia(self):
+        asegurar_periodo_aplicado(self.hoy)
+        # Solo la de la versión; durante una petición se comparte con las demás
+        with self.assertNumQueries(1):
+            asegurar_periodo_aplicado(self.hoy + datetime.timedelta(days=10))
+        asegurar_periodo_aplicado(datetime.date(2025, 7, 1))
+        self.assertEqual(Gasto.objects.filter(recurrente__isnull=False).count(), 2)
+
+    def test_un_recurrente_nuevo_en_otro_proceso_se_aplica(self):
+        asegurar_periodo_aplicado(self.hoy)
+        proxima = recurrentes._proxima_ocurrencia
+        GastoRecurrente.objects.create(
+            nombre='Luz', monto=Decimal('45.00'), categoria=categorias.por_codigo('3'),
+            fondo=self.fondo, fecha_inicio=datetime.date(2025, 6, 1),
+        )
+        # Este proceso conserva su fecha y su caché; el otro cambió la versión
+        recurrentes._proxima_ocurrencia = proxima
+        with override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'otro-proceso'},
+        }):
+            asegurar_periodo_aplicado(self.hoy + datetime.timedelta(days=1))
+        self.assertTrue(Gasto.objects.filter(recurrente__nombre='Luz').exists())
+
+
+class OcurrenciasPendientesTests(TestCase):
+    def _recurrente(self, periodicidad, inicio, ultima=None, **campos):
+        return GastoRecurrente(
+            nombre='Prueba', monto=Decimal('120.00'), periodicidad=periodicidad,
+            fecha_inicio=inicio, ultima_fecha_aplicada=ultima, **campos,
+        )
+
+    def test_dia_31_en_meses_cortos_sin_desfase(self):
+        recurrente = self._recurrente('MENSUAL', datetime.date(2025, 1, 31))
+        fechas, siguiente = ocurrencias_pendientes(recurrente, datetime.date(2025, 5, 31))
+        self.assertEqual(fechas, [
+            datetime.date(2025, 1, 31), datetime.date(2025, 2, 28), datetime.date(2025, 3, 31),
+            datetime.date(2025, 4, 30), datetime.date(2025, 5, 31),
+        ])
+        self.assertEqual(siguiente, datetime.date(2025, 6, 30))
+        # Tras un febrero bisiesto se vuelve al día 31
+        recurrente.ultima_fecha_aplicada = datetime.date(2028, 2, 29)
+        self.assertEqual(
+            ocurrencias_pendientes(recurrente, datetime.date(2028, 3, 31))[0], [datetime.date(2028, 3, 31)]
+        )
+
+    def test_recupera_trimestres_pendientes(self):
+        recurrente = self._recurrente('TRIMESTRAL', datetime.date(2024, 11, 30), ultima=datetime.date(2025, 2, 28))
+        fechas, siguiente = ocurrencias_pendientes(recurrente, datetime.date(2025, 12, 1))
+        self.assertEqual(fechas, [datetime.date(2025, 5, 30), datetime.date(2025, 8, 30), datetime.date(2025, 11, 30)])
+        self.assertEqual(siguiente, datetime.date(2026, 2, 28))
+
+    def test_anual_prorrateado_se_carga_cada_mes(self):
+        recurrente = self._recurrente('ANUAL', datetime.date(2025, 1, 10), prorratear=True)
+        fechas, _ = ocurrencias_pendientes(recurrente, datetime.date(2025, 3, 31))
+        self.assertEqual(len(fechas), 3)
+        self.assertEqual(importe(recurrente), Decimal('10.00'))
+        completo = self._recurrente('ANUAL', datetime.date(2025, 1, 10))
+        self.assertEqual(ocurrencias_pendientes(completo, datetime.date(2025, 12, 31))[0], [datetime.date(2025, 1, 10)])
+        self.assertEqual(importe(completo), Decimal('120.00'))
+
+    def test_intervalo_personalizado(self):
+        recurrente = self._recurrente(
+            'PERSONALIZADA', datetime.date(2025, 1, 1), ultima=datetime.date(2025, 1, 11), intervalo_dias=10,
+        )
+        fechas, siguiente = ocurrencias_pendientes(recurrente, datetime.date(2025, 2, 5))
+        self.assertEqual(fechas, [datetime.date(2025, 1, 21), datetime.date(2025, 1, 31)])
+        self.assertEqual(siguiente, datetime.date(2025, 2, 10))
+
+    def test_semanas_pendientes_se_generan_de_una_vez(self):
+        User.objects.create(username='sara')
+        recurrente = self._recurrente('SEMANAL', datetime.date(2025, 3, 3), categoria=categorias.por_codigo('4'))
+        recurrente.save()
+        aplicar_pendientes(datetime.date(2025, 3, 31))
+        self.assertEqual(Gasto.objects.filter(recurrente=recurrente).count(), 5)
+        recurrente.refresh_from_db()
+        self.assertEqual(recurrente.ultima_fecha_aplicada, datetime.date(2025, 3, 31))
+
+
+class AportacionesPorFondoTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.adri = User.objects.create(username='adri')
+        self.gastos = FondoComun.objects.create(tipo='GASTOS')
+        self.viajes = FondoComun.objects.create(tipo='VIAJES')
+        self.compras = FondoComun.objects.create(tipo='COMPRAS')
+        for fondo, cantidad, usuario, automatico, fecha in [
+            (self.gastos, '100.00', self.sara, False, datetime.date(2025, 4, 1)),
+            (self.gastos, '60.00', self.adri, False, datetime.date(2025, 4, 30)),
+            (self.gastos, '25.00', None, True, datetime.date(2025, 4, 1)),
+            (self.gastos, '999.00', self.sara, False, datetime.date(2025, 5, 1)),
+            (self.viajes, '10.50', self.adri, False, datetime.date(2025, 4, 15)),
+        ]:
+            ingreso = IngresoFondo.objects.create(
+                fondo=fondo, cantidad=Decimal(cantidad), usuario=usuario, es_automatico=automatico
+            )
+            # ``fecha`` se rellena al crear (auto_now_add)
+            IngresoFondo.objects.filter(pk=ingreso.pk).update(fecha=fecha)
+
+    def test_una_consulta_agrupada_para_todos_los_fondos(self):
+        fondos = [self.gastos, self.viajes, self.compras]
+        with self.assertNumQueries(1):
+            aportaciones = aportaciones_por_fondo(fondos, datetime.date(2025, 4, 1), datetime.date(2025, 5, 1))
+        cero = Decimal('0.00')
+        self.assertEqual(aportaciones, {
+            # Los automáticos cuentan solo en el total
+            self.gastos.id: {'total': Decimal('185.00'), 'sara': Decimal('100.00'), 'adri': Decimal('60.00')},
+            self.viajes.id: {'total': Decimal('10.50'), 'sara': cero, 'adri': Decimal('10.50')},
+            self.compras.id: {'total': cero, 'sara': cero, 'adri': cero},
+        })
+
+    def test_sin_fin_incluye_todo_desde_el_inicio(self):
+        aportaciones = aportaciones_por_fondo([self.gastos], datetime.date(2025, 4, 2))
+        self.assertEqual(aportaciones[self.gastos.id]['total'], Decimal('1059.00'))
+
+
+class ResumenMensualTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.adri = User.objects.create(username='adri')
+        self.fondo = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('500.00'))
+
+    def test_altas_cambios_y_bajas_mantienen_el_resumen(self):
+        gasto = _gasto(self.sara, '20.00', datetime.date(2025, 3, 31))
+        _gasto(self.sara, '5.00', datetime.date(2025, 3, 2))
+        _gasto(self.adri, '7.00', datetime.date(2025, 4, 2), fondo=self.fondo)
+        self.assertEqual(resumen.verificar(), [])
+        self.assertEqual(resumen.totales_por_categoria(2025, 3), {categorias.por_codigo('1').id: Decimal('25.00')})
+
+        # Cambio de mes, de categoría y de importe a la vez
+        gasto.fecha = datetime.date(2025, 4, 1)
+        gasto.categoria = categorias.por_codigo('4')
+        gasto.monto_total = Decimal('21.00')
+        gasto.save()
+        self.assertEqual(resumen.verificar(), [])
+        self.assertEqual(resumen.totales_por_mes((2025, 1), (2025, 12)), [
+            ((2025, 3), Decimal('5.00')), ((2025, 4), Decimal('28.00')),
+        ])
+
+        Gasto.objects.get(monto_total=Decimal('5.00')).delete()
+        self.assertEqual(resumen.verificar(), [])
+        self.assertEqual(resumen.totales_por_mes((2025, 1), (2025, 12)), [((2025, 4), Decimal('28.00'))])
+
+    def test_alta_en_bloque_agrupa_por_clave(self):
+        lote = Gasto.objects.bulk_create([
+            Gasto(descripcion='Mercadona', monto_total=Decimal('1.10'), fecha=datetime.date(2025, 6, dia),
+                  pagado_por=self.sara, categoria=categorias.por_codigo('1'))
+            for dia in range(1, 21)
+        ])
+        with CaptureQueriesContext(connection) as consultas:
+            gastos_creados_en_bloque.send(sender=Gasto, gastos=lote)
+        resumenes = [c for c in consultas.captured_queries if 'core_resumenmensual' in c['sql']]
+        # Un UPDATE que no encuentra la fila y la creación
+        self.assertEqual(len(resumenes), 2)
+        self.assertEqual(resumen.verificar(), [])
+
+    def test_gastos_con_fecha_futura_del_mes_no_cuentan(self):
+        hoy = datetime.date(2025, 3, 15)
+        _gasto(self.sara, '20.00', datetime.date(2025, 3, 2))
+        _gasto(self.sara, '8.00', datetime.date(2025, 3, 20))
+        _gasto(self.adri, '40.00', datetime.date(2025, 3, 31), codigo='2')
+        _gasto(self.adri, '3.00', datetime.date(2025, 2, 27))
+        self.assertEqual(resumen.totales_por_categoria(2025, 3, hoy), {categorias.por_codigo('1').id: Decimal('20.00')})
+        self.assertEqual(resumen.totales_por_mes((2025, 1), (2025, 3), hoy), [
+            ((2025, 2), Decimal('3.00')), ((2025, 3), Decimal('20.00')),
+        ])
+        self.assertEqual(resumen.totales_por_mes((2025, 1), (2025, 3), datetime.date(2025, 3, 1)), [
+            ((2025, 2), Decimal('3.00')),
+        ])
+
+    def test_reconstruir_corrige_desvios(self):
+        _gasto(self.sara, '20.00', datetime.date(2025, 3, 31))
+        ResumenMensual.objects.update(total=Decimal('1.00'))
+        self.assertEqual(len(resumen.verificar()), 1)
+        self.assertEqual(resumen.reconstruir(), 1)
+        self.assertEqual(resumen.verificar(), [])
+
+
+class ComerciosTests(TestCase):
+    def setUp(self):
+        sara = User.objects.create(username='sara')
+        for descripcion, importe, fecha, codigo in [
+            ('MERCADONA', '10.00', datetime.date(2025, 3, 1), '1'),
+            ('  mercadona ', '5.50', datetime.date(2025, 3, 20), '1'),
+            ('Eroski', '30.00', datetime.date(2025, 3, 5), '1'),
+            ('Mercadona', '2.00', datetime.date(2025, 4, 1), '1'),
+            ('Mercadona', '99.00', datetime.date(2025, 3, 6), '4'),
+        ]:
+            _gasto(sara, importe, fecha, descripcion=descripcion, codigo=codigo)
+
+    def test_totales_por_comercio_normalizado(self):
+        # La agregación y, fuera de una petición, la versión de las categorías
+        with self.assertNumQueries(2):
+            totales = totales_por_comercio(datetime.date(2025, 3, 1), datetime.date(2025, 4, 1))
+        self.assertEqual(totales, [('Eroski', Decimal('30.00')), ('Mercadona', Decimal('15.50'))])
+        todos = totales_por_comercio(datetime.date(2025, 3, 1), datetime.date(2025, 4, 1), filtro=Q())
+        self.assertEqual(todos[0], ('Mercadona', Decimal('114.50')))
+
+    def test_historial_mensual_de_un_comercio(self):
+        self.assertEqual(historial_comercio('mercadona', datetime.date(2025, 1, 1), datetime.date(2026, 1, 1)), [
+            (datetime.date(2025, 3, 1), Decimal('114.50')), (datetime.date(2025, 4, 1), Decimal('2.00')),
+        ])
+
+
+class CategoriasTests(TestCase):
+    def test_resolver_por_id_o_nombre(self):
+        ocio = categorias.por_codigo('4')
+        self.assertEqual(categorias.resolver(str(ocio.id)), ocio)
+        self.assertEqual(categorias.resolver('  OCIO '), ocio)
+        self.assertIsNone(categorias.resolver('Farmacia'))
+        self.assertIsNone(categorias.resolver(''))
+
+    def test_cambios_de_otro_proceso(self):
+        self.assertIsNone(categorias.resolver('Farmacia'))
+        # Otro proceso crea la categoría: su señal cambia la versión en la
+        # base de datos, pero no toca la copia en memoria ni la caché de este
+        Categoria.objects.bulk_create([Categoria(nombre='Farmacia')])
+        versiones.cambiar(categorias.CLAVE_VERSION)
+        self.assertEqual(categorias.resolver('farmacia').nombre, 'Farmacia')
+
+    def test_una_consulta_de_versiones_por_peticion(self):
+        sara = User.objects.create(username='sara')
+        for numero in range(5):
+            _gasto(sara, f'{numero}.00', datetime.date(2025, 5, 1), codigo=str(numero + 1))
+        self.client.force_login(sara)
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get('/gastos/')
+        leidas = [c for c in consultas.captured_queries if 'core_versiondatos' in c['sql']]
+        self.assertEqual(len(leidas), 1)
+
+
+class MigracionCategoriasTests(TransactionTestCase):
+    """0018 y 0019 pasan la categoría de texto a clave foránea."""
+
+    anterior = [('core', '0017_gasto_comercio_normalizado')]
+    posterior = [('core', '0019_categoria_fk_final')]
+
+    def setUp(self):
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(self.anterior)
+        self.apps = ejecutor.loader.project_state(self.anterior).apps
+
+    def tearDown(self):
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(ejecutor.loader.graph.leaf_nodes())
+
+    def test_quita_duplicados_y_traduce_los_textos(self):
+        CategoriaAntigua = self.apps.get_model('core', 'Categoria')
+        GastoAntiguo = self.apps.get_model('core', 'Gasto')
+        CategoriaAntigua.objects.bulk_create(
+            [CategoriaAntigua(nombre='Ocio'), CategoriaAntigua(nombre=' ocio'), CategoriaAntigua(nombre='Viajes')]
+        )
+        sara = self.apps.get_model('auth', 'User').objects.create(username='sara')
+        for texto in ('1', 'supermercado', 'OCIO', '', 'Farmacia', 'Farmacia'):
+            GastoAntiguo.objects.create(
+                descripcion='Gasto', monto_total=Decimal('1.00'), fecha=datetime.date(2025, 1, 1),
+                categoria=texto, pagado_por=sara,
+            )
+
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(self.posterior)
+        apps = ejecutor.loader.project_state(self.posterior).apps
+        CategoriaNueva = apps.get_model('core', 'Categoria')
+
+        nombres = sorted(CategoriaNueva.objects.values_list('nombre', flat=True))
+        self.assertEqual(nombres, sorted(['Ocio', 'Viajes', 'Supermercado', 'Gastos piso', 'Otros', 'Compras piso', 'Farmacia']))
+        self.assertEqual(CategoriaNueva.objects.get(nombre='Ocio').codigo, '4')
+        asignadas = sorted(apps.get_model('core', 'Gasto').objects.values_list('categoria__nombre', flat=True))
+        self.assertEqual(asignadas, ['Farmacia', 'Farmacia', 'Ocio', 'Otros', 'Supermercado', 'Supermercado'])
+        self.assertEqual(apps.get_model('core', 'ResumenMensual').objects.get(categoria__nombre='Farmacia').numero, 2)
+
+
+class FiltrarPeriodoTests(TestCase):
+    def setUp(self):
+        sara = User.objects.create(username='sara')
+        for fecha in (
+            datetime.date(2024, 3, 31), datetime.date(2025, 2, 28), datetime.date(2025, 3, 1),
+            datetime.date(2025, 3, 31), datetime.date(2025, 4, 1), datetime.date(2026, 3, 15),
+        ):
+            _gasto(sara, '1.00', fecha)
+
+    def _fechas(self, ano=None, mes=None):
+        return sorted(filtrar_periodo(Gasto.objects.all(), ano, mes).values_list('fecha', flat=True))
+
+    def test_intervalos_semiabiertos(self):
+        self.assertEqual(self._fechas('2025', '3'), [datetime.date(2025, 3, 1), datetime.date(2025, 3, 31)])
+        self.assertEqual(len(self._fechas('2025')), 4)
+        self.assertEqual(self._fechas(mes='3'), [
+            datetime.date(2024, 3, 31), datetime.date(2025, 3, 1), datetime.date(2025, 3, 31), datetime.date(2026, 3, 15),
+        ])
+        self.assertEqual(rango_mes(2025, 12), (datetime.date(2025, 12, 1), datetime.date(2026, 1, 1)))
+
+    def test_valores_no_validos_se_ignoran(self):
+        self.assertEqual(len(self._fechas('abc', '13')), 6)
+        self.assertEqual(len(self._fechas('', '')), 6)
+
+    def test_sin_extraer_partes_de_la_fecha(self):
+        consulta = str(filtrar_periodo(Gasto.objects.all(), '2025', '3').query)
+        self.assertNotIn('django_date_extract', consulta)
+        self.assertIn('"core_gasto"."fecha" >= 2025-03-01', consulta)
+
+
+class AjustarSaldosTests(TestCase):
+    def setUp(self):
+        self.gastos = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('100.00'))
+        self.viajes = FondoComun.objects.create(tipo='VIAJES', saldo=Decimal('50.00'))
+
+    def test_instancias_obsoletas_no_pierden_movimientos(self):
+        # Dos «procesos» leen el fondo antes de que ninguno escriba: con
+        # lectura-modificación-escritura el segundo pisaría al primero
+        leido_1 = FondoComun.objects.get(pk=self.gastos.pk)
+        leido_2 = FondoComun.objects.get(pk=self.gastos.pk)
+        ajustar_saldo(leido_1.pk, Decimal('-30.00'))
+        ajustar_saldo(leido_2.pk, Decimal('-20.00'))
+        self.gastos.refresh_from_db()
+        self.assertEqual(self.gastos.saldo, Decimal('50.00'))
+
+    def test_movimientos_en_bloque_se_agrupan_por_fondo(self):
+        with CaptureQueriesContext(connection) as consultas:
+            ajustar_saldos([
+                (self.gastos.pk, Decimal('-10.00')),
+                (self.viajes.pk, Decimal('5.50')),
+                (self.gastos.pk, Decimal('-2.25')),
+                (None, Decimal('99.00')),  # gasto sin fondo: se ignora
+            ])
+        actualizaciones = [c for c in consultas.captured_queries if c['sql'].startswith('UPDATE "core_fondocomun"')]
+        self.assertEqual(len(actualizaciones), 2)
+        self.gastos.refresh_from_db()
+        self.viajes.refresh_from_db()
+        self.assertEqual(self.gastos.saldo, Decimal('87.75'))
+        self.assertEqual(self.viajes.saldo, Decimal('55.50'))
+
+    def test_ingreso_suma_al_fondo(self):
+        IngresoFondo.objects.create(fondo=self.viajes, cantidad=Decimal('12.34'))
+        self.viajes.refresh_from_db()
+        self.assertEqual(self.viajes.saldo, Decimal('62.34'))
+
+
+def _reintentar_si_bloqueada(funcion):
+    """Ejecuta ``funcion`` en una transacción, repitiéndola si SQLite está bloqueada.
+
+    La base de datos de pruebas de SQLite (en memoria, con caché compartida)
+    no espera a que se libere el bloqueo de otro escritor sino que falla al
+    momento; la transacción se deshace entera y basta con repetirla.
+    PostgreSQL espera al bloqueo de la fila y nunca llega a reintentar.
+    """
+    while True:
+        try:
+            with transaction.atomic():
+                return funcion()
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            time.sleep(0.001)
+
+
+class AjustarSaldosConcurrenteTests(TransactionTestCase):
+    """Varios hilos, cada uno con su conexión, mueven el saldo del mismo fondo a la vez."""
+
+    HILOS = 8
+    MOVIMIENTOS = 25
+
+    def test_escritores_concurrentes_sin_desvio(self):
+        fondo = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('0.00'))
+        viajes = FondoComun.objects.create(tipo='VIAJES', saldo=Decimal('0.00'))
+        usuario = User.objects.create(username='sara')
+        salida = threading.Barrier(self.HILOS)
+        errores = []
+
+        def escritor(indice):
+            try:
+                salida.wait()
+                for _ in range(self.MOVIMIENTOS):
+                    if indice % 2:
+                        # Gasto y aportación al mismo tiempo, en bloque
+                        _reintentar_si_bloqueada(
+                            lambda: ajustar_saldos({fondo.pk: Decimal('-1.10'), viajes.pk: Decimal('0.10')})
+                        )
+                    else:
+                        # Ingreso: pasa por la señal de ``IngresoFondo``
+                        _reintentar_si_bloqueada(
+                            lambda: IngresoFondo.objects.create(fondo=fondo, cantidad=Decimal('2.35'), usuario=usuario)
+                        )
+            except Exception as error:  # pragma: no cover - se comprueba abajo
+                errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        mitad = self.HILOS // 2
+        fondo.refresh_from_db()
+        viajes.refresh_from_db()
+        self.assertEqual(fondo.saldo, mitad * self.MOVIMIENTOS * (Decimal('2.35') - Decimal('1.10')))
+        self.assertEqual(viajes.saldo, mitad * self.MOVIMIENTOS * Decimal('0.10'))
+        self.assertEqual(IngresoFondo.objects.count(), mitad * self.MOVIMIENTOS)
+
+
+class MovimientosFondoTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.fondo = FondoComun.objects.create(tipo='GASTOS')
+        IngresoFondo.objects.create(fondo=self.fondo, cantidad=Decimal('100.00'))
+        IngresoFondo.objects.update(fecha=datetime.date(2025, 1, 1))
+        MovimientoFondo.objects.update(fecha=datetime.date(2025, 1, 1))
+        self.gasto = _gasto(self.sara, '30.00', datetime.date(2025, 1, 20), fondo=self.fondo, codigo='3')
+        _gasto(self.sara, '20.00', datetime.date(2025, 2, 10), fondo=self.fondo, codigo='3')
+
+    def test_saldo_en_con_y_sin_cierres(self):
+        esperados = {
+            datetime.date(2024, 12, 31): Decimal('0.00'),
+            datetime.date(2025, 1, 19): Decimal('100.00'),
+            datetime.date(2025, 1, 31): Decimal('70.00'),
+            datetime.date(2025, 2, 15): Decimal('50.00'),
+        }
+        for fecha, saldo in esperados.items():
+            self.assertEqual(fondos.saldo_en(self.fondo.pk, fecha), saldo)
+        self.assertGreater(fondos.cerrar_meses(datetime.date(2025, 2, 28)), 0)
+        for fecha, saldo in esperados.items():
+            self.assertEqual(fondos.saldo_en(self.fondo.pk, fecha), saldo)
+        self.assertEqual(fondos.conciliar(), [])
+
+    def test_editar_un_gasto_compensa_y_corrige_los_cierres(self):
+        fondos.cerrar_meses(datetime.date(2025, 2, 28))
+        self.gasto.monto_total = Decimal('40.00')
+        self.gasto.fecha = datetime.date(2025, 2, 1)
+        self.gasto.save()
+        self.assertEqual(self.gasto.movimientos.count(), 3)
+        self.assertEqual(fondos.saldo_en(self.fondo.pk, datetime.date(2025, 1, 31)), Decimal('100.00'))
+        self.assertEqual(fondos.saldo_en(self.fondo.pk, datetime.date(2025, 2, 28)), Decimal('40.00'))
+        self.assertEqual(fondos.conciliar(), [])
+
+
+class HistorialSaldosTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.fondo = FondoComun.objects.create(tipo='VIAJES')
+        MovimientoFondo.objects.bulk_create([
+            MovimientoFondo(fondo=self.fondo, fecha=fecha, importe=Decimal(importe), tipo='AJUSTE')
+            for fecha, importe in [
+                (datetime.date(2024, 12, 15), '50.00'),
+                (datetime.date(2025, 1, 6), '10.00'),
+                (datetime.date(2025, 1, 8), '-5.50'),
+                (datetime.date(2025, 1, 20), '20.00'),
+                (datetime.date(2025, 3, 1), '1.00'),
+            ]
+        ])
+
+    def test_saldo_acumulado_parte_de_los_movimientos_anteriores(self):
+        filas = list(historial_saldos(datetime.date(2025, 1, 1), datetime.date(2025, 3, 1), 'semana'))
+        self.assertEqual(
+            [(fila['periodo'], Decimal(fila['saldo']).quantize(Decimal('0.01'))) for fila in filas],
+            [
+                (datetime.date(2024, 12, 30), Decimal('50.00')),
+                (datetime.date(2025, 1, 6), Decimal('54.50')),
+                (datetime.date(2025, 1, 20), Decimal('74.50')),
+            ],
+        )
+        for fila in filas:
+            fin = fila['periodo'] + datetime.timedelta(days=6)
+            self.assertEqual(fondos.saldo_en(self.fondo.pk, fin), Decimal(fila['saldo']).quantize(Decimal('0.01')))
+
+    def test_vista_json(self):
+        self.client.force_login(self.sara)
+        datos = self.client.get('/fondos/historial/?desde=2025-01-01&hasta=2025-04-01&granularidad=mes').json()
+        self.assertEqual(datos['fondos'][0]['puntos'], [['2025-01-01', 74.5], ['2025-03-01', 75.5]])
+        self.assertEqual(self.client.get('/fondos/historial/?desde=2025-02-01&hasta=2025-01-01').status_code, 400)
+        self.assertEqual(self.client.get('/fondos/historial/?granularidad=hora').status_code, 400)
+        self.assertEqual(self.client.get('/fondos/historial/?desde=ayer').status_code, 400)
+
+
+class MigracionMovimientosTests(TransactionTestCase):
+    """0021 registra el histórico de cada fondo con su saldo inicial."""
+
+    anterior = [('core', '0020_indices_consultas')]
+
+    def setUp(self):
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(self.anterior)
+        apps = ejecutor.loader.project_state(self.anterior).apps
+        # Saldo guardado de 100 y un único gasto de 10: la apertura es de 110
+        fondo = apps.get_model('core', 'FondoComun').objects.create(tipo='GASTOS', saldo=Decimal('100.00'))
+        apps.get_model('core', 'Gasto').objects.create(
+            descripcion='Gasto', monto_total=Decimal('10.00'), fecha=datetime.date(2025, 1, 10),
+            pagado_por=apps.get_model('auth', 'User').objects.create(username='sara'),
+            categoria=apps.get_model('core', 'Categoria').objects.create(nombre='Pruebas'),
+            fondo_id=fondo.pk,
+        )
+        self.fondo_id = fondo.pk
+
+    def tearDown(self):
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(ejecutor.loader.graph.leaf_nodes())
+
+    def _migrar(self, destino):
+        ejecutor = MigrationExecutor(connection)
+        ejecutor.migrate(destino)
+        return ejecutor.loader.project_state(destino).apps
+
+    def test_apertura_en_el_primer_movimiento(self):
+        apps = self._migrar([('core', '0021_movimientos_fondo')])
+        apertura = apps.get_model('core', 'MovimientoFondo').objects.get(tipo='APERTURA')
+        self.assertEqual((apertura.fecha, apertura.importe), (datetime.date(2025, 1, 10), Decimal('110.00')))
+
+
+def _registro_norma43(fecha, importe, debe, referencia=''):
+    """Registro ``22`` de Norma 43 con los campos que se leen."""
+    return (
+        f'22    0000{fecha:%y%m%d}{fecha:%y%m%d}00000{"1" if debe else "2"}{round(importe * 100):014d}'
+        f'0000000000{"":12}{referencia:16}\n'
+    )
+
+
+class LectoresExtractoTests(TestCase):
+    def test_importes_con_cualquier_separador_decimal(self):
+        for texto, esperado in [
+            ('-1.234,56', '-1234.56'), ('-1,234.56', '-1234.56'), ('-1234.56', '-1234.56'),
+            ('1.234,56 €', '1234.56'), ('-12,5', '-12.5'), ('1.234.567', '1234567'), ('-0,99', '-0.99'),
+        ]:
+            self.assertEqual(_importe(texto), Decimal(esperado), texto)
+
+    def test_importes_ambiguos_o_mal_agrupados(self):
+        for texto in ('1,234', '-1.234', '12.34.56', '1,234.5.6'):
+            with self.assertRaises(ValueError, msg=texto):
+                _importe(texto)
+
+    def test_csv(self):
+        movimientos = list(leer_csv([
+            'Fecha;Concepto;Importe;Categoría\n',
+            '01/03/2025;MERCADONA;-12,30;Supermercado\n',
+            ';;;\n',
+            '2025-03-02;Nómina;1.500,00;\n',
+        ]))
+        self.assertEqual(
+            [(m.linea, m.fecha, m.descripcion, m.importe, m.categoria) for m in movimientos],
+            [
+                (2, datetime.date(2025, 3, 1), 'MERCADONA', Decimal('-12.30'), 'Supermercado'),
+                (4, datetime.date(2025, 3, 2), 'Nómina', Decimal('1500.00'), ''),
+            ],
+        )
+
+    def test_separador_decimal_del_fichero(self):
+        for importes, esperados in [
+            (['-1.234', '-12,50', '-1.234'], ['-1234', '-12.50', '-1234']),
+            (['-1.234', '"-1,500"', '-5.00'], ['-1.234', '-1500', '-5.00']),
+            (['-1.234', '-7'], ['-1234', '-7']),
+        ]:
+            lineas = ['fecha;concepto;importe\n'] + [f'2025-03-01;A;{importe}\n' for importe in importes]
+            self.assertEqual([m.importe for m in leer_csv(lineas)], [Decimal(e) for e in esperados], importes)
+
+    def test_csv_con_errores_indica_la_linea(self):
+        with self.assertRaisesMessage(ErrorImportacion, 'Línea 3: importe no válido'):
+            list(leer_csv(['fecha,concepto,importe\n', '2025-03-01,A,-1.50\n', '2025-03-01,B,"-1,50"\n']))
+        with self.assertRaisesMessage(ErrorImportacion, 'faltan las columnas importe'):
+            list(leer_csv(['fecha;concepto\n']))
+
+    def test_norma43(self):
+        lineas = [
+            '11' + '0' * 78 + '\n',
+            _registro_norma43(datetime.date(2025, 3, 4), Decimal('45.10'), True, 'REF1'),
+            '2301' + 'RECIBO LUZ'.ljust(38) + 'MARZO'.ljust(38) + '\n',
+            _registro_norma43(datetime.date(2025, 3, 5), Decimal('1000.00'), False, 'TRANSFERENCIA'),
+            '33' + '0' * 78 + '\n',
+        ]
+        movimientos = list(leer_norma43(lineas))
+        self.assertEqual(
+            [(m.fecha, m.descripcion, m.importe) for m in movimientos],
+            [
+                (datetime.date(2025, 3, 4), 'RECIBO LUZ MARZO', Decimal('-45.10')),
+                (datetime.date(2025, 3, 5), 'TRANSFERENCIA', Decimal('1000.00')),
+            ],
+        )
+
+    def test_ofx_sgml_y_xml(self):
+        sgml = [
+            'OFXHEADER:100\n', '<OFX><BANKTRANLIST>\n',
+            '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250306120000<TRNAMT>-7.25<NAME>CAFETERIA\n',
+            '</STMTTRN><STMTTRN><DTPOSTED>20250307<TRNAMT>20.00<MEMO>Bizum\n',
+            '</STMTTRN></BANKTRANLIST></OFX>\n',
+        ]
+        xml = [
+            '<OFX><STMTTRN><DTPOSTED>20250306</DTPOSTED><TRNAMT>-7.25</TRNAMT>',
+            '<NAME>CAFETERIA</NAME></STMTTRN><STMTTRN><DTPOSTED>20250307</DTPOSTED>',
+            '<TRNAMT>20.00</TRNAMT><MEMO>Bizum</MEMO></STMTTRN></OFX>',
+        ]
+        for lineas in (sgml, xml):
+            self.assertEqual(
+                [(m.fecha, m.descripcion, m.importe) for m in leer_ofx(lineas)],
+                [
+                    (datetime.date(2025, 3, 6), 'CAFETERIA', Decimal('-7.25')),
+                    (datetime.date(2025, 3, 7), 'Bizum', Decimal('20.00')),
+                ],
+            )
+        with self.assertRaises(ErrorImportacion):
+            list(leer_ofx(['<OFX><STMTTRN><NAME>Sin fecha</STMTTRN></OFX>']))
+
+
+class ImportarExtractoTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.fondo = FondoComun.objects.create(tipo='GASTOS', saldo=Decimal('100.00'))
+
+    def test_crea_los_cargos_en_lotes_y_ajusta_el_fondo_una_vez(self):
+        lineas = ['fecha;concepto;importe\n'] + [
+            f'2025-03-{dia:02d};Compra {dia};-{dia},00\n' for dia in range(1, 6)
+        ] + ['2025-03-06;Devolución;3,00\n']
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = importar(
+                lineas, 'csv', self.sara, categoria=categorias.por_codigo('3'), fondo=self.fondo, tamano_lote=2,
+            )
+        self.assertEqual((resultado.creados, resultado.ignorados), (5, 1))
+        self.assertEqual(resultado.por_fondo, {self.fondo.pk: Decimal('15.00')})
+        actualizaciones = [c for c in consultas.captured_queries if c['sql'].startswith('UPDATE "core_fondocomun"')]
+        self.assertEqual(len(actualizaciones), 1)
+        # Tres lotes, pero el resumen se actualiza una sola vez: un UPDATE que
+        # no encuentra la fila y su creación
+        resumenes = [c for c in consultas.captured_queries if 'core_resumenmensual' in c['sql']]
+        self.assertEqual(len(resumenes), 2)
+        self.fondo.refresh_from_db()
+        self.assertEqual(self.fondo.saldo, Decimal('85.00'))
+        self.assertEqual(MovimientoFondo.objects.filter(fondo=self.fondo, tipo='GASTO').count(), 5)
+        self.assertEqual(ResumenMensual.objects.get().total, Decimal('15.00'))
+
+    def test_un_error_cancela_toda_la_importacion(self):
+        lineas = ['fecha;concepto;importe;categoria\n', '2025-03-01;A;-1,00;\n', '2025-03-02;B;-2,00;Astronomía\n']
+        with self.assertRaisesMessage(ErrorImportacion, 'Línea 3: categoría desconocida'):
+            importar(lineas, 'csv', self.sara, fondo=self.fondo, tamano_lote=1)
+        self.assertFalse(Gasto.objects.exists())
+        self.fondo.refresh_from_db()
+        self.assertEqual(self.fondo.saldo, Decimal('100.00'))
+
+
+class ExportacionTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        fondo = FondoComun.objects.create(tipo='GASTOS')
+        _gasto(self.sara, '10.00', datetime.date(2025, 3, 1), fondo=fondo, descripcion='Luz "marzo"', codigo='3')
+        _gasto(self.sara, '4.50', datetime.date(2025, 3, 2), descripcion='Cine <3', codigo='4')
+        _gasto(self.sara, '99.00', datetime.date(2025, 4, 1), descripcion='Abril')
+        self.client.force_login(self.sara)
+
+    def test_csv_filtrado(self):
+        respuesta = self.client.get('/gastos/exportar/?year=2025&month=3')
+        self.assertTrue(respuesta.streaming)
+        self.assertIn('attachment; filename="gastos-', respuesta['Content-Disposition'])
+        texto = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertTrue(texto.startswith('\ufeffFecha,Descripción,'))
+        self.assertEqual(list(csv.reader(texto.splitlines()))[1:], [
+            ['2025-03-01', 'Luz "marzo"', 'Gastos piso', 'Gastos del piso', 'sara', '10.00', '6.30', '3.70'],
+            ['2025-03-02', 'Cine <3', 'Ocio', '', 'sara', '4.50', '2.84', '1.66'],
+        ])
+
+    def test_xlsx_por_bloques(self):
+        bloques = list(xlsx_en_flujo(filas_exportacion(Gasto.objects.all()), filas_por_bloque=1))
+        self.assertGreater(len(bloques), 3)
+        with zipfile.ZipFile(io.BytesIO(b''.join(bloques))) as libro:
+            self.assertIsNone(libro.testzip())
+            hoja = libro.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(hoja.count('<row>'), 4)
+        # Fechas como número de serie de Excel y textos escapados
+        self.assertIn(f'<v>{(datetime.date(2025, 3, 1) - datetime.date(1899, 12, 30)).days}</v>', hoja)
+        self.assertIn('Cine &lt;3', hoja)
+
+    def test_xlsx_desde_la_vista_con_filtros(self):
+        respuesta = self.client.get('/gastos/exportar/?formato=xlsx&cat=Ocio')
+        self.assertEqual(respuesta['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        with zipfile.ZipFile(io.BytesIO(b''.join(respuesta.streaming_content))) as libro:
+            self.assertEqual(libro.read('xl/worksheets/sheet1.xml').decode().count('<row>'), 2)
+
+
+class ListaGastosTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        # Importes y fechas repetidos: el id desempata en todos los órdenes
+        for numero in range(2 * TAMANO_PAGINA + 3):
+            _gasto(
+                self.sara, f'{numero % 4}.50', datetime.date(2025, 5, 1 + numero % 3),
+                codigo='1' if numero % 5 else '4',
+            )
+        self.client.force_login(self.sara)
+
+    def _recorrer(self, consulta):
+        """Gastos de todas las páginas siguiendo los enlaces «Siguiente»."""
+        vistos = []
+        respuesta = self.client.get(f'/gastos/?{consulta}')
+        while True:
+            vistos.extend((g['monto_total'], g['fecha']) for g in respuesta.context['gastos'])
+            pagina = respuesta.context['pagina']
+            if not pagina.has_next:
+                return vistos, respuesta
+            respuesta = self.client.get(f'/gastos/?{consulta}&despues={pagina.cursor_siguiente}')
+
+    def test_todos_los_ordenes_recorren_cada_gasto_una_vez(self):
+        for orden, campos in ORDENES_LISTA.items():
+            vistos, _ = self._recorrer(f'order={orden}')
+            esperados = list(Gasto.objects.order_by(*campos).values_list('monto_total', 'fecha'))
+            self.assertEqual(vistos, esperados, orden)
+
+    def test_filtros_y_numero_de_resultados(self):
+        vistos, respuesta = self._recorrer('order=importe_desc&cat=Ocio')
+        ocio = Gasto.objects.filter(categoria=categorias.por_codigo('4'))
+        self.assertEqual(len(vistos), ocio.count())
+        self.assertEqual((respuesta.context['numero'], respuesta.context['numero_exacto']), (ocio.count(), True))
+        self.assertIn('cat=Ocio', respuesta.context['filtros_query'])
+
+    def test_cursores_manipulados_dan_la_primera_pagina(self):
+        primera = list(self.client.get('/gastos/?order=importe_asc').context['gastos'])
+        for cursor in ('x', '1.50', '1.50_', 'NaN_3', '1e999_2', '2025-05-01_1'):
+            respuesta = self.client.get(f'/gastos/?order=importe_asc&despues={cursor}')
+            self.assertEqual(respuesta.status_code, 200, cursor)
+            self.assertEqual(list(respuesta.context['gastos']), primera, cursor)
+
+
+class BusquedaTests(TestCase):
+    DESCRIPCIONES = [
+        'Mercadona Centro', 'MERCADONA', 'Factura luz marzo', 'Luz y agua', 'Cena pizzeria', 'Pizza',
+        'Gasolinera Repsol', 'Cuota 4/12', 'Recibo 2024',
+    ]
+
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        self.adri = User.objects.create(username='adrian')
+        for dia, descripcion in enumerate(self.DESCRIPCIONES, start=1):
+            _gasto(self.sara, '1.00', datetime.date(2025, 3, dia), descripcion=descripcion)
+
+    def _ids(self, texto, motor):
+        return set(Gasto.objects.filter(motor.filtro(texto)).values_list('id', flat=True))
+
+    def test_mismos_resultados_que_sin_indice(self):
+        if not isinstance(busqueda.motor(), busqueda.MotorFTS5):
+            self.skipTest('SQLite sin FTS5')
+        # Palabras, trozos de palabra, cifras y textos cortos: ambos motores coinciden
+        for texto in (
+            'merca', 'MERCADONA centro', 'luz', 'pizz', 'adri', 'Factura luz', 'dona', 'olinera',
+            '4', '20', '024', 'a y', 'zz', 'z marzo', '"luz"', 'ñ',
+        ):
+            self.assertEqual(
+                self._ids(texto, busqueda.motor()), self._ids(texto, busqueda.MotorBasico()), texto,
+            )
+        gastos = Gasto.objects.all()
+        for texto in ('luz', 'pizz', 'dona', '4'):
+            self.assertEqual(
+                set(busqueda.mas_relevantes(gastos, texto)),
+                {gasto_id for gasto_id, _ in busqueda.MotorBasico().candidatos(gastos, texto, 100)},
+            )
+
+    def test_el_indice_sigue_a_los_gastos(self):
+        luz = Gasto.objects.get(descripcion='Luz y agua')
+        luz.descripcion = 'Gas natural'
+        luz.save()
+        Gasto.objects.get(descripcion='Pizza').delete()
+        nuevos = Gasto.objects.bulk_create([
+            Gasto(descripcion='Pizza familiar', monto_total=Decimal('9.00'), fecha=datetime.date(2025, 3, 9),
+                  pagado_por=self.sara, categoria=categorias.por_codigo('4')),
+        ])
+        gastos_creados_en_bloque.send(sender=Gasto, gastos=nuevos)
+
+        def descripciones(texto):
+            return sorted(Gasto.objects.filter(busqueda.filtro(texto)).values_list('descripcion', flat=True))
+
+        self.assertEqual(descripciones('luz'), ['Factura luz marzo'])
+        self.assertEqual(descripciones('natural'), ['Gas natural'])
+        self.assertEqual(descripciones('pizz'), ['Cena pizzeria', 'Pizza familiar'])
+        busqueda.reconstruir()
+        self.assertEqual(descripciones('pizz'), ['Cena pizzeria', 'Pizza familiar'])
+
+    def test_relevancia_y_antiguedad(self):
+        ids = busqueda.mas_relevantes(Gasto.objects.all(), 'mercadona')
+        descripciones = list(Gasto.objects.filter(pk__in=ids).values_list('descripcion', flat=True))
+        self.assertEqual(sorted(descripciones), ['MERCADONA', 'Mercadona Centro'])
+        # Con la misma relevancia gana el más reciente
+        antiguo = _gasto(self.sara, '1.00', datetime.date(2024, 1, 1), descripcion='Cine')
+        reciente = _gasto(self.sara, '1.00', datetime.date(2025, 1, 1), descripcion='Cine')
+        self.assertEqual(busqueda.mas_relevantes(Gasto.objects.all(), 'cine'), [reciente.pk, antiguo.pk])
+
+
+class CopiasTests(TestCase):
+    def setUp(self):
+        generar(gastos=60, anos=1)
+        Liquidacion.objects.create(
+            fecha=datetime.date.today() - datetime.timedelta(days=90),
+            pagado_por=User.objects.get(username='adri'), cantidad=Decimal('25.00'),
+        )
+
+    def _datos(self):
+        """Contenido de las tablas copiadas y del resumen (los cierres se comprueban al conciliar)."""
+        datos = {}
+        for modelo in copias.MODELOS + [ResumenMensual]:
+            campos = [campo for campo in copias._campos(modelo) if campo not in ('id', 'last_login')]
+            datos[modelo._meta.label] = sorted(map(repr, modelo._default_manager.values_list(*campos)))
+        return datos
+
+    def _copia(self):
+        copia = io.BytesIO()
+        copias.crear_copia(copia)
+        copia.seek(0)
+        return copia
+
+    def test_copia_y_restauracion_conservan_todo(self):
+        antes = self._datos()
+        copia = self._copia()
+        filas = copias.restaurar_copia(copia, reemplazar=True)
+        self.assertEqual(filas['core.gasto'], Gasto.objects.count())
+        self.assertEqual(self._datos(), antes)
+        self.assertEqual(fondos.conciliar(), [])
+        self.assertEqual(resumen.verificar(), [])
+
+    def test_no_pisa_datos_sin_reemplazar(self):
+        with self.assertRaisesMessage(copias.ErrorCopia, 'no están vacías'):
+            copias.restaurar_copia(self._copia())
+
+    def test_copia_incompleta_no_cambia_nada(self):
+        lineas = gzip.decompress(self._copia().getvalue()).splitlines(keepends=True)
+        truncada = io.BytesIO(gzip.compress(b''.join(lineas[:-1] + [b'{"fin":{}}\n'])))
+        antes = self._datos()
+        with self.assertRaisesMessage(copias.ErrorCopia, 'incompleta'):
+            copias.restaurar_copia(truncada, reemplazar=True)
+        self.assertEqual(self._datos(), antes)
+
+
+class SugerenciasTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        with self.captureOnCommitCallbacks(execute=True):
+            for descripcion, codigo in [('Mercadona', '1'), ('mercadona ', '1'), ('Mercadona', '4'), ('Café Central', '4')]:
+                _gasto(self.sara, '1.00', datetime.date(2025, 3, 1), descripcion=descripcion, codigo=codigo)
+        sugerencias.olvidar_indice()
+
+    def _descripciones(self, texto):
+        return [sugerencia['descripcion'] for sugerencia in sugerencias.sugerir(texto)]
+
+    def test_prefijo_de_cualquier_palabra_sin_tildes(self):
+        mercadona = sugerencias.sugerir('MERC')[0]
+        self.assertEqual(
+            (mercadona['veces'], mercadona['categoria']), (3, categorias.por_codigo('1').id),
+        )
+        self.assertEqual(self._descripciones('centr'), ['Café Central'])
+        self.assertEqual(self._descripciones('cafe c'), ['Café Central'])
+        self.assertEqual(self._descripciones('xyz'), [])
+
+    def test_anadir_y_quitar_mantienen_los_textos(self):
+        indice = sugerencias.IndicePrefijos()
+        indice.anadir('Bar Pepe', 1, None, datetime.date(2025, 1, 1))
+        indice.anadir('Bar Pepe', 2, None, datetime.date(2025, 1, 2), veces=2)
+        self.assertEqual([comercio.nombre for comercio in indice.buscar('pe')], ['Bar Pepe'])
+        indice.quitar('Bar Pepe', 2, None, veces=2)
+        self.assertEqual(indice.buscar('bar')[0].categorias[1], 1)
+        indice.quitar('Bar Pepe', 1, None)
+        self.assertEqual((indice.buscar('bar'), indice.textos), ([], []))
+
+    def test_ordena_todo_el_rango_del_prefijo(self):
+        indice = sugerencias.IndicePrefijos()
+        for numero in range(3000):
+            indice.anadir(f'Aa {numero:04d}', 1, None, datetime.date(2020, 1, 1))
+        indice.anadir('Az favorito', 1, None, datetime.date(2025, 1, 1), veces=50)
+        self.assertEqual(indice.buscar('a', limite=1)[0].nombre, 'Az favorito')
+
+    def test_cambios_confirmados_sin_reconstruir(self):
+        indice = sugerencias.indice()
+        with self.captureOnCommitCallbacks(execute=True):
+            gasto = _gasto(self.sara, '1.00', datetime.date(2025, 3, 2), descripcion='Farmacia Sol')
+        self.assertIs(sugerencias.indice(), indice)
+        self.assertEqual(self._descripciones('farm'), ['Farmacia Sol'])
+        with self.captureOnCommitCallbacks(execute=True):
+            gasto.delete()
+        self.assertIs(sugerencias.indice(), indice)
+        self.assertEqual(self._descripciones('farm'), [])
+
+    def test_varios_cambios_en_una_transaccion(self):
+        indice = sugerencias.indice()
+        with self.captureOnCommitCallbacks(execute=True):
+            for dia in (2, 3, 4):
+                _gasto(self.sara, '1.00', datetime.date(2025, 3, dia), descripcion='Farmacia Sol')
+            Gasto.objects.filter(descripcion='Café Central').get().delete()
+        self.assertIs(sugerencias.indice(), indice)
+        self.assertEqual(sugerencias.sugerir('farm')[0]['veces'], 3)
+        self.assertEqual(self._descripciones('cafe'), [])
+
+    def test_cambios_deshechos_no_quedan_en_el_indice(self):
+        sugerencias.indice()
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            _gasto(self.sara, '1.00', datetime.date(2025, 3, 2), descripcion='Farmacia Sol')
+            self.assertEqual(self._descripciones('farm'), ['Farmacia Sol'])
+            1 / 0
+        self.assertEqual(self._descripciones('farm'), [])
+
+    def test_cambios_de_otro_proceso(self):
+        indice = sugerencias.indice()
+        self.assertEqual(self._descripciones('farm'), [])
+        # Otro proceso crea un gasto: este solo lee las filas que han cambiado
+        with self.captureOnCommitCallbacks(execute=True):
+            _gasto(self.sara, '1.00', datetime.date(2025, 3, 2), descripcion='Farmacia Sol', codigo='5')
+        with self.assertNumQueries(3):
+            self.assertIs(sugerencias.indice(), indice)
+        self.assertEqual(self._descripciones('farm'), ['Farmacia Sol'])
+
+    def test_la_tabla_sigue_a_los_gastos(self):
+        def usos():
+            return sorted(UsoComercio.objects.filter(veces__gt=0).values_list('comercio', 'categoria', 'fondo', 'veces'))
+
+        fondo = FondoComun.objects.create(tipo='GASTOS')
+        with self.captureOnCommitCallbacks(execute=True):
+            gasto = Gasto.objects.get(descripcion='Café Central')
+            gasto.fondo = fondo
+            gasto.save()
+            Gasto.objects.filter(descripcion='mercadona ').get().delete()
+        antes = usos()
+        indice = sugerencias.indice()
+        self.assertEqual(sugerencias.reconstruir(), len(antes))
+        self.assertEqual(usos(), antes)
+        # Tras reconstruir, los procesos cargan la tabla entera
+        self.assertIsNot(sugerencias.indice(), indice)
+        self.assertEqual(sugerencias.sugerir('cafe')[0]['fondo'], fondo.pk)
+
+
+class ClasificadorTests(TestCase):
+    def setUp(self):
+        self.sara = User.objects.create(username='sara')
+        with self.captureOnCommitCallbacks(execute=True):
+            for descripcion, codigo, veces in [
+                ('Mercadona', '1', 5), ('Eroski', '1', 3), ('Cine Yelmo', '4', 4), ('Bar Pepe', '4', 2),
+            ]:
+                for _ in range(veces):
+                    _gasto(self.sara, '1.00', datetime.date(2025, 3, 1), descripcion=descripcion, codigo=codigo)
+        clasificador.olvidar_modelo()
+        self.supermercado = categorias.por_codigo('1').id
+        self.ocio = categorias.por_codigo('4').id
+
+    def test_predice_por_las_palabras_conocidas(self):
+        self.assertEqual(clasificador.predecir('MERCADONA Centro'), self.supermercado)
+        self.assertEqual(clasificador.predecir('cine'), self.ocio)
+        self.assertIsNone(clasificador.predecir('Desconocido'))
+        self.assertEqual(clasificador.palabras('Café «Bar» y 2x'), ['cafe', 'bar', '2x'])
+
+    def test_aprender_y_olvidar_dejan_el_modelo_igual(self):
+        modelo = clasificador.NaiveBayes()
+        modelo.aprender(['cine', 'yelmo'], self.ocio, 2)
+        antes = (dict(modelo.documentos), dict(modelo.total_palabras), dict(modelo.conteos))
+        modelo.aprender(['bar', 'cine'], self.supermercado)
+        modelo.olvidar(['bar', 'cine'], self.supermercado)
+        self.assertEqual((dict(modelo.documentos), dict(modelo.total_palabras), dict(modelo.conteos)), antes)
+
+    def test_aprende_de_los_cambios_sin_reentrenar(self):
+        modelo = clasificador.modelo()
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(6):
+                _gasto(self.sara, '1.00', datetime.date(2025, 3, 2), descripcion='Farmacia', codigo='5')
+        self.assertIs(clasificador.modelo(), modelo)
+        self.assertEqual(clasificador.predecir('farmacia'), categorias.por_codigo('5').id)
+
+        # Recategorizar el bar en supermercado y borrar el cine
+        with self.captureOnCommitCallbacks(execute=True):
+            for gasto in Gasto.objects.filter(descripcion='Bar Pepe'):
+                gasto.categoria = categorias.por_codigo('1')
+                gasto.save()
+            for gasto in Gasto.objects.filter(descripcion='Cine Yelmo'):
+                gasto.delete()
+        self.assertIs(clasificador.modelo(), modelo)
+        self.assertEqual(clasificador.predecir('bar'), self.supermercado)
+        self.assertIsNone(clasificador.predecir('cine'))
+        self.assertEqual(modelo.conteos, clasificador.entrenar().conteos)
+
+    def test_cambios_de_otro_proceso(self):
+        modelo = clasificador.modelo()
+        self.assertIsNone(clasificador.predecir('farmacia'))
+        # Otro proceso crea gastos: este solo lee las filas que han cambiado
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(6):
+                _gasto(self.sara, '1.00', datetime.date(2025, 3, 2), descripcion='Farmacia', codigo='5')
+        with self.assertNumQueries(3):
+            self.assertIs(clasificador.modelo(), modelo)
+        self.assertEqual(clasificador.predecir('farmacia'), categorias.por_codigo('5').id)
+
+    def test_la_tabla_sigue_a_los_gastos(self):
+        def conteos():
+            return sorted(ConteoPalabra.objects.filter(veces__gt=0).values_list('palabra', 'categoria', 'veces'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Gasto.objects.filter(descripcion='Eroski').first().delete()
+        antes = conteos()
+        modelo = clasificador.modelo()
+        self.assertEqual(clasificador.reconstruir(), len(antes))
+        self.assertEqual(conteos(), antes)
+        # Tras reconstruir, los procesos cargan la tabla entera
+        self.assertIsNot(clasificador.modelo(), modelo)
+        self.assertEqual(clasificador.modelo().conteos, clasificador.entrenar().conteos)
+
+
+class GeneracionTests(TestCase):
+    def test_datos_generados_cuadran(self):
+        generar(gastos=300, anos=1)
+        self.assertEqual(Gasto.objects.filter(recurrente__isnull=True).count(), 300)
+        self.assertEqual(resumen.verificar(), [])
+        self.assertEqual(fondos.conciliar(), [])
+        # Los recurrentes y objetivos quedan aplicados hasta hoy
+        pendientes = aplicar_pendientes(simular=True)
+        self.assertEqual((pendientes['gastos'], pendientes['ingresos']), ([], []))
+
+    def test_consultas_de_las_vistas_no_dependen_de_los_gastos(self):
+        # Una vista que consultara gasto a gasto haría más consultas al crecer el
+        # historial (guardar puede hacer menos si ya existen las filas del resumen)
+        generar(gastos=100, anos=1)
+        usuario = User.objects.get(username='sara')
+        pocos = medir_vistas(usuario, repeticiones=1)
+        generar(gastos=400, anos=1, semilla=2)
+        muchos = medir_vistas(usuario, repeticiones=1)
+        for vista, medida in pocos.items():
+            self.assertLess(medida['estado'], 400, vista)
+            self.assertLessEqual(muchos[vista]['consultas'], medida['consultas'], vista)
+
+
+class MedicionPeticionesTests(TestCase):
+    def setUp(self):
+        generar(gastos=20, anos=1)
+        self.client.force_login(User.objects.get(username='sara'))
+
+    def test_desactivada_no_anade_cabecera(self):
+        self.assertNotIn('Server-Timing', self.client.get('/fondos/'))
+
+    @override_settings(MEDIR_PETICIONES=True, PETICION_LENTA_MS=0)
+    def test_cabecera_y_log_de_peticiones_lentas(self):
+        with CaptureQueriesContext(connection) as consultas, self.assertLogs('core.middleware', 'WARNING') as log:
+            respuesta = self.client.get('/fondos/')
+        numero = len(consultas.captured_queries)
+        self.assertIn(f'SQL ({numero} consultas)', respuesta['Server-Timing'])
+        datos = json.loads(log.records[0].getMessage())
+        self.assertEqual((datos['ruta'], datos['consultas']), ('/fondos/', numero))
+        self.assertTrue(datos['repetidas'])
+
+    def test_forma_de_consulta_ignora_la_longitud_de_las_listas(self):
+        self.assertEqual(
+            forma_consulta('SELECT * FROM t WHERE id IN (%s, %s,\n %s) AND a = %s'),
+            forma_consulta('SELECT * FROM t  WHERE id IN (%s) AND a = %s'),
+        )
+
+
+class PerfiladoTests(TestCase):
+    def setUp(self):
+        generar(gastos=20, anos=1)
+        self.usuaria = User.objects.get(username='sara')
+        self.client.force_login(self.usuaria)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(PERFILES_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_sin_personal_se_ignora(self):
+        respuesta = self.client.get('/fondos/?perfilar=tabla', HTTP_X_PERFILAR='1')
+        self.assertEqual(respuesta['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(perfilado.listar(), [])
+
+    def test_personal_guarda_el_perfil_y_ve_la_tabla(self):
+        User.objects.filter(pk=self.usuaria.pk).update(is_staff=True)
+        respuesta = self.client.get('/fondos/?perfilar=tabla&orden=propio&limite=5')
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'Ordered by: internal time', respuesta.content)
+        [perfil] = perfilado.listar()
+        self.assertEqual(perfil.vista, 'panel_fondos')
+        self.assertEqual(perfilado.podar(conservar=0), [perfil])
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        generar(gastos=20, anos=1)
+        self.usuaria = User.objects.get(username='sara')
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+        ajustes = override_settings(METRICAS_TOKEN='secreto', METRICAS_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_acceso(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        self.client.force_login(self.usuaria)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        User.objects.filter(pk=self.usuaria.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_exposicion_suma_los_procesos(self):
+        self.client.force_login(self.usuaria)
+        self.client.get('/fondos/')
+        # Valores escritos por otro proceso en el directorio compartido
+        with open(f'{self.directorio}/1-otro.json', 'w', encoding='utf-8') as fichero:
+            json.dump({
+                'contadores': [['gastos_peticiones_total', [['estado', '200'], ['vista', 'panel_fondos']], 1000]],
+                'histogramas': [],
+            }, fichero)
+
+        respuesta = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lineas = respuesta.content.decode().splitlines()
+        [peticiones] = [linea for linea in lineas if linea.startswith('gastos_peticiones_total{estado="200",vista="panel_fondos"}')]
+        self.assertGreater(float(peticiones.split()[-1]), 1000)
+        self.assertIn('# TYPE gastos_peticion_duracion_segundos histogram', lineas)
+        self.assertTrue(any(linea.startswith('gastos_peticion_duracion_segundos_bucket{le="+Inf",vista="panel_fondos"}') for linea in lineas))
+        self.assertIn(f'gastos_gastos_registrados {float(Gasto.objects.count())!r}', lineas)
+        saldo = FondoComun.objects.get(tipo='AHORRO').saldo
+        self.assertIn(f'gastos_fondo_saldo_euros{{fondo="AHORRO"}} {float(saldo)!r}', lineas)
+
+    def test_procesos_terminados_se_suman_en_un_fichero(self):
+        def creados():
+            [linea] = [linea for linea in metricas.exposicion().splitlines() if linea.startswith('gastos_gastos_creados_total')]
+            return float(linea.split()[-1])
+
+        # Tres procesos que terminan uno tras otro
+        for valor in (1, 2, 3):
+            with mock.patch.object(metricas, '_registro', metricas._Registro()):
+                metricas.incrementar('gastos_gastos_creados_total', valor)
+                metricas.observar('gastos_peticion_duracion_segundos', 0.02, vista='inicio')
+                metricas.escribir(forzar=True)
+                metricas.cerrar()
+        self.assertEqual(sorted(nombre for nombre in os.listdir(self.directorio) if nombre.endswith('.json')), [metricas.AGREGADO])
+        with mock.patch.object(metricas, '_registro', metricas._Registro()):
+            self.assertEqual(creados(), 6.0)
+            self.assertIn('gastos_peticion_duracion_segundos_count{vista="inicio"} 3.0', metricas.exposicion())
+            # Lo registrado después de cerrar no repite lo ya sumado
+            metricas.cerrar()
+            metricas.incrementar('gastos_gastos_creados_total', 4)
+            self.assertEqual(creados(), 10.0)
+
+
+class PanelesTests(TestCase):
+    def setUp(self):
+        generar(gastos=20, anos=1)
+        self.client.force_login(User.objects.get(username='sara'))
+
+    def test_contexto_guardado_hasta_el_siguiente_cambio(self):
+        self.client.get('/fondos/')
+        with CaptureQueriesContext(connection) as capturadas:
+            saldo = self.client.get('/fondos/').context['saldo_total']
+        self.assertFalse([q for q in capturadas.captured_queries if 'core_fondocomun' in q['sql']])
+
+        # Los saldos cambian con ``UPDATE``, sin señales de ``FondoComun``
+        fondo = FondoComun.objects.get(tipo='AHORRO')
+        ajustar_saldo(fondo.id, Decimal('10'))
+        self.assertEqual(self.client.get('/fondos/').context['saldo_total'], saldo + Decimal('10'))
+
+        total = self.client.get('/resumen/').context['total_general']
+        Gasto.objects.create(
+            descripcion='Panadería', monto_total=Decimal('2.50'), fecha=datetime.date.today(),
+            categoria=categorias.por_codigo('1'), pagado_por=User.objects.get(username='adri'),
+        )
+        self.assertEqual(self.client.get('/resumen/').context['total_general'], total + Decimal('2.50'))
+
+    def test_cambios_de_otro_proceso(self):
+        # Cada «proceso» tiene su propia caché en memoria
+        otro_proceso = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'otro-proceso'},
+        })
+        with otro_proceso:
+            saldo = self.client.get('/fondos/').context['saldo_total']
+            total = self.client.get('/resumen/').context['total_general']
+
+        # Este proceso cambia los datos sin tocar la caché del otro
+        ajustar_saldo(FondoComun.objects.get(tipo='AHORRO').id, Decimal('10'))
+        Gasto.objects.filter(pk=Gasto.objects.order_by('-fecha').values('pk')[:1]).update(monto_total=F('monto_total') + 1)
+        resumen.reconstruir()
+
+        with otro_proceso:
+            self.assertEqual(self.client.get('/fondos/').context['saldo_total'], saldo + Decimal('10'))
+            self.assertEqual(self.client.get('/resumen/').context['total_general'], total + Decimal('1'))
+
+    def test_cambio_deshecho_no_invalida(self):
+        self.client.get('/fondos/')
+        version = versiones.leer(paneles.CLAVE_VERSION)
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            ajustar_saldo(FondoComun.objects.get(tipo='AHORRO').id, Decimal('10'))
+            self.assertNotEqual(versiones.leer(paneles.CLAVE_VERSION), version)
+            1 / 0
+        self.assertEqual(versiones.leer(paneles.CLAVE_VERSION), version)
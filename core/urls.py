@@ -2,12 +2,17 @@ from django.urls import path
 from . import views
 urlpatterns = [
     path('gastos/', views.lista_gastos, name='lista_gastos'),
+    path('gastos/exportar/', views.exportar_gastos, name='exportar_gastos'),
     path('nuevo/', views.crear_gasto, name='crear_gasto'),
+    path('nuevo/sugerencias/', views.sugerencias_gasto, name='sugerencias_gasto'),
+    path('importar/', views.importar_extracto, name='importar_extracto'),
     path('login/', views.login_usuario, name='login'),
     path('logout/', views.logout_usuario, name='logout'),
     path('registro/', views.registro_usuario, name='registro'),
     path('', views.panel_gastos, name='panel_gastos'),
     path('fondos/', views.panel_fondos, name='panel_fondos'),
+    path('fondos/historial/', views.historial_fondos, name='historial_fondos'),
     path('fondos/actualizar/<int:fondo_id>/', views.actualizar_fondo, name='actualizar_fondo'),
     path('resumen/', views.resumen_finanzas, name='resumen'),
+    path('metrics', views.exponer_metricas, name='metricas'),
 ]
@@ -0,0 +1,82 @@
+"""
+Versiones de los datos que los procesos copian en memoria o en la caché.
+
+Las categorías (``core.categorias``), el índice de sugerencias
+(``core.sugerencias``) y el clasificador (``core.clasificador``) se
+guardan en memoria de cada proceso junto con la versión de los datos con
+que se cargaron, y los contextos de los paneles (``core.paneles``) y la
+próxima ocurrencia de los recurrentes (``core.recurrentes``) en la caché
+de Django bajo una clave que incluye la versión. Al usarlos se compara con
+la versión actual y, si ha cambiado, se ponen al día. La versión vive en
+la tabla ``VersionDatos``, que comparten todos los procesos de gunicorn
+con cualquier configuración de la caché de Django (por defecto, la
+memoria de cada proceso, que no sirve para avisar a los demás).
+
+:func:`cambiar` da a una clave una versión nueva, mayor que la anterior,
+dentro de la transacción en curso, así que los demás procesos ven la
+versión nueva a la vez que los datos. :func:`leer` consulta la base de
+datos; durante una petición todas las versiones se leen con una sola
+consulta la primera vez que se piden y se reutilizan hasta que termina, de
+modo que la petición trabaja con una misma foto de las versiones y el
+coste no depende de cuántas veces se consulten.
+"""
+
+import threading
+import time
+
+from django.core.signals import request_finished, request_started
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+
+from .models import VersionDatos
+
+# Versiones leídas en la petición en curso (``None`` fuera de una petición)
+_local = threading.local()
+
+
+@receiver(request_started)
+def _empezar_peticion(**kwargs):
+    _local.versiones = {}
+    _local.leidas = False
+
+
+@receiver(request_finished)
+def _terminar_peticion(**kwargs):
+    _local.versiones = None
+
+
+def leer(clave):
+    """Versión actual de ``clave`` (0 si nunca ha cambiado)."""
+    versiones = getattr(_local, 'versiones', None)
+    if versiones is None:
+        return VersionDatos.objects.filter(clave=clave).values_list('version', flat=True).first() or 0
+    if not _local.leidas:
+        versiones.update(VersionDatos.objects.values_list('clave', 'version'))
+        _local.leidas = True
+    return versiones.get(clave, 0)
+
+
+def cambiar(clave):
+    """Da a ``clave`` una versión nueva y la devuelve.
+
+    La versión nueva se calcula en el propio ``UPDATE`` a partir de la
+    anterior (es siempre mayor) y la fila queda bloqueada hasta el final de
+    la transacción, así que las versiones de una clave crecen en el orden en
+    que se confirman los cambios.
+    """
+    filas = VersionDatos.objects.filter(clave=clave)
+    siguiente = Greatest(F('version') + 1, Value(time.time_ns()))
+    if not filas.update(version=siguiente):
+        # Primer cambio de la clave
+        try:
+            with transaction.atomic():
+                VersionDatos.objects.create(clave=clave, version=time.time_ns())
+        except IntegrityError:
+            filas.update(version=siguiente)
+    nueva = filas.values_list('version', flat=True).get()
+    versiones = getattr(_local, 'versiones', None)
+    if versiones is not None:
+        versiones[clave] = nueva
+    return nueva
@@ -2,82 +2,43 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
 from decimal import Decimal
 import datetime
 
-from .models import UserProfile, Categoria, Gasto, FondoComun, IngresoFondo, GastoRecurrente, ObjetivoAhorro
+from .models import UserProfile, Gasto, FondoComun, IngresoFondo, GastoRecurrente, ObjetivoAhorro
 from .forms import GastoForm, RegistroForm
+from .balance import calcular_deuda, calcular_deuda_actual
+from .fondos import GRANULARIDADES, aportaciones_por_fondo, fijar_saldo, granularidad_para, historial_saldos
+from . import busqueda, categorias, clasificador, metricas, paneles, resumen, sugerencias
+from .comercios import totales_por_comercio
+from .importacion import FORMATOS, abrir, detectar_formato, importar
+from .exportacion import csv_en_flujo, filas as filas_exportacion, xlsx_en_flujo
+from . import filtros
+from .filtros import filtrar_gastos
+from .fechas import filtrar_periodo, rango_mes
+import hmac
 import json
+from django.conf import settings
 from django.db.models import Sum
-from django.db.models.functions import TruncMonth
 
-from django.db import transaction
 
-from django.core.paginator import Paginator
-from django.db.models import Q
+from urllib.parse import urlencode
+
+from .paginacion import TAMANO_PAGINA, PaginaKeyset, paginar_keyset
+from .recurrentes import aplicar_pendientes, asegurar_periodo_aplicado
 from django.utils.timezone import now
 
 
 def aplicar_gastos_recurrentes_y_objetivos():
-    hoy = datetime.date.today()
+    """Aplica los recurrentes y objetivos pendientes hasta hoy.
 
-    def ya_aplicado(ultimo_ano, ultimo_mes):
-        return ultimo_ano == hoy.year and ultimo_mes == hoy.month
-
-    with transaction.atomic():
-        # === Gastos recurrentes (suscripciones / caldera) ===
-        for rec in GastoRecurrente.objects.filter(activo=True):
-            if ya_aplicado(rec.ultimo_ano_aplicado, rec.ultimo_mes_aplicado):
-                continue
-
-            # mensual completo o anual prorrateado
-            monto_mes = (
-                rec.monto if rec.periodicidad == 'MENSUAL'
-                else (rec.monto / Decimal('12')) if rec.prorratear
-                else rec.monto
-            ).quantize(Decimal('0.01'))
-
-            # crea el gasto (siempre de la cuenta conjunta; da igual quién aparezca como pagador)
-            gasto = Gasto.objects.create(
-                descripcion=f"[Recurrente] {rec.nombre}",
-                monto_total=monto_mes,
-                categoria=rec.categoria,
-                pagado_por=User.objects.filter(username__in=['sara','adri']).first(),
-                fecha=hoy,
-                fondo=rec.fondo
-            )
-
-            # descuenta manualmente del saldo del fondo si corresponde
-            if rec.fondo:
-                rec.fondo.saldo -= monto_mes
-                rec.fondo.save(update_fields=['saldo'])
-
-            # marca como aplicado este mes
-            rec.ultimo_ano_aplicado = hoy.year
-            rec.ultimo_mes_aplicado = hoy.month
-            rec.save(update_fields=['ultimo_ano_aplicado', 'ultimo_mes_aplicado'])
-
-        # === Objetivos de ahorro ===
-        for obj in ObjetivoAhorro.objects.filter(activo=True):
-            if ya_aplicado(obj.ultimo_ano_aplicado, obj.ultimo_mes_aplicado):
-                continue
-
-            aporte = obj.aporte_mensual.quantize(Decimal('0.01'))
-
-            # ingreso automático al fondo (no se adjudica a Sara/Adri)
-            IngresoFondo.objects.create(
-                fondo=obj.fondo_destino,
-                cantidad=aporte,
-                usuario=None,
-                es_automatico=True
-            )
-            # si tienes señal post_save en IngresoFondo, el saldo se suma automáticamente
-
-            obj.ultimo_ano_aplicado = hoy.year
-            obj.ultimo_mes_aplicado = hoy.month
-            obj.save(update_fields=['ultimo_ano_aplicado', 'ultimo_mes_aplicado'])
+    Se mantiene por compatibilidad; la lógica vive en ``core.recurrentes``
+    y las vistas usan ``asegurar_periodo_aplicado``, que solo lee una
+    versión mientras no haya ocurrencias pendientes.
+    """
+    return aplicar_pendientes()
 
 
 
@@ -98,17 +59,17 @@ aportaciones mensuales proporcionales al salario de cada usuaria:
   gastos del piso, 100 € para viajes, 100 € para compras del piso y
   150 € para ahorro de pareja).
 * Ampliación de la lista de categorías disponible al crear un gasto
-  para incluir «Compras piso». Esta lista se ofrece como nombres
-  legibles y se almacena en el campo ``categoria`` del modelo ``Gasto``.
+  para incluir «Compras piso». Las categorías se leen de la tabla
+  ``Categoria`` (a través de la copia en memoria de ``core.categorias``)
+  y ``Gasto.categoria`` es una clave foránea a ella.
 
 El resto de vistas (listado de gastos, panel de gastos, registro y
 login) se mantienen prácticamente igual, corrigiendo la identación y
 añadiendo los nuevos colores para la categoría ``Compras piso``.
 """
 
-# Porcentajes de aportación fijos por usuaria
-PORCENTAJE_SARA = Decimal('0.63')
-PORCENTAJE_ADRI = Decimal('0.37')
+# Porcentajes de aportación fijos por usuaria (definidos en ``balance``)
+from .balance import PORCENTAJE_SARA, PORCENTAJE_ADRI
 
 # Nota: los montos mensuales ya no se definen de forma estática.
 #       En lugar de ello se registran como objetos ``IngresoFondo``
@@ -134,65 +95,108 @@ def actualizar_fondos_mensuales() -> None:
     return
 
 
+# Claves de ordenación del listado de gastos. Todas acaban en ``id`` para
+# que sean únicas y puedan paginarse por clave; ``(fecha, id)`` y
+# ``(monto_total, id)`` tienen su propio índice.
+ORDENES_LISTA = {
+    'fecha_desc': ['-fecha', '-id'],
+    'importe_desc': ['-monto_total', '-id'],
+    'importe_asc': ['monto_total', 'id'],
+}
+
+
+def _pagina_por_relevancia(request, parametros):
+    """Página de los resultados de la búsqueda ``q`` ordenados por relevancia.
+
+    Se ordenan los gastos más relevantes (ver ``core.busqueda``) y los
+    cursores son posiciones en esa lista.
+    """
+    sin_texto = {clave: valor for clave, valor in parametros.items() if clave != 'q'}
+    ids = busqueda.mas_relevantes(filtrar_gastos(Gasto.objects.all(), sin_texto), parametros['q'])
+    antes = request.GET.get('antes', '')
+    despues = request.GET.get('despues', '')
+    if antes.isdigit():
+        fin = min(int(antes), len(ids))
+        inicio = max(fin - TAMANO_PAGINA, 0)
+    else:
+        inicio = min(int(despues) if despues.isdigit() else 0, len(ids))
+        fin = min(inicio + TAMANO_PAGINA, len(ids))
+    por_id = Gasto.objects.select_related('pagado_por').in_bulk(ids[inicio:fin])
+    return PaginaKeyset(
+        [por_id[gasto_id] for gasto_id in ids[inicio:fin] if gasto_id in por_id],
+        has_next=fin < len(ids),
+        has_previous=inicio > 0,
+        cursor_siguiente=str(fin),
+        cursor_anterior=str(inicio),
+    )
+
+
 @login_required
 def lista_gastos(request):
-    gastos = Gasto.objects.select_related('categoria','fondo','pagado_por')
+    """Buscador y listado de todos los gastos.
 
-    # filtros por búsqueda, categoría, fondo y fechas
-    q      = request.GET.get('q','').strip()
-    cat_id = request.GET.get('cat')
-    fondo_id = request.GET.get('fondo')
-    year   = request.GET.get('year')
-    month  = request.GET.get('month')
-    order  = request.GET.get('order','fecha_desc')
-
-    if q:
-        gastos = gastos.filter(
-            Q(descripcion__icontains=q) |
-            Q(categoria__nombre__icontains=q) |
-            Q(fondo__nombre__icontains=q) |
-            Q(pagado_por__username__icontains=q)
-        )
-    if cat_id:
-        gastos = gastos.filter(categoria_id=cat_id)
-    if fondo_id:
-        gastos = gastos.filter(fondo_id=fondo_id)
-    if year and month:
-        gastos = gastos.filter(fecha__year=year, fecha__month=month)
-    elif year:
-        gastos = gastos.filter(fecha__year=year)
-
-    # ordenación
-    if order == 'importe_desc':
-        gastos = gastos.order_by('-monto_total','-fecha','-id')
-    elif order == 'importe_asc':
-        gastos = gastos.order_by('monto_total','-fecha','-id')
+    Acepta los filtros de ``core.filtros`` y tres órdenes, más el orden por
+    relevancia cuando hay texto de búsqueda. La paginación es por clave
+    (``despues``/``antes``), así que una página lejana cuesta lo mismo que
+    la primera, y el total se obtiene con ``contar_gastos`` en lugar de un
+    ``COUNT(*)`` sobre todos los gastos en cada página.
+    """
+    parametros = filtros.parametros(request.GET)
+    order = request.GET.get('order', 'fecha_desc')
+    if order not in ORDENES_LISTA and not (order == 'relevancia' and parametros.get('q')):
+        order = 'fecha_desc'
+    gastos = filtrar_gastos(Gasto.objects.all(), parametros)
+
+    if order == 'relevancia':
+        pagina = _pagina_por_relevancia(request, parametros)
     else:
-        gastos = gastos.order_by('-fecha','-id')
+        pagina = paginar_keyset(
+            gastos.select_related('pagado_por'),
+            ORDENES_LISTA[order],
+            despues=request.GET.get('despues'),
+            antes=request.GET.get('antes'),
+        )
+    numero, exacto = filtros.contar_gastos(gastos, parametros)
+
+    nombres_fondos = {fondo.id: fondo.get_tipo_display() for fondo in FondoComun.objects.all()}
+    gastos_pagina = []
+    for gasto in pagina.object_list:
+        gastos_pagina.append(
+            {
+                'fecha': gasto.fecha,
+                'descripcion': gasto.descripcion,
+                'monto_total': gasto.monto_total,
+                'categoria': categorias.nombre(gasto.categoria_id),
+                'fondo': nombres_fondos.get(gasto.fondo_id, ''),
+                'pagado_por': gasto.pagado_por.username,
+            }
+        )
+    total_pagina = sum((gasto['monto_total'] for gasto in gastos_pagina), Decimal('0.00'))
 
     # selectores para los filtros
-    categorias = Categoria.objects.order_by('nombre')
-    fondos     = FondoComun.objects.order_by('nombre')
-    today      = now().date()
-    years  = list(range(today.year, today.year - 5, -1))
+    today = now().date()
+    years = list(range(today.year, today.year - 5, -1))
     months = [
         (1, 'Enero'), (2, 'Febrero'), (3, 'Marzo'), (4, 'Abril'),
         (5, 'Mayo'), (6, 'Junio'), (7, 'Julio'), (8, 'Agosto'),
         (9, 'Septiembre'), (10, 'Octubre'), (11, 'Noviembre'), (12, 'Diciembre')
     ]
 
-    # total de la página (opcional)
-    total_pagina = sum((g.monto_total for g in gastos_page.object_list), Decimal('0.00'))
-
     context = {
-        'gastos': gastos_page,
-        'categorias': categorias,
-        'fondos': fondos,
-        'q': q,
-        'cat': cat_id,
-        'fondo': fondo_id,
-        'year': year,
-        'month': month,
+        'gastos': gastos_pagina,
+        'pagina': pagina,
+        'total_pagina': total_pagina,
+        'numero': numero,
+        'numero_exacto': exacto,
+        'categorias': [(categoria.id, categoria.nombre) for categoria in categorias.todas()],
+        'fondos': sorted(nombres_fondos.items(), key=lambda fondo: fondo[1]),
+        # Filtros y orden activos para mantenerlos en los enlaces de paginación
+        'filtros_query': urlencode({**parametros, 'order': order}),
+        'q': parametros.get('q', ''),
+        'cat': parametros.get('cat', ''),
+        'fondo': parametros.get('fondo', ''),
+        'year': parametros.get('year', ''),
+        'month': parametros.get('month', ''),
         'order': order,
         'years': years,
         'months': months,
@@ -226,7 +230,7 @@ def crear_gasto(request):
                     request,
                     'core/crear_gasto.html',
                     {
-                        'categorias': ['Gastos piso', 'Compras piso', 'Supermercado', 'Viajes', 'Ocio', 'Otros'],
+                        'categorias': categorias.todas(),
                         'usuarios': User.objects.filter(username__in=['sara', 'adri']),
                         'fondos': FondoComun.objects.exclude(tipo='AHORRO'),
                     },
@@ -234,19 +238,16 @@ def crear_gasto(request):
 
             # Obtener el usuario que pagó
             pagador = User.objects.get(id=pagado_por_id)
-            # Determinar el fondo asociado a la categoría si no se ha seleccionado uno
-            categoria_map = {
-                '1': 'SUPERMERCADO',  # Supermercado
-                '3': 'GASTOS',       # Gastos piso
-                '2': 'VIAJES',       # Viajes
-                '6': 'COMPRAS',      # Compras piso
-            }
+            # La categoría llega como id (o como nombre, desde formularios antiguos)
+            categoria = categorias.resolver(categoria)
+            if categoria is None:
+                raise ValueError('categoría desconocida')
             fondo = None
             # Si el usuario no seleccionó un fondo manualmente y la categoría está
             # asociada a un fondo, lo asignamos automáticamente.
-            if not fondo_id and categoria in categoria_map:
+            if not fondo_id and categorias.tipo_fondo(categoria):
                 try:
-                    fondo = FondoComun.objects.get(tipo=categoria_map[categoria])
+                    fondo = FondoComun.objects.get(tipo=categorias.tipo_fondo(categoria))
                 except FondoComun.DoesNotExist:
                     fondo = None
             # Si el formulario incluye un fondo manualmente lo usamos en su lugar
@@ -265,7 +266,8 @@ def crear_gasto(request):
                 messages.warning(request, 'El gasto supera el saldo disponible del fondo; el saldo quedará en negativo.')
 
 
-            # Crear y guardar el gasto
+            # Crear y guardar el gasto. Si tiene fondo, la señal de ``Gasto``
+            # registra el cargo y lo descuenta del saldo en la misma transacción.
             gasto = Gasto(
                 descripcion=descripcion,
                 monto_total=monto_total,
@@ -276,11 +278,6 @@ def crear_gasto(request):
             )
             gasto.save()
 
-            # Descontar del fondo si corresponde
-            if fondo:
-                fondo.saldo -= Decimal(monto_total)
-                fondo.save()
-
             messages.success(request, 'Gasto creado correctamente')
             return redirect('panel_gastos')
 
@@ -294,7 +291,7 @@ def crear_gasto(request):
         request,
         'core/crear_gasto.html',
         {
-            'categorias': ['Gastos piso', 'Compras piso', 'Supermercado', 'Viajes', 'Ocio', 'Otros'],
+            'categorias': categorias.todas(),
             'usuarios': User.objects.filter(username__in=['sara', 'adri']),
             'fondos': fondos,
             'fondo_seleccionado': fondo_id,
@@ -302,6 +299,101 @@ def crear_gasto(request):
     )
 
 
+@login_required
+def sugerencias_gasto(request):
+    """Sugerencias de descripción (con su categoría y fondo habituales) para ``?q=``.
+
+    Las sirve el índice en memoria de ``core.sugerencias``; el formulario de
+    ``crear_gasto`` las pide mientras se escribe la descripción. Incluye
+    además la categoría que propone ``core.clasificador`` para el texto
+    escrito, por si no coincide con ninguna descripción anterior.
+    """
+    texto = request.GET.get('q', '')
+    return JsonResponse({'sugerencias': sugerencias.sugerir(texto), 'categoria': clasificador.predecir(texto)})
+
+
+@login_required
+def importar_extracto(request):
+    """Importa como gastos los cargos de un extracto bancario subido.
+
+    El fichero (CSV, Norma 43 u OFX) se lee línea a línea desde el fichero
+    subido, sin cargarlo entero, y se importa en una sola transacción: si
+    alguna línea no se puede interpretar no se guarda ningún gasto.
+    """
+    contexto = {
+        'categorias': categorias.todas(),
+        'usuarios': User.objects.filter(username__in=['sara', 'adri']),
+        'fondos': FondoComun.objects.exclude(tipo='AHORRO'),
+        'formatos': FORMATOS,
+    }
+    if request.method != 'POST':
+        return render(request, 'core/importar_extracto.html', contexto)
+
+    fichero = request.FILES.get('fichero')
+    if fichero is None:
+        messages.error(request, 'Selecciona un fichero')
+        return render(request, 'core/importar_extracto.html', contexto)
+    formato = request.POST.get('formato') or detectar_formato(fichero.name)
+    if formato not in FORMATOS:
+        messages.error(request, 'No se reconoce el formato del fichero')
+        return render(request, 'core/importar_extracto.html', contexto)
+    try:
+        pagador = User.objects.get(id=request.POST.get('pagado_por') or request.user.id)
+        fondo_id = request.POST.get('fondo')
+        fondo = FondoComun.objects.get(id=fondo_id) if fondo_id else None
+        resultado = importar(
+            abrir(fichero, formato), formato, pagador,
+            categoria=categorias.resolver(request.POST.get('categoria')),
+            fondo=fondo,
+        )
+    except (User.DoesNotExist, FondoComun.DoesNotExist, ValueError) as e:
+        messages.error(request, f'No se ha importado nada: {e}')
+        return render(request, 'core/importar_extracto.html', contexto)
+
+    messages.success(
+        request,
+        f'Importados {resultado.creados} gastos ({resultado.ignorados} abonos ignorados)',
+    )
+    return redirect('panel_gastos')
+
+
+@login_required
+def exportar_gastos(request):
+    """Descarga los gastos filtrados en CSV (por defecto) o XLSX (``?formato=xlsx``).
+
+    Acepta los mismos filtros que los listados (``cat``, ``fondo``,
+    ``year``, ``month`` y ``q``). El fichero se genera a medida que se leen
+    las filas, así que la memoria no depende del número de gastos.
+    """
+    gastos = filtrar_gastos(Gasto.objects.all(), filtros.parametros(request.GET))
+    nombre = f"gastos-{datetime.date.today():%Y%m%d}"
+    if request.GET.get('formato') == 'xlsx':
+        respuesta = StreamingHttpResponse(
+            xlsx_en_flujo(filas_exportacion(gastos)),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+        nombre += '.xlsx'
+    else:
+        respuesta = StreamingHttpResponse(csv_en_flujo(filas_exportacion(gastos)), content_type='text/csv; charset=utf-8')
+        nombre += '.csv'
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return respuesta
+
+
+def exponer_metricas(request):
+    """Métricas en formato Prometheus (ver ``core.metricas``).
+
+    Las lee quien envíe ``Authorization: Bearer <METRICAS_TOKEN>`` o una
+    usuaria del personal identificada; el resto recibe un 403.
+    """
+    token = settings.METRICAS_TOKEN
+    cabecera = request.headers.get('Authorization', '')
+    autorizado = bool(token) and hmac.compare_digest(cabecera.encode(), f'Bearer {token}'.encode())
+    if not autorizado and not (request.user.is_active and request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(metricas.exposicion(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def registro_usuario(request):
     """Gestiona el registro de nuevos usuarios."""
     if request.method == 'POST':
@@ -343,18 +435,9 @@ from .views import PORCENTAJE_SARA, PORCENTAJE_ADRI  # Asegúrate de importar tu
 
 @login_required
 def panel_gastos(request):
-    aplicar_gastos_recurrentes_y_objetivos()
+    asegurar_periodo_aplicado()
 
     """Muestra el panel de gastos con balance y listado de todos los gastos."""
-    # Mapeo de identificadores a nombres de categoría (por compatibilidad)
-    CATEGORIA_NOMBRES = {
-        '1': 'Supermercado',
-        '2': 'Viajes',
-        '3': 'Gastos piso',
-        '4': 'Ocio',
-        '5': 'Otros',
-        '6': 'Compras piso',
-    }
     # Colores para cada categoría
     CATEGORIA_COLORES = {
         'Viajes': 'bg-warning bg-opacity-50',
@@ -395,94 +478,66 @@ def panel_gastos(request):
 
     # Filtrar por categoría
     if cat_filter:
-        # Algunos registros antiguos almacenan el nombre legible en lugar del código,
-        # por lo que comprobamos ambos valores. Primero intentamos obtener el
-        # nombre a partir del mapeo de códigos; si existe, filtramos por el
-        # código o por el nombre (ignorando mayúsculas/minúsculas). Si no existe
-        # en el mapeo, filtramos solo por el valor recibido.
-        nombre_cat = CATEGORIA_NOMBRES.get(cat_filter)
-        if nombre_cat:
-            todos_los_gastos = todos_los_gastos.filter(
-                Q(categoria=cat_filter) | Q(categoria__iexact=nombre_cat)
-            )
-        else:
-            todos_los_gastos = todos_los_gastos.filter(categoria=cat_filter)
-
-    # Filtrar por mes (si se seleccionó)
-    if month_filter:
-        todos_los_gastos = todos_los_gastos.filter(fecha__month=month_filter)
-
-    # Filtrar por año (opcional, de cara a años futuros)
-    if year_filter:
-        todos_los_gastos = todos_los_gastos.filter(fecha__year=year_filter)
+        # Se admite el id de la categoría o su nombre; en ambos casos se
+        # filtra por igualdad sobre ``categoria_id`` (columna indexada).
+        categoria = categorias.resolver(cat_filter)
+        todos_los_gastos = todos_los_gastos.filter(categoria_id=categoria.id if categoria else None)
+
+    # Filtrar por mes y/o año (el año es opcional, de cara a años futuros).
+    # Se filtra por intervalos de fechas para poder usar los índices.
+    todos_los_gastos = filtrar_periodo(todos_los_gastos, year_filter, month_filter)
+
+    # El balance se calcula en la base de datos con una única agregación.
+    # Sin filtros se parte de la última liquidación y solo se agregan los
+    # gastos posteriores; con filtros se calcula sobre los gastos filtrados.
+    if cat_filter or month_filter or year_filter:
+        deuda_total = calcular_deuda(todos_los_gastos, usuario_actual, mi_porcentaje, otro_porcentaje)
+    else:
+        deuda_total = calcular_deuda_actual(usuario_actual, sara, mi_porcentaje, otro_porcentaje)
 
-    # Ordenar y procesar los gastos como ya lo hacías
-    todos_los_gastos = todos_los_gastos.order_by('-fecha')
+    # Construir selectores para filtros (años, meses y categorías)
+    today = now().date()
+    years = list(range(today.year, today.year - 5, -1))
+    months = [
+        (1, 'Enero'), (2, 'Febrero'), (3, 'Marzo'), (4, 'Abril'),
+        (5, 'Mayo'), (6, 'Junio'), (7, 'Julio'), (8, 'Agosto'),
+        (9, 'Septiembre'), (10, 'Octubre'), (11, 'Noviembre'), (12, 'Diciembre'),
+    ]
+    # Lista de tuplas (id, nombre) leída de la copia en memoria
+    categorias_filtro = [(categoria.id, categoria.nombre) for categoria in categorias.todas()]
+
+    # Paginación por clave sobre (fecha, id): solo se leen de la base de
+    # datos los 10 gastos que se muestran, con sus relaciones, y las páginas
+    # no se desplazan aunque se registren gastos nuevos mientras se navega.
+    pagina = paginar_keyset(
+        todos_los_gastos.select_related('pagado_por', 'fondo'),
+        ['-fecha', '-id'],
+        despues=request.GET.get('despues'),
+        antes=request.GET.get('antes'),
+    )
+    # Filtros activos para mantenerlos en los enlaces de paginación
+    filtros_query = urlencode(
+        {clave: valor for clave, valor in (('cat', cat_filter), ('year', year_filter), ('month', month_filter)) if valor}
+    )
 
-    # Procesar gastos para calcular deuda y partes correspondientes
-    deuda_total = Decimal('0')
     gastos_procesados = []
-    for gasto in todos_los_gastos:
-        categoria_nombre = gasto.get_categoria_display() or ''
-        # Calcular el reparto proporcional independientemente de quién paga
-        parte_sara = gasto.monto_total * PORCENTAJE_SARA
-        parte_adri = gasto.monto_total * PORCENTAJE_ADRI
-        # Si el gasto pertenece a un fondo común, no afecta a la deuda
-        if gasto.fondo:
-            gastos_procesados.append(
-                {
-                    'fecha': gasto.fecha,
-                    'descripcion': gasto.descripcion,
-                    'monto_total': gasto.monto_total,
-                    'parte_sara': parte_sara,
-                    'parte_adri': parte_adri,
-                    'pagado_por': 'Cuenta común',
-                    'categoria': categoria_nombre,
-                    'color_clase': CATEGORIA_COLORES.get(categoria_nombre, ''),
-                }
-            )
-            continue  # saltamos el cálculo de deuda para este gasto
-
-        # Balance de deuda según quién pagó cuando no hay fondo asociado
-        if gasto.pagado_por == usuario_actual:
-            if usuario_actual == sara:
-                deuda_total += parte_adri  # Adri le debe a Sara
-            else:
-                deuda_total += parte_sara  # Sara le debe a Adri
-        else:
-            if usuario_actual == sara:
-                deuda_total -= parte_sara  # Sara debe a Adri
-            else:
-                deuda_total -= parte_adri  # Adri debe a Sara
-
+    for gasto in pagina.object_list:
+        categoria_nombre = categorias.nombre(gasto.categoria_id)
         gastos_procesados.append(
             {
                 'fecha': gasto.fecha,
                 'descripcion': gasto.descripcion,
                 'monto_total': gasto.monto_total,
-                'parte_sara': parte_sara,
-                'parte_adri': parte_adri,
-                'pagado_por': gasto.pagado_por.username,
+                # Reparto proporcional independientemente de quién paga
+                'parte_sara': gasto.monto_total * PORCENTAJE_SARA,
+                'parte_adri': gasto.monto_total * PORCENTAJE_ADRI,
+                # Los gastos de un fondo común salen de la cuenta conjunta
+                'pagado_por': 'Cuenta común' if gasto.fondo_id else gasto.pagado_por.username,
                 'categoria': categoria_nombre,
                 'color_clase': CATEGORIA_COLORES.get(categoria_nombre, ''),
             }
         )
 
-    # Construir selectores para filtros (años, meses y categorías)
-    today = now().date()
-    years = list(range(today.year, today.year - 5, -1))
-    months = [
-        (1, 'Enero'), (2, 'Febrero'), (3, 'Marzo'), (4, 'Abril'),
-        (5, 'Mayo'), (6, 'Junio'), (7, 'Julio'), (8, 'Agosto'),
-        (9, 'Septiembre'), (10, 'Octubre'), (11, 'Noviembre'), (12, 'Diciembre'),
-    ]
-    categorias_filtro = Gasto.CATEGORIAS  # Lista de tuplas (código, nombre)
-
-     # Paginador: 10 gastos por página
-    page_number = request.GET.get('page', 1)
-    paginator = Paginator(gastos_procesados, 10)
-    page_obj = paginator.get_page(page_number)
-
     context = {
         'gastos': gastos_procesados,
         'deuda_total': deuda_total,
@@ -497,16 +552,57 @@ def panel_gastos(request):
         'cat': cat_filter,
         'year': year_filter,
         'month': month_filter,
-        'page_obj': page_obj,
-        'paginator': paginator,
-        'is_paginated': paginator.num_pages > 1,
+        'pagina': pagina,
+        'filtros_query': filtros_query,
+        'is_paginated': pagina.is_paginated,
     }
     return render(request, 'core/panel_gastos.html', context)
 
 
+def _periodo_solicitado(request):
+    """Devuelve el intervalo ``[desde, hasta)`` pedido en la URL.
+
+    Admite ``?desde=AAAA-MM-DD&hasta=AAAA-MM-DD`` o ``?year=&month=``; si no
+    se indica nada (o los valores no son válidos) se usa el mes actual.
+    """
+    try:
+        desde = datetime.date.fromisoformat(request.GET['desde'])
+        hasta = request.GET.get('hasta')
+        return desde, datetime.date.fromisoformat(hasta) if hasta else None
+    except (KeyError, ValueError):
+        pass
+    hoy = datetime.date.today()
+    try:
+        return rango_mes(int(request.GET.get('year', hoy.year)), int(request.GET.get('month', hoy.month)))
+    except ValueError:
+        return rango_mes(hoy.year, hoy.month)
+
+
+def _contexto_panel_fondos(desde, hasta, hoy):
+    fondos = list(FondoComun.objects.all())
+    # Aportaciones del periodo para cada fondo y cada usuaria en una única
+    # consulta agrupada
+    aportaciones = aportaciones_por_fondo(fondos, desde, hasta)
+    # Calcular saldo total en todos los fondos
+    saldo_total = sum(f.saldo for f in fondos)
+    # Intervalos que ofrece el gráfico de evolución de los saldos
+    rangos_historial = [
+        (hoy - datetime.timedelta(days=dias), etiqueta)
+        for dias, etiqueta in ((91, 'Últimos 3 meses'), (365, 'Último año'), (5 * 365, 'Últimos 5 años'))
+    ]
+    return {
+        'fondos': fondos,
+        'aportaciones': aportaciones,
+        'saldo_total': saldo_total,
+        'desde': desde,
+        'hasta': hasta,
+        'rangos_historial': rangos_historial,
+    }
+
+
 @login_required
 def panel_fondos(request):
-    aplicar_gastos_recurrentes_y_objetivos()
+    asegurar_periodo_aplicado()
     """
     Muestra el panel de fondos comunes.
 
@@ -516,60 +612,65 @@ def panel_fondos(request):
     distintos meses y crear o eliminar aportaciones sin tener que tocar el
     código.
     """
-    fondos = FondoComun.objects.all()
-    # Fecha del primer día del mes actual para filtrar ingresos
-    primer_dia_mes = datetime.date.today().replace(day=1)
-    # Calculamos las aportaciones del mes para cada fondo y cada usuaria
-    aportaciones = {}
-    for fondo in fondos:
-        # Ingresos del mes para este fondo
-        ingresos_mes = IngresoFondo.objects.filter(fondo=fondo, fecha__gte=primer_dia_mes)
-        total = ingresos_mes.aggregate(suma=Sum('cantidad'))['suma'] or Decimal('0')
-        # Suma por usuaria
-        sara_total = ingresos_mes.filter(usuario__username='sara').aggregate(suma=Sum('cantidad'))['suma'] or Decimal('0')
-        adri_total = ingresos_mes.filter(usuario__username='adri').aggregate(suma=Sum('cantidad'))['suma'] or Decimal('0')
-        # Guardamos usando el id del fondo para poder acceder fácilmente desde la plantilla
-        aportaciones[fondo.id] = {
-            'total': total.quantize(Decimal('0.01')),
-            'sara': sara_total.quantize(Decimal('0.01')),
-            'adri': adri_total.quantize(Decimal('0.01')),
-        }
-    # Calcular saldo total en todos los fondos
-    saldo_total = sum(f.saldo for f in fondos)
-    context = {
-        'fondos': fondos,
-        'aportaciones': aportaciones,
-        'saldo_total': saldo_total,
-    }
+    # Periodo de las aportaciones: el mes actual salvo que se pida otro mes
+    # (?year=&month=) o un intervalo (?desde=&hasta=, con hasta excluido)
+    desde, hasta = _periodo_solicitado(request)
+    hoy = datetime.date.today()
+    # El contexto se guarda en la caché hasta el próximo cambio de los datos
+    context = paneles.contexto(
+        'panel_fondos', f'{hoy}:{desde}:{hasta}', lambda: _contexto_panel_fondos(desde, hasta, hoy)
+    )
     return render(request, 'core/panel_fondos.html', context)
 
 
 @login_required
-def resumen_finanzas(request):
-    """Vista de resumen financiero con gráficos mensuales y por categoría.
-
-    Prepara datos agregados para representar los gastos de los últimos meses
-    y del mes actual desglosados por categoría. Los datos se serializan a
-    JSON para que puedan ser consumidos por Chart.js en la plantilla."""
+def historial_fondos(request):
+    """Evolución del saldo de cada fondo en JSON para el gráfico del panel.
 
+    Admite ``?desde=AAAA-MM-DD&hasta=AAAA-MM-DD`` (con ``hasta`` excluido;
+    por defecto, el último año) y ``?granularidad=dia|semana|mes``, que si
+    no se indica depende de la longitud del intervalo. Cada fondo trae sus
+    puntos ``[periodo, saldo]`` solo en los periodos en que cambió el saldo.
+    """
     hoy = datetime.date.today()
+    try:
+        hasta = datetime.date.fromisoformat(request.GET.get('hasta') or (hoy + datetime.timedelta(days=1)).isoformat())
+        desde = datetime.date.fromisoformat(request.GET.get('desde') or (hasta - datetime.timedelta(days=365)).isoformat())
+    except ValueError:
+        return JsonResponse({'error': 'Fechas no válidas (AAAA-MM-DD)'}, status=400)
+    if desde >= hasta:
+        return JsonResponse({'error': 'desde debe ser anterior a hasta'}, status=400)
+    granularidad = request.GET.get('granularidad') or granularidad_para(desde, hasta)
+    if granularidad not in GRANULARIDADES:
+        return JsonResponse({'error': f'Granularidad no válida: {granularidad}'}, status=400)
+
+    puntos = {}
+    for fila in historial_saldos(desde, hasta, granularidad):
+        # SQLite suma los decimales como coma flotante
+        saldo = Decimal(fila['saldo']).quantize(Decimal('0.01'))
+        puntos.setdefault(fila['fondo_id'], []).append([fila['periodo'].isoformat(), float(saldo)])
+    fondos = [
+        {'id': fondo.id, 'nombre': fondo.get_tipo_display(), 'puntos': puntos.get(fondo.id, [])}
+        for fondo in FondoComun.objects.all()
+    ]
+    return JsonResponse({
+        'granularidad': granularidad,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'fondos': fondos,
+    })
+
+
+def _contexto_resumen(hoy):
     inicio_mes = hoy.replace(day=1)
 
-    # Totales por categoría en el mes actual (agrupar por nombre legible)
-    gastos_categoria = (
-        Gasto.objects
-        .filter(fecha__gte=inicio_mes, fecha__lte=hoy)
-        .values('categoria')
-        .annotate(total=Sum('monto_total'))
-    )
-    categorias_dict = dict(Gasto.CATEGORIAS)
-    totales_por_categoria = {}
-    for item in gastos_categoria:
-        codigo = item['categoria']
-        nombre = categorias_dict.get(codigo, codigo)
-        total = item['total'] or Decimal('0')
-        # Suma al total existente si el nombre ya se ha añadido
-        totales_por_categoria[nombre] = totales_por_categoria.get(nombre, Decimal('0')) + total
+    # Totales por categoría en el mes actual, con el nombre legible.
+    # Se leen de la tabla agregada ``ResumenMensual``, no de ``Gasto``; solo
+    # los gastos con fecha posterior a hoy se consultan para restarlos.
+    totales_por_categoria = {
+        categorias.nombre(categoria_id): total
+        for categoria_id, total in resumen.totales_por_categoria(hoy.year, hoy.month, hoy).items()
+    }
 
     # Preparar datos para el gráfico y la tabla
     labels_categoria = list(totales_por_categoria.keys())
@@ -585,44 +686,25 @@ def resumen_finanzas(request):
     # "Supermercado" para el mes actual ===
     # Muchos gastos se clasifican bajo la categoría "Supermercado", pero
     # queremos saber cuánto se ha gastado en cada tienda específica (Eroski,
-    # Mercadona, Gadis, etc.).  Agrupamos las descripciones de los gastos
-    # (insensibles a mayúsculas/minúsculas) y sumamos el monto total por cada
-    # una.  Se contempla que la categoría pueda almacenarse como código ('1')
-    # o como nombre legible ('Supermercado').
-    gastos_supermercado = (
-        Gasto.objects
-        .filter(fecha__gte=inicio_mes, fecha__lte=hoy)
-        .filter(Q(categoria='1') | Q(categoria__iexact='Supermercado'))
-    )
-    totales_por_super = {}
-    for gasto in gastos_supermercado:
-        # Normalizamos la descripción para agrupar tiendas iguales con distinta
-        # capitalización.  Usamos strip() para eliminar espacios al inicio y
-        # al final, y title() para poner la primera letra en mayúscula.
-        desc = gasto.descripcion.strip().title()
-        totales_por_super[desc] = totales_por_super.get(desc, Decimal('0')) + gasto.monto_total
+    # Mercadona, Gadis, etc.).  Los gastos guardan la descripción normalizada
+    # en ``comercio_normalizado``, así que la base de datos agrupa y suma
+    # por tienda en una sola consulta.
+    totales_por_super = dict(totales_por_comercio(inicio_mes, hoy + datetime.timedelta(days=1)))
     labels_super = list(totales_por_super.keys())
     data_super = [float(totales_por_super[nombre]) for nombre in labels_super]
 
 
-    # Totales mensuales de los últimos seis meses (sin cambios)
-    seis_meses_atras = hoy - datetime.timedelta(days=180)
-    gastos_mes = (
-        Gasto.objects
-        .filter(fecha__gte=seis_meses_atras, fecha__lte=hoy)
-        .annotate(mes=TruncMonth('fecha'))
-        .values('mes')
-        .annotate(total=Sum('monto_total'))
-        .order_by('mes')
-    )
+    # Totales mensuales de los últimos seis meses (incluido el actual),
+    # también desde la tabla agregada
+    total_meses = hoy.year * 12 + hoy.month - 1 - 5
+    hace_seis_meses = (total_meses // 12, total_meses % 12 + 1)
     labels_mes = []
     data_mes = []
-    for item in gastos_mes:
-        mes_date = item['mes']
-        labels_mes.append(mes_date.strftime('%b %Y'))
-        data_mes.append(float(item['total']))
+    for (ano, mes), total in resumen.totales_por_mes(hace_seis_meses, (hoy.year, hoy.month), hoy):
+        labels_mes.append(datetime.date(ano, mes, 1).strftime('%b %Y'))
+        data_mes.append(float(total))
 
-    context = {
+    return {
         'labels_categoria': json.dumps(labels_categoria),
         'data_categoria': json.dumps(data_categoria),
         'labels_mes': json.dumps(labels_mes),
@@ -632,6 +714,19 @@ def resumen_finanzas(request):
         'labels_super': json.dumps(labels_super),
         'data_super': json.dumps(data_super),
     }
+
+
+@login_required
+def resumen_finanzas(request):
+    """Vista de resumen financiero con gráficos mensuales y por categoría.
+
+    Prepara datos agregados para representar los gastos de los últimos meses
+    y del mes actual desglosados por categoría. Los datos se serializan a
+    JSON para que puedan ser consumidos por Chart.js en la plantilla.
+    El contexto se guarda en la caché hasta el próximo cambio de los datos
+    (ver ``core.paneles``)."""
+    hoy = datetime.date.today()
+    context = paneles.contexto('resumen', hoy.isoformat(), lambda: _contexto_resumen(hoy))
     return render(request, 'core/resumen.html', context)
 
 @login_required
@@ -641,8 +736,7 @@ def actualizar_fondo(request, fondo_id: int):
         try:
             fondo = FondoComun.objects.get(id=fondo_id)
             nuevo_saldo = Decimal(request.POST.get('saldo', '0'))
-            fondo.saldo = nuevo_saldo
-            fondo.save()
+            fijar_saldo(fondo.id, nuevo_saldo)
             return JsonResponse({'success': True, 'nuevo_saldo': float(nuevo_saldo)})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=400)
@@ -41,14 +41,35 @@ MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     # WhiteNoise permite servir archivos estáticos en producción
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Métricas de las peticiones para /metrics (sin contar los estáticos)
+    "core.middleware.MetricasMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Perfil de CPU de las peticiones con ?perfilar=1 (solo personal)
+    "core.middleware.PerfiladoMiddleware",
+    # Debe ser el último (mide la vista); solo actúa con MEDIR_PETICIONES
+    "core.middleware.MedicionPeticionesMiddleware",
 ]
 
+# Medición de las peticiones (consultas SQL, vista y plantillas) en la
+# cabecera Server-Timing y log de las lentas; ver ``core.middleware``
+MEDIR_PETICIONES = os.environ.get("DJANGO_MEDIR_PETICIONES", "False") == "True"
+# Las peticiones que tardan al menos estos milisegundos se registran en el log
+PETICION_LENTA_MS = int(os.environ.get("DJANGO_PETICION_LENTA_MS", "500"))
+# Directorio de los perfiles de CPU pedidos por el personal; ver ``core.perfilado``
+PERFILES_DIR = os.environ.get("DJANGO_PERFILES_DIR", str(BASE_DIR / "perfiles"))
+# Métricas en formato Prometheus en /metrics; ver ``core.metricas``
+METRICAS = os.environ.get("DJANGO_METRICAS", "True") == "True"
+# Directorio compartido por los procesos de gunicorn para sumar sus métricas
+METRICAS_DIR = os.environ.get("DJANGO_METRICAS_DIR") or None
+# Token con el que Prometheus puede leer /metrics (Authorization: Bearer <token>);
+# sin él, solo el personal identificado
+METRICAS_TOKEN = os.environ.get("DJANGO_METRICAS_TOKEN", "")
+
 # URL raíz
 ROOT_URLCONF = "gastos_project.urls"
 
@@ -120,6 +141,34 @@ else:
         }
     }
 
+# Caché (contextos de los paneles, próxima ocurrencia de los recurrentes): en
+# memoria de cada proceso por defecto. Con DJANGO_CACHE=archivos (en
+# DJANGO_CACHE_DIR) o DJANGO_CACHE=bd (tabla creada con createcachetable) la
+# comparten todos los procesos de gunicorn. Ambas entradas, como las copias
+# en memoria, llevan en la clave una versión guardada en la base de datos
+# (core.versiones), así que no hace falta compartirla para que los procesos
+# vean los cambios; solo evita que cada uno repita el cálculo.
+CACHE_BACKEND = os.environ.get("DJANGO_CACHE", "memoria")
+if CACHE_BACKEND == "archivos":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("DJANGO_CACHE_DIR", str(BASE_DIR / "cache")),
+        }
+    }
+elif CACHE_BACKEND == "bd":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "cache_gastos",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
 
 
 # Validadores de contraseña